@@ -0,0 +1,56 @@
+"""Store days and times as integers on sqlite (day numbers, seconds since midnight) instead of TEXT.
+
+Revision ID: 436a561180ec
+Revises: 61f79e04819a
+Create Date: 2026-10-18 14:03:27.118604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '436a561180ec'
+down_revision = '61f79e04819a'
+branch_labels = None
+depends_on = None
+
+# see dr_schema.DayNumber / SecondsTime : date.toordinal() of 'YYYY-MM-DD' (julianday of 0001-01-01 is 1721425.5), & seconds of 'HH:MM:SS[.ffffff]'
+TO_DAY_NUMBER = "CAST(julianday({col}) - 1721424.5 AS INTEGER)"
+TO_SECONDS = "CAST(substr({col}, 1, 2) AS INTEGER) * 3600 + CAST(substr({col}, 4, 2) AS INTEGER) * 60 + CAST(substr({col}, 7, 2) AS INTEGER)"
+FROM_DAY_NUMBER = "date({col} + 1721424.5)"
+FROM_SECONDS = "CASE WHEN {col} IS NULL THEN NULL ELSE printf('%02d:%02d:%02d.000000', {col} / 3600, {col} / 60 % 60, {col} % 60) END"
+
+
+# triggers on act_recs the app created, if it connected to the db before its upgrade : batch mode can't rename the copy with them
+# (9c3e5b7a1f2d creates them again)
+SEARCH_TRIGGERS = ['act_search_rec_insert', 'act_search_rec_update', 'act_search_rec_delete',
+                   'act_search_cat_insert', 'act_search_cat_update', 'act_search_cat_delete']
+
+
+def upgrade():
+    for _trigger in SEARCH_TRIGGERS:
+        op.execute("DROP TRIGGER IF EXISTS %s" % _trigger)
+    # values first (while the columns still have TEXT / NUMERIC affinity), then the columns' types (tables are copied by batch mode)
+    op.execute("UPDATE act_recs SET day = %s, startt = %s, endt = %s" % (TO_DAY_NUMBER.format(col='day'), TO_SECONDS.format(col='startt'),
+                                                                         TO_SECONDS.format(col='endt')))
+    op.execute("UPDATE act_rollups SET day = %s" % TO_DAY_NUMBER.format(col='day'))
+    with op.batch_alter_table('act_recs', recreate='always') as batch_op:
+        batch_op.alter_column('day', type_=sa.Integer(), existing_nullable=True)
+        batch_op.alter_column('startt', type_=sa.Integer(), existing_nullable=True)
+        batch_op.alter_column('endt', type_=sa.Integer(), existing_nullable=True)
+    with op.batch_alter_table('act_rollups', recreate='always') as batch_op:
+        batch_op.alter_column('day', type_=sa.Integer(), existing_nullable=False)
+
+
+def downgrade():
+    # columns' types first (batch mode CASTs the integers), then values : as CAST of a 'YYYY-MM-DD' string to DATE would give YYYY
+    with op.batch_alter_table('act_recs', recreate='always') as batch_op:
+        batch_op.alter_column('day', type_=sa.Date(), existing_nullable=True)
+        batch_op.alter_column('startt', type_=sa.Text(), existing_nullable=True)  # as TIME used to be compiled for sqlite
+        batch_op.alter_column('endt', type_=sa.Text(), existing_nullable=True)
+    with op.batch_alter_table('act_rollups', recreate='always') as batch_op:
+        batch_op.alter_column('day', type_=sa.Date(), existing_nullable=False)
+    op.execute("UPDATE act_recs SET day = %s, startt = %s, endt = %s" % (FROM_DAY_NUMBER.format(col='day'), FROM_SECONDS.format(col='startt'),
+                                                                         FROM_SECONDS.format(col='endt')))
+    op.execute("UPDATE act_rollups SET day = %s" % FROM_DAY_NUMBER.format(col='day'))
@@ -0,0 +1,50 @@
+"""Add act_rollups daily totals table, populated from act_recs.
+
+Revision ID: 61f79e04819a
+Revises: 2b8dfc406f65
+Create Date: 2026-10-18 10:12:41.530218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '61f79e04819a'
+down_revision = '2b8dfc406f65'
+branch_labels = None
+depends_on = None
+
+# minutes since midnight of a TIME stored by sqlite as TEXT ('HH:MM:SS.ffffff')
+START_MIN = "CAST(substr(startt, 1, 2) AS INTEGER) * 60 + CAST(substr(startt, 4, 2) AS INTEGER)"
+END_MIN = "CAST(substr(endt, 1, 2) AS INTEGER) * 60 + CAST(substr(endt, 4, 2) AS INTEGER)"
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table('act_rollups'):  # the app creates it (empty) too, on connecting to a db without it
+        op.execute("DELETE FROM act_rollups")
+    else:
+        op.create_table('act_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('a_done', sa.String(length=40), nullable=False),
+        sa.Column('minutes', sa.Integer(), nullable=False),
+        sa.Column('rec_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'a_done')
+        )
+    # same totals as dr_bll.rebuild_rollups, in sql (sqlite) : intervals crossing midnight add their minutes after it to the next day ;
+    # records without a day (or a time) have no rollups
+    op.execute(f"""
+        INSERT INTO act_rollups (day, a_done, minutes, rec_count)
+        SELECT day, a_done, SUM(minutes), SUM(rec_count) FROM (
+            SELECT day, a_done, CASE WHEN end_min >= start_min THEN end_min - start_min ELSE 1440 - start_min END AS minutes, 1 AS rec_count
+            FROM (SELECT day, a_done, {START_MIN} AS start_min, {END_MIN} AS end_min FROM act_recs WHERE day IS NOT NULL AND startt IS NOT NULL AND endt IS NOT NULL)
+            UNION ALL
+            SELECT date(day, '+1 day'), a_done, end_min, 0
+            FROM (SELECT day, a_done, {START_MIN} AS start_min, {END_MIN} AS end_min FROM act_recs WHERE day IS NOT NULL AND startt IS NOT NULL AND endt IS NOT NULL)
+            WHERE end_min < start_min AND end_min > 0
+        ) GROUP BY day, a_done
+    """)
+
+
+def downgrade():
+    op.drop_table('act_rollups')
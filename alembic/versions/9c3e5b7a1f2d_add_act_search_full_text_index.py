@@ -0,0 +1,58 @@
+"""Add act_search : FTS5 full-text index (sqlite) over records' a_done, comments & category, kept up to date by triggers.
+
+Revision ID: 9c3e5b7a1f2d
+Revises: 436a561180ec
+Create Date: 2026-10-18 16:21:05.402113
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3e5b7a1f2d'
+down_revision = '436a561180ec'
+branch_labels = None
+depends_on = None
+
+# as dr_schema.SEARCH_DDL at this revision (IF NOT EXISTS : the app creates the index too, on connecting to a db without it)
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS act_search USING fts5(a_done, comments, a_cat, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS act_search_rec_insert AFTER INSERT ON act_recs BEGIN "
+    "INSERT INTO act_search (rowid, a_done, comments, a_cat) VALUES (new.a_id, new.a_done, new.comments, "
+    "(SELECT a_cat FROM act_cats WHERE a_done = new.a_done)); END",
+    "CREATE TRIGGER IF NOT EXISTS act_search_rec_update AFTER UPDATE OF a_id, a_done, comments ON act_recs BEGIN "
+    "DELETE FROM act_search WHERE rowid = old.a_id; "
+    "INSERT INTO act_search (rowid, a_done, comments, a_cat) VALUES (new.a_id, new.a_done, new.comments, "
+    "(SELECT a_cat FROM act_cats WHERE a_done = new.a_done)); END",
+    "CREATE TRIGGER IF NOT EXISTS act_search_rec_delete AFTER DELETE ON act_recs BEGIN "
+    "DELETE FROM act_search WHERE rowid = old.a_id; END",
+    "CREATE TRIGGER IF NOT EXISTS act_search_cat_insert AFTER INSERT ON act_cats BEGIN "
+    "UPDATE act_search SET a_cat = new.a_cat WHERE rowid IN (SELECT a_id FROM act_recs WHERE a_done = new.a_done); END",
+    "CREATE TRIGGER IF NOT EXISTS act_search_cat_update AFTER UPDATE OF a_done, a_cat ON act_cats BEGIN "
+    "UPDATE act_search SET a_cat = NULL WHERE rowid IN (SELECT a_id FROM act_recs WHERE a_done = old.a_done); "
+    "UPDATE act_search SET a_cat = new.a_cat WHERE rowid IN (SELECT a_id FROM act_recs WHERE a_done = new.a_done); END",
+    "CREATE TRIGGER IF NOT EXISTS act_search_cat_delete AFTER DELETE ON act_cats BEGIN "
+    "UPDATE act_search SET a_cat = NULL WHERE rowid IN (SELECT a_id FROM act_recs WHERE a_done = old.a_done); END",
+]
+TRIGGERS = ['act_search_rec_insert', 'act_search_rec_update', 'act_search_rec_delete',
+            'act_search_cat_insert', 'act_search_cat_update', 'act_search_cat_delete']
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':  # FTS5 is sqlite's ; bll.search_acts falls back to LIKE elsewhere
+        return
+    for _ddl in SEARCH_DDL:
+        op.execute(_ddl)
+    # (re-)index all records, with their category
+    op.execute("DELETE FROM act_search")
+    op.execute("INSERT INTO act_search (rowid, a_done, comments, a_cat) "
+               "SELECT act_recs.a_id, act_recs.a_done, act_recs.comments, act_cats.a_cat FROM act_recs "
+               "LEFT OUTER JOIN act_cats ON act_cats.a_done = act_recs.a_done")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for _trigger in TRIGGERS:
+        op.execute("DROP TRIGGER IF EXISTS %s" % _trigger)
+    op.execute("DROP TABLE IF EXISTS act_search")
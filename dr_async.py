@@ -0,0 +1,153 @@
+"""
+Asyncio access to the activity log, for a service with several concurrent clients (recorders).
+Reads run concurrently, each on its own pooled connection ; writes are queued to 1 writer task, so they are serialized
+(sqlite allows 1 writer at a time) rather than failing on 'database is locked'.
+The bll functions are reused as they are, run on the async session's underlying Session (AsyncSession.run_sync)
+"""
+
+import asyncio
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+
+import dr_schema as s
+import dr_bll as bl
+
+
+# ====== CONSTANTS =================================================================================
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+WRITE_QUEUE_SIZE = 1000  # writes waiting for the writer task, before write() waits too
+
+# ===================================================================================================
+
+
+def async_url(db_url):
+    """ db_url with its async driver, eg sqlite:///x.db -> sqlite+aiosqlite:///x.db """
+    dialect, sep, rest = db_url.partition('://')
+    return ASYNC_DRIVERS.get(dialect, dialect) + sep + rest
+
+
+class AsyncDataAccessLayer:
+    """
+    asyncio counterpart of s.DataAccessLayer (same db urls, FK_on & profile).
+    Usage:
+        adal = AsyncDataAccessLayer(db_url)
+        await adal.connect()
+        names = await adal.read(bl.search_names, s.ActvtyRec.a_done, 'yoga')  # any fn(session, *args)
+        await adal.write(bl.collapse_acts, ['yoga 1'], 'yoga')  # committed once it returns
+        await adal.close()
+    An in-memory db has 1 connection only, so its reads are queued to the writer too.
+    """
+
+    def __init__(self, db_url='some conn string', FK_on=s.FK_ON, profile=s.DB_PROFILE):
+        if profile not in s.SQLITE_PROFILES:
+            raise ValueError("Unknown profile : %s (use one of %s)" % (profile, tuple(s.SQLITE_PROFILES)))
+        self.db_url = db_url
+        self.FK_on = FK_on
+        self.profile = profile
+        self.engine = None
+        self.Session = None
+        self.parallel_reads = not s.is_memory_url(db_url)
+        self._writes = None
+        self._writer = None
+
+    @property
+    def is_sqlite(self):
+        return self.db_url.startswith('sqlite')
+
+    async def connect(self):
+        """ creates the engine (pragmas set per new connection, as s.get_engine), the tables if missing, & starts the writer task """
+        if not self.is_sqlite:
+            self.engine = create_async_engine(async_url(self.db_url), pool_pre_ping=True, pool_size=s.POOL_SIZE, max_overflow=s.POOL_MAX_OVERFLOW)
+        else:
+            pool_kw = {'poolclass': StaticPool} if s.is_memory_url(self.db_url) else {'poolclass': AsyncAdaptedQueuePool, 'pool_size': s.POOL_SIZE,
+                                                                                    'max_overflow': s.POOL_MAX_OVERFLOW}
+            self.engine = create_async_engine(async_url(self.db_url), query_cache_size=s.QUERY_CACHE_SIZE, **pool_kw)
+            pragmas = s.sqlite_pragmas(self.FK_on, self.profile)
+
+            @event.listens_for(self.engine.sync_engine, 'connect')
+            def _on_connect(dbapi_conn, conn_record):
+                cursor = dbapi_conn.cursor()
+                for pragma, value in pragmas:
+                    cursor.execute('pragma %s=%s' % (pragma, value))
+                cursor.close()
+
+        async with self.engine.begin() as conn:
+            await conn.run_sync(s.Base.metadata.create_all, checkfirst=True)
+        self.Session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self._writes = asyncio.Queue(WRITE_QUEUE_SIZE)
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        while True:
+            job = await self._writes.get()
+            if job is None:
+                break
+            fn, args, kwargs, commit, future = job
+            try:
+                async with self.Session() as session:
+                    result = await session.run_sync(fn, *args, **kwargs)
+                    if commit:
+                        await session.commit()
+            except Exception as exc_:  # rolled back on leaving the session ; the caller gets the exception
+                if not future.cancelled():
+                    # without this task's frames : a caller clearing the traceback's frames (eg unittest's assertRaises) would close it
+                    future.set_exception(exc_.with_traceback(None))
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+
+    async def _queue(self, fn, args, kwargs, commit):
+        future = asyncio.get_running_loop().create_future()
+        await self._writes.put((fn, args, kwargs, commit, future))
+        return await future
+
+    async def write(self, fn, *args, **kwargs):
+        """ runs fn(session, *args, **kwargs) in the writer task & commits ; returns fn's result once committed (or raises, rolled back) """
+        return await self._queue(fn, args, kwargs, True)
+
+    async def read(self, fn, *args, **kwargs):
+        """ runs fn(session, *args, **kwargs) on a session of its own (nothing committed) ; returns fn's result """
+        if not self.parallel_reads:
+            return await self._queue(fn, args, kwargs, False)
+        async with self.Session() as session:
+            return await session.run_sync(fn, *args, **kwargs)
+
+    async def close(self):
+        """ waits for queued writes, stops the writer task & closes all connections """
+        if self._writer is not None:
+            await self._writes.put(None)
+            await self._writer
+            self._writer = None
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = self.Session = None
+
+
+# ====== OPERATIONS ================================================================================
+# async versions of the bll operations used by recorders
+
+def _record_act(session, day, startt, endt, a_done, comments=None):
+    rec = s.ActvtyRec(day=day, startt=startt, endt=endt, a_done=a_done)
+    if comments is not None:
+        rec.comments = comments
+    session.add(rec)
+    session.flush()
+    return rec.a_id
+
+
+async def record_act(adal, day, startt, endt, a_done, comments=None):
+    """ records 1 activity (committed) ; returns its a_id """
+    return await adal.write(_record_act, day, startt, endt, a_done, comments)
+
+
+async def search_names(adal, column_obj, keyedin_, limit=None):
+    """ as bl.search_names : [(name, count)] of column_obj containing keyedin_ """
+    return await adal.read(bl.search_names, column_obj, keyedin_, limit)
+
+
+async def collapse_acts(adal, act_list, updated_actvty_name, bulk=True):
+    """ as bl.collapse_acts, but committed ; returns (num_concated, num_replaced) """
+    return await adal.write(bl.collapse_acts, act_list, updated_actvty_name, bulk)
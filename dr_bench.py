@@ -0,0 +1,1047 @@
+"""
+Benchmarks for the data path : run as a script, eg
+    python dr_bench.py search_names
+    python dr_bench.py suite 1m              # times the hot paths on 1M zipfian records, saved to bench_results/1m-<commit>.json
+    python dr_bench.py compare old.json new.json
+Each benchmark builds its own synthetic db (in a temp dir), so never touches day_record.db
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import platform
+import itertools
+import subprocess
+import tempfile
+import asyncio
+import threading
+import datetime as dt
+from collections import Counter
+from contextlib import contextmanager
+
+import sqlalchemy
+from sqlalchemy import event
+
+import dr_schema as s
+import dr_bll as bll
+
+
+# ====== CONSTANTS =================================================================================
+RECS_PER_DAY = 30  # synthetic records tile each day, so no overlaps / duplicate start times
+SEARCH_TERMS = ['a', 'yo', 'mail', 'zzz']
+ZIPF_S = 1.1  # exponent of the suite's activity distribution : a few activities make up most records, like a real log
+SUITE_SIZES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+SUITE_NAMES = 3000  # distinct activities in the suite's dbs
+RESULTS_DIR = 'bench_results'
+REGRESSION_RATIO = 1.2  # compare flags timings this much slower
+STARTUP_BUDGET_SECS = {'menu': 0.15, 'record': 0.75}  # longest dr_ui may take (best of runs) to show its menu / quick record 1 activity
+
+# ===================================================================================================
+
+
+def synthetic_names(n_names, seed=0):
+    """ returns n_names distinct activity names with their category, eg ('hatha yoga 7', 'sport') """
+    words = [('yoga', 'sport'), ('hatha yoga', 'sport'), ('run', 'sport'), ('email', 'work'), ('meeting', 'work'),
+             ('coding', 'work'), ('reading', 'leisure'), ('cooking', 'chores'), ('cleaning', 'chores'), ('sleep', 'rest')]
+    rnd = random.Random(seed)
+    return [("%s %d" % (words[i % len(words)][0], i), words[i % len(words)][1]) for i in rnd.sample(range(n_names), n_names)]
+
+
+def insert_recs(conn, rows):
+    """ inserts act_recs rows (dicts), keeping the daily rollups up to date as bll does for bulk writes """
+    conn.execute(s.ActvtyRec.__table__.insert(), rows)
+    bll.apply_rollup_deltas(conn, bll.rollup_deltas([(_r['day'], _r['startt'], _r['endt'], _r['a_done']) for _r in rows]))
+
+
+def zipf_cum_weights(n, zipf_s=ZIPF_S):
+    """ cumulative weights of ranks 1..n under a zipf distribution (weight of rank k ~ 1 / k ** zipf_s) """
+    return list(itertools.accumulate(1. / _k ** zipf_s for _k in range(1, n + 1)))
+
+
+def generate_db(dal, n_rows, n_names=300, seed=0, start_day=dt.date(2015, 1, 1), zipf_s=None):
+    """ fills dal's db with n_names act_cats and n_rows act_recs (RECS_PER_DAY contiguous records per day).
+    Activities are drawn uniformly, or zipf distributed if zipf_s (the first names returned being the most used)
+    """
+    rnd = random.Random(seed)
+    names = synthetic_names(n_names, seed)
+    cum_weights = zipf_cum_weights(n_names, zipf_s) if zipf_s else None
+    with dal.engine.begin() as conn:
+        conn.execute(s.ActvtyCat.__table__.insert(), [{'a_done': _n, 'a_cat': _c} for _n, _c in names])
+        for _from in range(0, n_rows, 10000):
+            _n = min(10000, n_rows - _from)
+            acts = rnd.choices(names, cum_weights=cum_weights, k=_n)
+            rows = []
+            for i, (_act, _cat) in zip(range(_from, _from + _n), acts):
+                day, slot = divmod(i, RECS_PER_DAY)
+                startm = slot * (1440 // RECS_PER_DAY)
+                endm = startm + rnd.randint(1, 1440 // RECS_PER_DAY - 1)
+                rows.append({'day': start_day + dt.timedelta(days=day),
+                             'startt': dt.time(startm // 60, startm % 60), 'endt': dt.time(endm // 60, endm % 60),
+                             'a_done': _act})
+            insert_recs(conn, rows)
+    return [_n for _n, _c in names]
+
+
+@contextmanager
+def temp_dal(n_rows, **gen_kw):
+    """ yields a connected DataAccessLayer (with an open session) on a fresh synthetic sqlite file """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, 'bench.db'))
+        dal.connect()
+        generate_db(dal, n_rows, **gen_kw)
+        dal.create_session()
+        try:
+            yield dal
+        finally:
+            dal.session.close()
+            dal.dispose()
+
+
+@contextmanager
+def count_queries(engine):
+    """ counts statements sent to the db : yields a dict whose 'n' gets updated """
+    counter = {'n': 0}
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        counter['n'] += 1
+    event.listen(engine, 'before_cursor_execute', _count)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', _count)
+
+
+def timed(fn, *args, repeat=3, **kwargs):
+    """ returns (best time in secs over repeat runs, last result) """
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+# ====== BENCHMARKS =================================================================================
+
+def _search_names_n_plus_1(session, column_obj, keyedin_):
+    # the pre-aggregation implementation of Task.prompt_for_name : 1 distinct query + 1 count query per name
+    distinct_stats = dict()
+    results = session.query(column_obj).filter(column_obj.like('%' + keyedin_ + '%'))
+    for _result in results.distinct():
+        distinct_stats[_result[0]] = results.filter(column_obj == _result[0]).count()
+    return sorted(distinct_stats.items(), key=lambda _nc: -_nc[1])
+
+
+def bench_search_names(sizes=(1000, 10000, 100000), n_names=300):
+    """ query count & latency of name search, N+1 count queries vs single GROUP BY query """
+    print("%8s %6s | %10s %10s | %10s %10s" % ('rows', 'term', 'n+1 qrys', 'n+1 ms', 'grp qrys', 'grp ms'))
+    for n_rows in sizes:
+        with temp_dal(n_rows, n_names=n_names) as dal:
+            for term in SEARCH_TERMS:
+                with count_queries(dal.engine) as old_q:
+                    old_t, _ = timed(_search_names_n_plus_1, dal.session, s.ActvtyRec.a_done, term, repeat=1)
+                with count_queries(dal.engine) as new_q:
+                    new_t, _ = timed(bll.search_names, dal.session, s.ActvtyRec.a_done, term, repeat=1)
+                print("%8d %6s | %10d %10.1f | %10d %10.1f" % (n_rows, term, old_q['n'], old_t * 1e3, new_q['n'], new_t * 1e3))
+
+
+def bench_name_index(n_rows=100000, n_names=(300, 3000, 30000), repeat=200):
+    """ load cost & lookup latency of bll.NameIndex vs the GROUP BY query """
+    print("%8s | %10s | %6s %10s %12s" % ('names', 'load ms', 'term', 'db us', 'index us'))
+    for _n_names in n_names:
+        with temp_dal(n_rows, n_names=_n_names) as dal:
+            load_t, name_index = timed(lambda: bll.NameIndex(s.ActvtyRec.a_done).load(dal.session), repeat=1)
+            for term in SEARCH_TERMS:
+                db_t, _ = timed(bll.search_names, dal.session, s.ActvtyRec.a_done, term, limit=20, repeat=5)
+                ix_t, _ = timed(name_index.search, term, limit=20, repeat=repeat)
+                print("%8d | %10.1f | %6s %10.0f %12.1f" % (_n_names, load_t * 1e3, term, db_t * 1e6, ix_t * 1e6))
+            name_index.close()
+
+
+def bench_collapse(sizes=(10000, 100000), n_names=300, share=0.2):
+    """ collapse_acts of the share least used names : ORM objects loop vs set-based UPDATE """
+    print("%8s %8s | %10s %10s" % ('rows', 'changed', 'orm ms', 'bulk ms'))
+    for n_rows in sizes:
+        times = dict()
+        for bulk in (False, True):
+            with temp_dal(n_rows, n_names=n_names) as dal:
+                name_counts = bll.search_names(dal.session, s.ActvtyRec.a_done, '')
+                act_list = [_n for _n, _c in name_counts[-int(len(name_counts) * share):]]
+                dal.session.add(s.ActvtyCat(a_done='collapsed', a_cat='misc'))
+                dal.session.flush()
+                t0 = time.perf_counter()
+                collapse_stats = bll.collapse_acts(dal.session, act_list, 'collapsed', bulk=bulk)
+                dal.session.flush()  # the ORM path only writes its changes here
+                times[bulk] = time.perf_counter() - t0
+        print("%8d %8d | %10.1f %10.1f" % (n_rows, sum(collapse_stats), times[False] * 1e3, times[True] * 1e3))
+
+
+def write_acts_csv(path, n_rows, n_names=300, seed=0):
+    """ writes a csv of n_rows synthetic records (as import_acts expects), with names not yet in any db """
+    rnd = random.Random(seed)
+    names = synthetic_names(n_names, seed)
+    with open(path, 'w') as csv_file:
+        csv_file.write("day,startt,endt,a_done,comments,a_cat\n")
+        for i in range(n_rows):
+            day, slot = divmod(i, RECS_PER_DAY)
+            startm = slot * (1440 // RECS_PER_DAY)
+            endm = startm + rnd.randint(1, 1440 // RECS_PER_DAY - 1)
+            a_done, a_cat = names[rnd.randrange(n_names)]
+            csv_file.write("%s,%02d:%02d,%02d:%02d,%s,,%s\n" % (dt.date(2015, 1, 1) + dt.timedelta(days=day),
+                                                                 startm // 60, startm % 60, endm // 60, endm % 60, a_done, a_cat))
+
+
+def bench_import(sizes=(10000, 100000, 1000000)):
+    """ throughput of bll.import_acts from csv (& parquet, if pyarrow is installed) into an empty db """
+    print("%8s %8s | %10s %12s" % ('rows', 'format', 'secs', 'rows/s'))
+    for n_rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = {'csv': os.path.join(tmp_dir, 'acts.csv')}
+            write_acts_csv(paths['csv'], n_rows)
+            try:
+                import pyarrow.csv
+                import pyarrow.parquet
+                paths['parquet'] = os.path.join(tmp_dir, 'acts.parquet')
+                pyarrow.parquet.write_table(pyarrow.csv.read_csv(paths['csv']), paths['parquet'])
+            except ImportError:
+                pass
+            for fmt, path in paths.items():
+                dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, fmt + '.db'))
+                dal.connect()
+                dal.create_session()
+                import_stats = bll.import_acts(dal.session, path)
+                dal.session.close()
+                dal.dispose()
+                print("%8d %8s | %10.2f %12.0f" % (n_rows, fmt, import_stats['secs'], import_stats['rows_per_sec']))
+
+
+def bench_export(sizes=(10000, 100000, 1000000)):
+    """ throughput & peak python memory of bll.export_acts (parquet & arrow) vs loading all records through the ORM """
+    import tracemalloc
+    print("%8s %8s | %10s %12s %10s" % ('rows', 'format', 'secs', 'rows/s', 'peak MB'))
+    for n_rows in sizes:
+        with temp_dal(n_rows) as dal, tempfile.TemporaryDirectory() as tmp_dir:
+            for fmt in ('parquet', 'arrow', 'orm'):
+                tracemalloc.start()
+                t0 = time.perf_counter()
+                if fmt == 'orm':
+                    num_rows = len(dal.session.query(s.ActvtyRec).all())
+                    dal.session.expunge_all()
+                else:
+                    num_rows = bll.export_acts(dal.session, os.path.join(tmp_dir, 'acts.' + fmt))['rows']
+                secs = time.perf_counter() - t0
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print("%8d %8s | %10.2f %12.0f %10.1f" % (num_rows, fmt, secs, num_rows / secs, peak / 2 ** 20))
+
+
+def _time_usage_orm(session):
+    # row by row baseline : 1 ORM object per record, summed in python
+    usage = dict()
+    for _rec in session.query(s.ActvtyRec):
+        _mins = (_rec.endt.hour * 60 + _rec.endt.minute) - (_rec.startt.hour * 60 + _rec.startt.minute)
+        _key = (_rec.day, _rec.category.a_cat if _rec.category else None)
+        usage[_key] = usage.get(_key, 0) + (_mins if _mins >= 0 else _mins + 1440)
+    return usage
+
+
+def bench_time_usage(years=(1, 5, 10)):
+    """ dr_report.time_usage over synthetic multi-year histories, vs a row by row ORM loop """
+    import dr_report as rep
+    print("%6s %8s | %10s | %10s %10s %10s %10s" % ('years', 'rows', 'orm ms', 'total ms', 'day ms', 'week ms', 'month ms'))
+    for _years in years:
+        n_rows = _years * 365 * RECS_PER_DAY
+        with temp_dal(n_rows) as dal:
+            orm_t, _ = timed(_time_usage_orm, dal.session, repeat=1)
+            dal.session.expunge_all()
+            rep_ts = [timed(rep.time_usage, dal.session, 'a_cat', _period, repeat=1)[0] for _period in (None,) + rep.PERIODS]
+            print("%6d %8d | %10.0f | %10.0f %10.0f %10.0f %10.0f" % ((_years, n_rows, orm_t * 1e3) + tuple(_t * 1e3 for _t in rep_ts)))
+
+
+def bench_rollups(years=(1, 5, 10)):
+    """ dr_report.time_usage per category over the whole history & over 1 month : from records vs from daily rollups """
+    import dr_report as rep
+    print("%6s %8s | %12s %12s | %12s %12s" % ('years', 'rows', 'all recs ms', 'all rolls ms', 'month recs ms', 'month rolls ms'))
+    for _years in years:
+        n_rows = _years * 365 * RECS_PER_DAY
+        with temp_dal(n_rows) as dal:
+            month = (dt.date(2015, 6, 1), dt.date(2015, 6, 30))
+            ts = [timed(rep.time_usage, dal.session, 'a_cat', None, *_range, use_rollups=_use, repeat=3)[0]
+                  for _range in ((None, None), month) for _use in (False, True)]
+            print("%6d %8d | %12.1f %12.1f | %12.1f %12.1f" % ((_years, n_rows) + tuple(_t * 1e3 for _t in ts)))
+
+
+def bench_time_storage(sizes=(100000, 1000000), repeat=5):
+    """ range scan & duration aggregation on act_recs-like sqlite tables, with days & times stored as TEXT (the old
+    compile_time_sqlite hack) vs as integers (s.DayNumber / s.SecondsTime). Raw sqlite3, to time the storage itself
+    """
+    import sqlite3
+    text_secs = "(CAST(substr({col}, 1, 2) AS INTEGER) * 3600 + CAST(substr({col}, 4, 2) AS INTEGER) * 60)"
+    queries = {'text': ("SELECT count(*) FROM recs WHERE day BETWEEN '2016-01-01' AND '2016-12-31' AND startt BETWEEN '08:00' AND '12:00'",
+                        "SELECT a_done, sum(%s - %s) FROM recs GROUP BY a_done" % (text_secs.format(col='endt'), text_secs.format(col='startt'))),
+               'int': ("SELECT count(*) FROM recs WHERE day BETWEEN %d AND %d AND startt BETWEEN 28800 AND 43200"
+                       % (dt.date(2016, 1, 1).toordinal(), dt.date(2016, 12, 31).toordinal()),
+                       "SELECT a_done, sum(endt - startt) FROM recs GROUP BY a_done")}
+    print("%8s %6s | %10s | %10s %10s" % ('rows', 'store', 'file MB', 'range ms', 'agg ms'))
+    for n_rows in sizes:
+        rnd = random.Random(0)
+        recs = []
+        for i in range(n_rows):
+            day, slot = divmod(i, RECS_PER_DAY)
+            startm = slot * (1440 // RECS_PER_DAY)
+            recs.append((dt.date(2015, 1, 1) + dt.timedelta(days=day), startm * 60, (startm + rnd.randint(1, 40)) * 60, 'act %d' % rnd.randrange(300)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for store, (range_q, agg_q) in queries.items():
+                path = os.path.join(tmp_dir, store + '.db')
+                conn = sqlite3.connect(path)
+                col_type = 'TEXT' if store == 'text' else 'INTEGER'
+                conn.execute("CREATE TABLE recs (a_id INTEGER PRIMARY KEY, day %s, startt %s, endt %s, a_done VARCHAR(40))" % ((col_type,) * 3))
+                conn.execute("CREATE INDEX ix_day ON recs (day)")
+                conn.execute("CREATE INDEX ix_startt ON recs (startt)")
+                if store == 'text':
+                    rows = [(_d.isoformat(), '%02d:%02d:00.000000' % divmod(_s // 60, 60), '%02d:%02d:00.000000' % divmod(_e // 60 % 1440, 60), _a)
+                            for _d, _s, _e, _a in recs]
+                else:
+                    rows = [(_d.toordinal(), _s, _e, _a) for _d, _s, _e, _a in recs]
+                conn.executemany("INSERT INTO recs (day, startt, endt, a_done) VALUES (?, ?, ?, ?)", rows)
+                conn.commit()
+                range_t, _ = timed(lambda: conn.execute(range_q).fetchall(), repeat=repeat)
+                agg_t, _ = timed(lambda: conn.execute(agg_q).fetchall(), repeat=repeat)
+                conn.close()
+                print("%8d %6s | %10.1f | %10.1f %10.1f" % (n_rows, store, os.path.getsize(path) / 2 ** 20, range_t * 1e3, agg_t * 1e3))
+
+
+def bench_overlaps(sizes=(10000, 100000, 1000000), repeat=100):
+    """ latency of the pre-insert overlap check (bll.find_overlaps) & time of the whole-history scan (bll.scan_overlaps) """
+    print("%8s | %12s | %10s" % ('rows', 'find us', 'scan ms'))
+    for n_rows in sizes:
+        with temp_dal(n_rows) as dal:
+            day = dt.date(2015, 1, 1) + dt.timedelta(days=n_rows // RECS_PER_DAY // 2)
+            find_t, _ = timed(bll.find_overlaps, dal.session, day, dt.time(10), dt.time(11), repeat=repeat)
+            scan_t, overlaps = timed(bll.scan_overlaps, dal.session, repeat=1)
+            print("%8d | %12.0f | %10.0f" % (n_rows, find_t * 1e6, scan_t * 1e3))
+
+
+def _task_uncached(db_url):
+    # the pre-caching DataAccessLayer, per task : new engine, schema check & pragma on a new session
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    engine = create_engine(db_url, pool_pre_ping=True)
+    s.Base.metadata.create_all(engine, checkfirst=True)
+    session = sessionmaker(bind=engine)()
+    session.execute('pragma foreign_keys=on')
+    session.query(s.ActvtyCat).count()
+    session.close()
+    engine.dispose()
+
+
+def _task_cached(db_url):
+    dal = s.DataAccessLayer(db_url)
+    dal.connect()
+    with dal.session_scope() as session:
+        session.query(s.ActvtyCat).count()
+
+
+def bench_dal(n_tasks=200):
+    """ n_tasks short tasks (connect, 1 query, close) on a file db : new engine per task vs cached engine & pool """
+    print("%8s | %10s %10s | %8s %10s %14s" % ('tasks', 'new ms', 'cached ms', 'connects', 'checkouts', 'schema checks'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url = 'sqlite:///' + os.path.join(tmp_dir, 'dal.db')
+        new_t, _ = timed(lambda: [_task_uncached(db_url) for _ in range(n_tasks)], repeat=1)
+        cached_t, _ = timed(lambda: [_task_cached(db_url) for _ in range(n_tasks)], repeat=1)
+        dal = s.DataAccessLayer(db_url)
+        print("%8d | %10.1f %10.1f | %8d %10d %14d" % (n_tasks, new_t * 1e3, cached_t * 1e3, dal.stats['connects'], dal.stats['checkouts'],
+                                                      dal.stats['schema_checks']))
+        dal.dispose()
+
+
+def _record_one(dal, day, minute, a_done):
+    # as RecordActivity : 1 record per session & commit
+    with dal.session_scope() as session:
+        session.add(s.ActvtyRec(day=day, startt=dt.time(minute // 60, minute % 60), endt=dt.time(minute // 60, minute % 60, 30),
+                                a_done=a_done))
+
+
+def bench_profiles(n_rows=10000, n_inserts=300, n_readers=4, read_secs=2.0):
+    """ per sqlite profile, on a file db : single-row insert latency (1 commit each), & read throughput of n_readers threads
+    searching names while a writer keeps committing
+    """
+    print("%8s | %10s %10s | %10s %10s %8s" % ('profile', 'ins p50 ms', 'ins p99 ms', 'reads/s', 'writes/s', 'errors'))
+    for profile in [_p for _p in s.SQLITE_PROFILES if _p != s.READ_ONLY_PROFILE]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, 'bench.db'), profile=profile)
+            dal.connect()
+            a_done = generate_db(dal, n_rows, n_names=300)[0]
+            day = dt.date(2030, 1, 1)
+            latencies = []
+            for _i in range(n_inserts):
+                _t = time.perf_counter()
+                _record_one(dal, day + dt.timedelta(days=_i // 1440), _i % 1440, a_done)
+                latencies.append(time.perf_counter() - _t)
+            latencies.sort()
+
+            stop, counts, errors = threading.Event(), Counter(), Counter()
+
+            def _reader():
+                while not stop.is_set():
+                    try:
+                        with dal.session_scope() as session:
+                            bll.search_names(session, s.ActvtyRec.a_done, 'yoga', limit=10)
+                        counts['reads'] += 1
+                    except Exception:
+                        errors['reads'] += 1
+
+            def _writer():
+                _i = 0
+                while not stop.is_set():
+                    try:
+                        _record_one(dal, day + dt.timedelta(days=100 + _i // 1440), _i % 1440, a_done)
+                        counts['writes'] += 1
+                    except Exception:
+                        errors['writes'] += 1
+                    _i += 1
+
+            threads = [threading.Thread(target=_reader) for _ in range(n_readers)] + [threading.Thread(target=_writer)]
+            for _th in threads:
+                _th.start()
+            time.sleep(read_secs)
+            stop.set()
+            for _th in threads:
+                _th.join()
+            print("%8s | %10.2f %10.2f | %10.0f %10.0f %8d" % (profile, latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3,
+                                                               counts['reads'] / read_secs, counts['writes'] / read_secs, sum(errors.values())))
+            dal.dispose()
+
+
+async def _async_load(db_url, names, n_clients, n_requests, write_share, seed=0):
+    import dr_async as da
+    adal = da.AsyncDataAccessLayer(db_url)
+    await adal.connect()
+    day = dt.date(2030, 1, 1)
+
+    async def _client(i_client):
+        rnd = random.Random(seed + i_client)
+        for _i in range(n_requests):
+            if rnd.random() < write_share:  # each client records on days of its own, so records never clash
+                _m = _i % 1440
+                await da.record_act(adal, day + dt.timedelta(days=i_client * 100 + _i // 1440), dt.time(_m // 60, _m % 60),
+                                    dt.time(_m // 60, _m % 60, 30), rnd.choice(names))
+            else:
+                await da.search_names(adal, s.ActvtyRec.a_done, rnd.choice(names)[:3], limit=10)
+
+    _t = time.perf_counter()
+    await asyncio.gather(*[_client(_i) for _i in range(n_clients)])
+    elapsed = time.perf_counter() - _t
+    await adal.close()
+    return elapsed
+
+
+def bench_async(n_rows=10000, clients=(1, 4, 16, 64), n_requests=100, write_share=0.2):
+    """ load test of dr_async on a file db : n_clients concurrent clients, each sending n_requests (searches, & write_share records) """
+    print("%8s | %10s | %10s" % ('clients', 'requests', 'req/s'))
+    for n_clients in clients:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_url = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+            dal = s.DataAccessLayer(db_url)
+            dal.connect()
+            names = generate_db(dal, n_rows, n_names=300)
+            dal.dispose()
+            elapsed = asyncio.run(_async_load(db_url, names, n_clients, n_requests, write_share))
+            print("%8d | %10d | %10.0f" % (n_clients, n_clients * n_requests, n_clients * n_requests / elapsed))
+
+
+def _post_acts(n_requests, port, i_client, names, latencies):
+    import json
+    import http.client
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    day = dt.date(2030, 1, 1) + dt.timedelta(days=i_client * 10)
+    for _i in range(n_requests):
+        act = {'day': str(day + dt.timedelta(days=_i // 1440)), 'startt': '%02d:%02d' % divmod(_i % 1440, 60),
+               'endt': '%02d:%02d:30' % divmod(_i % 1440, 60), 'a_done': names[_i % len(names)]}
+        _t = time.perf_counter()
+        conn.request('POST', '/acts', json.dumps(act).encode(), {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - _t)
+        assert response.status == 201, response.status
+    conn.close()
+
+
+def bench_server(n_rows=10000, clients=(1, 8, 32), n_requests=100):
+    """ POST /acts of 1 record each, from n_clients concurrent clients : latency & throughput, with micro-batched vs 1 commit per request """
+    import dr_server as srv
+    print("%8s %8s | %10s %10s | %10s %8s" % ('batched', 'clients', 'p50 ms', 'p99 ms', 'req/s', 'commits'))
+    for batch_rows in (srv.BATCH_MAX_ROWS, 1):
+        for n_clients in clients:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, 'bench.db'))
+                dal.connect()
+                names = generate_db(dal, n_rows, n_names=300)
+                server = srv.ApiServer(('127.0.0.1', 0), dal, batch_rows=batch_rows)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                latencies = []
+                threads = [threading.Thread(target=_post_acts, args=(n_requests, server.server_port, _i, names, latencies))
+                           for _i in range(n_clients)]
+                _t = time.perf_counter()
+                for _th in threads:
+                    _th.start()
+                for _th in threads:
+                    _th.join()
+                elapsed = time.perf_counter() - _t
+                server.shutdown()
+                server.server_close()
+                dal.dispose()
+            latencies.sort()
+            print("%8s %8d | %10.2f %10.2f | %10.0f %8d" % (batch_rows > 1, n_clients, latencies[len(latencies) // 2] * 1e3,
+                                                            latencies[int(len(latencies) * 0.99)] * 1e3, len(latencies) / elapsed,
+                                                            server.recorder.stats['commits']))
+
+
+def bench_recorder(n_records=2000, batch_rows=(1, 50, 500)):
+    """ records/s of n_records from a tracker : 1 commit each (as RecordActivity), vs BufferedRecorder group commits """
+    print("%10s | %10s | %8s" % ('batch rows', 'recs/s', 'commits'))
+    day = dt.date(2030, 1, 1)
+    for profile in ('durable', 'fast'):
+        print("--- profile %s" % profile)
+        for rows in (None,) + batch_rows:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, 'bench.db'), profile=profile)
+                dal.connect()
+                a_done = generate_db(dal, 1000, n_names=300)[0]
+                recs = [s.ActvtyRec(day=day + dt.timedelta(days=_i // 1440), startt=dt.time(_i % 1440 // 60, _i % 60),
+                                    endt=dt.time(_i % 1440 // 60, _i % 60, 30), a_done=a_done) for _i in range(n_records)]
+                _t = time.perf_counter()
+                if rows is None:
+                    for _rec in recs:
+                        with dal.session_scope() as session:
+                            session.add(_rec)
+                    commits = n_records
+                else:
+                    recorder = bll.BufferedRecorder(dal, max_rows=rows)
+                    for _rec in recs:
+                        recorder.record(_rec)
+                    recorder.close()
+                    commits = recorder.stats['commits']
+                elapsed = time.perf_counter() - _t
+                dal.dispose()
+            print("%10s | %10.0f | %8d" % (rows or 'direct', n_records / elapsed, commits))
+
+
+def bench_cat_cache(n_records=1000, new_share=(0.01, 0.1, 0.5)):
+    """ recording n_records one by one, new_share of them with a new activity : new activities found by a foreign key
+    IntegrityError (rollback, add category, retry ; as RecordActivity did) vs checked with a CategoryCache before insert
+    """
+    from sqlalchemy import exc
+    print("%10s | %12s %12s | %10s" % ('new share', 'fk ms', 'cache ms', 'rollbacks'))
+    day = dt.date(2030, 1, 1)
+    for share in new_share:
+        timings, rollbacks = [], 0
+        for use_cache in (False, True):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, 'bench.db'))
+                dal.connect()
+                names = generate_db(dal, 1000, n_names=300)
+                rnd = random.Random(0)
+                acts = ['new %d' % _i if rnd.random() < share else rnd.choice(names) for _i in range(n_records)]
+                dal.create_session()
+                session = dal.session
+                cat_cache = bll.CategoryCache().load(session)
+                _t = time.perf_counter()
+                for _i, _act in enumerate(acts):
+                    rec = s.ActvtyRec(day=day + dt.timedelta(days=_i // 1440), startt=dt.time(_i % 1440 // 60, _i % 60),
+                                      endt=dt.time(_i % 1440 // 60, _i % 60, 30), a_done=_act)
+                    if use_cache:
+                        cat_cache.ensure(session, [_act], default_cat='new')
+                        session.add(rec)
+                        session.commit()
+                        continue
+                    session.add(rec)
+                    try:
+                        session.commit()
+                    except exc.IntegrityError:
+                        session.rollback()
+                        rollbacks += 1
+                        session.add(s.ActvtyCat(a_done=_act, a_cat='new'))
+                        session.add(rec)
+                        session.commit()
+                timings.append(time.perf_counter() - _t)
+                cat_cache.close()
+                session.close()
+                dal.dispose()
+        print("%10.2f | %12.1f %12.1f | %10d" % (share, timings[0] * 1e3, timings[1] * 1e3, rollbacks))
+
+
+def _search_acts_like(session, keyedin_, limit=20):
+    # search without act_search : LIKE scan of activities & comments (no ranking)
+    rec = s.ActvtyRec
+    return (session.query(rec.a_id, rec.a_done, rec.comments).filter(sqlalchemy.or_(rec.a_done.like('%' + keyedin_ + '%'), rec.comments.like('%' + keyedin_ + '%')))
+            .order_by(rec.a_id.desc()).limit(limit).all())
+
+
+def bench_search_text(sizes=(100000, 1000000), n_names=3000, share=0.2):
+    """ searching activities & comments, after collapsing the share least used names (so comments hold names) :
+    LIKE scan vs the act_search full-text index (ranked records, & names). Also the index's cost per recorded row
+    """
+    print("%8s %6s | %10s %10s %10s" % ('rows', 'term', 'like ms', 'fts ms', 'names ms'))
+    for n_rows in sizes:
+        with temp_dal(n_rows, n_names=n_names, zipf_s=ZIPF_S) as dal:
+            names = bll.search_names(dal.session, s.ActvtyRec.a_done, '')
+            dal.session.add(s.ActvtyCat(a_done='collapsed', a_cat='misc'))
+            bll.collapse_acts(dal.session, [_n for _n, _c in names[-int(len(names) * share):]], 'collapsed')
+            dal.session.commit()
+            for term in SEARCH_TERMS + ['hatha yo']:
+                like_t, _ = timed(_search_acts_like, dal.session, term, repeat=3)
+                fts_t, _ = timed(bll.search_acts, dal.session, term, limit=20, repeat=3)
+                names_t, _ = timed(bll.search_act_names, dal.session, term, limit=20, repeat=3)
+                print("%8d %6s | %10.1f %10.1f %10.1f" % (n_rows, term, like_t * 1e3, fts_t * 1e3, names_t * 1e3))
+    with tempfile.TemporaryDirectory() as tmp_dir:  # insert cost, with & without the index's triggers
+        for indexed in (True, False):
+            dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, 'search_%d.db' % indexed))
+            dal.connect()
+            if not indexed:
+                with dal.engine.begin() as conn:
+                    s.drop_search_index(s.Base.metadata, conn)
+            _t = time.perf_counter()
+            generate_db(dal, sizes[0], n_names=n_names)
+            print("... %d rows generated in %.1f s %s the index" % (sizes[0], time.perf_counter() - _t, 'with' if indexed else 'without'))
+            dal.dispose()
+
+
+def _launch(args, stdin=''):
+    """ (wall time, completed process) of running python with args, from this directory """
+    _t = time.perf_counter()
+    proc = subprocess.run([sys.executable] + args, input=stdin, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - _t, proc
+
+
+def bench_startup(n_runs=10, n_rows=10000, budgets=STARTUP_BUDGET_SECS):
+    """ wall time of launching dr_ui (best of n_runs, as from a hotkey) : up to its menu, & a quick record (--record) into a db of
+    n_rows. python alone & importing what dr_ui used to import up front for reference. Returns the launches over their budget
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'bench.db')
+        dal = s.DataAccessLayer('sqlite:///' + db_path)
+        dal.connect()
+        name = generate_db(dal, n_rows, n_names=300)[0]
+        dal.dispose()
+        day = (dt.date(2015, 1, 1) + dt.timedelta(days=n_rows // RECS_PER_DAY + 1)).isoformat()
+        launches = {'python': (['-c', 'pass'], ''),
+                    'eager imports': (['-c', 'import pandas, dateutil.parser, dr_schema, dr_bll'], ''),
+                    'menu': (['dr_ui.py', '--db', db_path], '\n')}
+        times = {_launch_name: min(_launch(*_args)[0] for _ in range(n_runs)) for _launch_name, _args in launches.items()}
+        record_times = []
+        for _i in range(n_runs):
+            _t, proc = _launch(['dr_ui.py', '--db', db_path, '--record', name, '--day', day, '--start', '%02d:00' % _i, '--end', '%02d:30' % _i])
+            if proc.returncode:
+                raise RuntimeError(proc.stderr)
+            record_times.append(_t)
+        times['record'] = min(record_times)
+    over = []
+    print("%-14s | %10s %10s" % ('launch', 'ms', 'budget ms'))
+    for _launch_name, _secs in times.items():
+        budget = budgets.get(_launch_name)
+        if budget is not None and _secs > budget:
+            over.append(_launch_name)
+        print("%-14s | %10.0f %10s%s" % (_launch_name, _secs * 1e3, '%.0f' % (budget * 1e3) if budget else '', ' !! over' if _launch_name in over else ''))
+    return over
+
+
+def _traced_bytes(fn, *args):
+    """ (bytes allocated by fn & still held by its result, result) """
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+
+def bench_snapshot(sizes=(100000, 1000000), n_names=3000):
+    """ memory per record of rep.ActSnapshot vs ORM objects, row tuples & fetch_intervals' DataFrame ;
+    cost of its full load & of refreshes after inserts, a collapse (rename) & ORM updates
+    """
+    import dr_report as rep
+    print("%8s | %10s %10s %10s %10s" % ('rows', 'orm B/row', 'rows B/row', 'frame B/row', 'snap B/row'))
+    refresh_lines = []
+    for n_rows in sizes:
+        with temp_dal(n_rows, n_names=n_names, zipf_s=ZIPF_S) as dal:
+            session = dal.session
+            orm_bytes = _traced_bytes(lambda: session.query(s.ActvtyRec).all())[0] if n_rows <= 100000 else float('nan')
+            session.expunge_all()
+            rec = s.ActvtyRec
+            tuple_bytes = _traced_bytes(lambda: session.query(rec.a_id, rec.day, rec.startt, rec.endt, rec.a_done).all())[0]
+            frame_bytes = rep.fetch_intervals(session).memory_usage(deep=True).sum()  # its strings are in arrow buffers : not traced
+            load_t, snapshot = timed(lambda: rep.ActSnapshot().refresh(session), repeat=1)
+            print("%8d | %10.0f %10.0f %10.0f %10.1f" % (n_rows, orm_bytes / n_rows, tuple_bytes / n_rows, frame_bytes / n_rows, snapshot.nbytes / snapshot.n))
+            timings = {'load': load_t, 'no change': timed(snapshot.refresh, session, repeat=3)[0]}
+            last_day = session.query(sqlalchemy.func.max(rec.day)).scalar()
+            recorder = bll.BufferedRecorder(dal, flush_secs=10)
+            for _i in range(1000):
+                _day = last_day + dt.timedelta(days=1 + _i // 1440)
+                recorder.record(s.ActvtyRec(day=_day, startt=dt.time(_i % 1440 // 60, _i % 60), endt=dt.time(_i % 1440 // 60, _i % 60, 30), a_done='yoga 0'))
+            recorder.close()
+            timings['1000 inserted'] = timed(snapshot.refresh, session, repeat=1)[0]
+            names = [_n for _n, _c in bll.search_names(session, rec.a_done, '')]
+            session.add(s.ActvtyCat(a_done='collapsed', a_cat='misc'))
+            bll.collapse_acts(session, names[-len(names) // 5:], 'collapsed')
+            session.commit()
+            timings['collapse'] = timed(snapshot.refresh, session, repeat=1)[0]
+            for _rec in session.query(rec).filter(rec.a_id <= 100):
+                _rec.comments = 'changed'
+            session.commit()
+            timings['100 updated'] = timed(snapshot.refresh, session, repeat=1)[0]
+            refresh_lines.extend("%8d %14s | %10.2f" % (n_rows, _what, _secs * 1e3) for _what, _secs in timings.items())
+            snapshot.close()
+    print("\n%8s %14s | %10s" % ('rows', 'refresh', 'ms'))
+    print('\n'.join(refresh_lines))
+
+
+def bench_parallel(n_rows=10000000, workers=None, periods=(None, 'week')):
+    """ rep.parallel_time_usage per category over all n_rows records (generated without act_search, which it doesn't use),
+    by 1 to workers processes (default : the cpus, at least 2) ; 1 is time_usage itself. Checks each result is time_usage's
+    """
+    import dr_report as rep
+    workers = workers or max(rep.REPORT_WORKERS, 2)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+        dal = s.DataAccessLayer(db_url)
+        dal.connect()
+        with dal.engine.begin() as conn:
+            s.drop_search_index(s.Base.metadata, conn)
+        gen_t, _ = timed(generate_db, dal, n_rows, n_names=SUITE_NAMES, zipf_s=ZIPF_S, repeat=1)
+        print("... %d rows generated in %.0f s, %d cpus\n" % (n_rows, gen_t, os.cpu_count() or 1))
+        print("%8s %8s | %10s %8s" % ('period', 'workers', 'secs', 'speedup'))
+        for period in periods:
+            with dal.session_scope() as session:
+                serial_t, expected = timed(rep.time_usage, session, 'a_cat', period, use_rollups=False, repeat=1)
+            print("%8s %8d | %10.2f %8.2f" % (period, 1, serial_t, 1.))
+            for _workers in range(2, workers + 1):
+                _t, usage = timed(rep.parallel_time_usage, db_url, 'a_cat', period, workers=_workers, repeat=1)
+                print("%8s %8d | %10.2f %8.2f%s" % (period, _workers, _t, serial_t / _t, '' if usage.equals(expected) else '  !! differs'))
+        dal.dispose()
+        s.dispose_engine(db_url, profile=s.READ_ONLY_PROFILE)
+
+
+def _insert_one(dal, row):
+    # 1 record per commit, through Core as PartitionedDataAccessLayer.record
+    with dal.session_scope() as session:
+        conn = session.connection()
+        conn.execute(s.ActvtyRec.__table__.insert(), [row])
+        bll.apply_rollup_deltas(conn, bll.rollup_deltas([(row['day'], row['startt'], row['endt'], row['a_done'])]))
+
+
+def _fetch_recs(session, day_from, day_to):
+    # the monolithic equivalent of PartitionedDataAccessLayer.fetch_recs
+    rec, cat = s.ActvtyRec, s.ActvtyCat
+    query = (sqlalchemy.select(rec.a_id, rec.day, rec.startt, rec.endt, rec.a_done, rec.comments, cat.a_cat).outerjoin(cat, rec.a_done == cat.a_done)
+             .where(rec.day >= day_from, rec.day <= day_to).order_by(rec.day, rec.startt, rec.a_id))
+    return session.execute(query).fetchall()
+
+
+def bench_partitions(years=(10, 40), n_inserts=300):
+    """ 1 db file vs dr_partition's 1 file per year (both without act_search, which isn't partitioned) : time to split,
+    single-record insert latency (1 commit each) in the last year, & fetching the records of a month, a year & everything
+    """
+    import dr_partition as dp
+    print("%6s %8s %8s | %10s %10s | %10s %10s %10s" % ('years', 'rows', 'layout', 'ins p50 ms', 'ins p99 ms', 'month ms', 'year ms', 'all ms'))
+    for _years in years:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, 'bench.db'))
+            dal.connect()
+            with dal.engine.begin() as conn:
+                s.drop_search_index(s.Base.metadata, conn)
+            a_done = generate_db(dal, _years * 365 * RECS_PER_DAY)[0]
+            split_t, _ = timed(dp.split_db, dal.db_url, os.path.join(tmp_dir, 'parts'), repeat=1)
+            pdal = dp.PartitionedDataAccessLayer(os.path.join(tmp_dir, 'parts'))
+            pdal.connect()
+            with dal.session_scope() as session:
+                last_day = session.query(sqlalchemy.func.max(s.ActvtyRec.day)).scalar()
+            ranges = [(last_day - dt.timedelta(days=_days), last_day) for _days in (30, 365)] + [(dt.date(1, 1, 1), last_day)]
+            for layout, insert, fetch in (('1 file', lambda _r: _insert_one(dal, _r), lambda *_range: _fetch_recs(dal.session, *_range)),
+                                          ('per year', lambda _r: pdal.record([_r]), pdal.fetch_recs)):
+                dal.create_session()
+                latencies = []
+                for _i in range(n_inserts):  # the day after the last, on which both layouts have room
+                    _m = _i % 1440
+                    _row = {'day': last_day + dt.timedelta(days=1 + _i // 1440), 'startt': dt.time(_m // 60, _m % 60),
+                            'endt': dt.time(_m // 60, _m % 60, 30), 'a_done': a_done}
+                    _t = time.perf_counter()
+                    insert(_row)
+                    latencies.append(time.perf_counter() - _t)
+                latencies.sort()
+                fetch_ts = [timed(fetch, *_range, repeat=3)[0] for _range in ranges]
+                dal.session.close()
+                print("%6d %8d %8s | %10.2f %10.2f | %10.1f %10.1f %10.1f" % ((_years, _years * 365 * RECS_PER_DAY, layout, latencies[len(latencies) // 2] * 1e3,
+                                                                              latencies[int(len(latencies) * 0.99)] * 1e3) + tuple(_t * 1e3 for _t in fetch_ts)))
+            print("... split in %.1f s" % split_t)
+            pdal.dispose()
+            dal.dispose()
+
+
+def bench_migrate(sizes=(100000, 1000000), configs=((1000, 0.), (1000, 1.), (20000, 1.), (None, 0.)), write_every_secs=0.01):
+    """ dr_migrate.TableCopy rebuilding act_recs (with a python transform) per (batch rows, pause ratio) (None : all rows in
+    1 transaction, like a plain table copy) : rows/s, longest lock, peak python memory (a 2nd run, traced), & the latency of
+    a writer recording 1 activity every write_every_secs meanwhile (p50 / max ; errors : gave up waiting for the lock)
+    """
+    import tracemalloc
+    import dr_migrate as dm
+    print("%8s %8s %6s | %10s %10s %10s %10s | %10s %10s %7s" % ('rows', 'batch', 'pause', 'rows/s', 'lock ms', 'swap ms', 'peak MB', 'write p50', 'write max', 'errors'))
+    for n_rows in sizes:
+        with temp_dal(n_rows) as dal:
+            a_done = dal.session.query(s.ActvtyRec.a_done).first()[0]
+            last_day = dal.session.query(sqlalchemy.func.max(s.ActvtyRec.day)).scalar()
+            dal.session.close()
+            for _batch, _pause in configs:
+                copy = lambda: dm.TableCopy(dal.engine, s.ActvtyRec.__table__, transform=lambda _row: dict(_row, comments=_row['comments'] or ''),
+                                            batch_rows=_batch or n_rows + 100000, pause_ratio=_pause, progress=None).run()
+                stop, latencies, errors = threading.Event(), [], Counter()
+
+                def _writer():
+                    _i = 0
+                    while not stop.is_set():
+                        _t = time.perf_counter()
+                        try:
+                            _record_one(dal, last_day + dt.timedelta(days=1 + _i // 1440), _i % 1440, a_done)
+                            latencies.append(time.perf_counter() - _t)
+                        except sqlalchemy.exc.OperationalError:
+                            errors['locked'] += 1
+                        _i += 1
+                        time.sleep(write_every_secs)
+                writer = threading.Thread(target=_writer)
+                writer.start()
+                try:
+                    stats = copy()
+                finally:
+                    stop.set()
+                    writer.join()
+                with dal.session_scope() as session:  # the writer's records : out again, for the next run
+                    session.query(s.ActvtyRec).filter(s.ActvtyRec.day > last_day).delete()
+                tracemalloc.start()
+                copy()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                latencies.sort()
+                print("%8d %8s %6.1f | %10.0f %10.1f %10.1f %10.1f | %10.2f %10.1f %7d" % (n_rows, _batch or 'all', _pause, stats['rows_per_sec'], stats['max_lock_secs'] * 1e3,
+                                                                                  stats['swap_secs'] * 1e3, peak / 2 ** 20, latencies[len(latencies) // 2] * 1e3 if latencies else float('nan'),
+                                                                                  latencies[-1] * 1e3 if latencies else float('nan'), errors['locked']))
+
+
+def near_duplicate_names(n_names, variant_share=0.2, seed=0):
+    """ returns ({name: count}, {variant: base}) : n_names made-up activity names, of which variant_share are variants of another
+    (eg 'tobaka' -> 'tobaking', 'morning tobaka', 'Tobaka', 'toaka'), used less than it
+    """
+    rnd = random.Random(seed)
+    syllables = [_c + _v for _c in 'bdfgklmnprstvz' for _v in 'aeiou']
+    n_bases = int(n_names * (1 - variant_share))
+    name_counts = dict()
+    while len(name_counts) < n_bases:
+        name = ' '.join(''.join(rnd.choices(syllables, k=rnd.randint(2, 4))) for _ in range(rnd.randint(1, 2)))
+        name_counts[name] = rnd.randint(10, 1000)
+    bases = list(name_counts)
+    variants = dict()
+    while len(name_counts) < n_names:
+        base = rnd.choice(bases)
+        kind = rnd.randrange(4)
+        if kind == 0:
+            name = base + 'ing'
+        elif kind == 1:
+            name = rnd.choice(['morning', 'evening', 'quick', 'long']) + ' ' + base
+        elif kind == 2:
+            name = base.title()
+        else:  # a typo : a letter left out
+            _i = rnd.randrange(1, len(base) - 1)
+            name = base[:_i] + base[_i + 1:]
+        if name not in name_counts:
+            name_counts[name] = rnd.randint(1, 9)
+            variants[name] = base
+    return name_counts, variants
+
+
+def _suggest_collapses_pairwise(name_counts, min_score=bll.COLLAPSE_MIN_SCORE):
+    """ bll.suggest_collapses without the blocking index : each name is scored against every target so far """
+    keys = {_n: ' '.join(re.findall(r'\w+', _n.lower())) for _n in name_counts}
+    grams = {_n: bll.ngrams(' %s ' % _k) for _n, _k in keys.items() if _k}
+    by_key, collapsed = dict(), dict()
+    for _name in sorted(grams, key=lambda _n: (-name_counts[_n], _n)):
+        target = by_key.get(keys[_name])
+        if target is None:
+            best = max(((len(grams[_name] & grams[_t]) / min(len(grams[_name]), len(grams[_t])), name_counts[_t], _t) for _t in collapsed),
+                       default=None)
+            if best is not None and best[0] >= min_score:
+                target = best[2]
+        if target is None:
+            collapsed[_name] = []
+            by_key[keys[_name]] = _name
+        else:
+            collapsed[target].append(_name)
+            by_key.setdefault(keys[_name], target)
+    return [(_act_list, _target) for _target, _act_list in collapsed.items() if _act_list]
+
+
+def bench_suggest_collapses(n_names=(1000, 10000, 50000), pairwise_max=10000):
+    """ bll.suggest_collapses of made-up names with planted variants : time vs scoring all pairs, suggestions made,
+    & share of the variants suggested for collapsing into the name they were made from
+    """
+    print("%8s | %10s %10s %5s | %10s %10s" % ('names', 'blocked ms', 'pairs ms', 'same', 'suggested', 'recall'))
+    for _n_names in n_names:
+        name_counts, variants = near_duplicate_names(_n_names)
+        blocked_t, suggestions = timed(bll.suggest_collapses, name_counts, repeat=1)
+        pairs_t, same = float('nan'), ''
+        if _n_names <= pairwise_max:
+            pairs_t, pairwise = timed(_suggest_collapses_pairwise, name_counts, repeat=1)
+            same = 'yes' if sorted(suggestions) == sorted(pairwise) else 'no'
+        into = {_a: _target for _act_list, _target in suggestions for _a in _act_list}
+        recall = sum(into.get(_v) == _base for _v, _base in variants.items()) / len(variants)
+        print("%8d | %10.0f %10.0f %5s | %10d %10.2f" % (_n_names, blocked_t * 1e3, pairs_t * 1e3, same, len(into), recall))
+
+
+# ====== SUITE =====================================================================================
+# the hot paths timed on 1 zipfian db, saved as json (with the commit) so runs can be compared across commits.
+# Metrics ending in _secs are best-of-repeat times (lower is better), in _per_sec throughputs (higher is better)
+
+def git_commit():
+    """ (short hash of HEAD, whether tracked files have uncommitted changes), or ('unknown', False) outside a git checkout """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_dir, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(dirty.strip())
+
+
+def suite_metrics(dal, names, repeat=5, n_inserts=10000):
+    """ times the hot paths on dal's db (filled by generate_db, names most used first) ; returns {metric: value} """
+    import dr_report as rep
+    session, metrics = dal.session, dict()
+    last_day = session.query(sqlalchemy.func.max(s.ActvtyRec.day)).scalar()
+    # name search, as prompt_for_name : in the db, & in a NameIndex
+    for _term in SEARCH_TERMS:
+        metrics['search_names_%s_secs' % _term] = timed(bll.search_names, session, s.ActvtyRec.a_done, _term, limit=20, repeat=repeat)[0]
+    name_index = bll.NameIndex(s.ActvtyRec.a_done)
+    metrics['name_index_load_secs'] = timed(name_index.load, session, repeat=1)[0]
+    for _term in SEARCH_TERMS:
+        metrics['name_index_search_%s_secs' % _term] = timed(name_index.search, _term, limit=20, repeat=repeat)[0]
+    name_index.close()
+    # full-text search of activities, comments & categories
+    for _term in SEARCH_TERMS:
+        metrics['search_acts_%s_secs' % _term] = timed(bll.search_acts, session, _term, limit=20, repeat=repeat)[0]
+    # range & aggregation queries
+    month = (last_day - dt.timedelta(days=30), last_day)
+    metrics['range_month_secs'] = timed(lambda: bll.query_acts_with_cats(session, *month).all(), repeat=repeat)[0]
+    year = (last_day - dt.timedelta(days=365), last_day)
+    metrics['usage_year_weekly_secs'] = timed(rep.time_usage, session, 'a_cat', 'week', *year, repeat=repeat)[0]
+    metrics['usage_year_weekly_raw_secs'] = timed(rep.time_usage, session, 'a_cat', 'week', *year, use_rollups=False, repeat=repeat)[0]
+    metrics['usage_all_rollups_secs'] = timed(rep.time_usage, session, 'a_done', repeat=repeat)[0]
+    metrics['find_overlaps_secs'] = timed(bll.find_overlaps, session, last_day, dt.time(12), dt.time(13), repeat=repeat)[0]
+    session.expunge_all()
+    # inserts : 1 commit per record (as RecordActivity), & group commits (BufferedRecorder)
+    day = last_day + dt.timedelta(days=1)
+    new_recs = lambda _n, _day: [s.ActvtyRec(day=_day + dt.timedelta(days=_i // 1440), startt=dt.time(_i % 1440 // 60, _i % 60),
+                                             endt=dt.time(_i % 1440 // 60, _i % 60, 30), a_done=names[_i % 10]) for _i in range(_n)]
+    _t = time.perf_counter()
+    for _rec in new_recs(200, day):
+        with dal.session_scope() as _session:
+            _session.add(_rec)
+    metrics['record_one_commit_secs'] = (time.perf_counter() - _t) / 200
+    recorder = bll.BufferedRecorder(dal, flush_secs=10)
+    _t = time.perf_counter()
+    for _rec in new_recs(n_inserts, day + dt.timedelta(days=10)):
+        recorder.record(_rec)
+    recorder.close()
+    metrics['buffered_insert_rows_per_sec'] = n_inserts / (time.perf_counter() - _t)
+    # collapse (changes the db : last) of the least used 20% of activities
+    act_list = names[-len(names) // 5:]
+    session.add(s.ActvtyCat(a_done='collapsed', a_cat='misc'))
+    session.flush()
+    _t = time.perf_counter()
+    bll.collapse_acts(session, act_list, 'collapsed')
+    session.commit()
+    metrics['collapse_tail_secs'] = time.perf_counter() - _t
+    return metrics
+
+
+def run_suite(size='10k', repeat=5, results_dir=RESULTS_DIR):
+    """ runs suite_metrics on a fresh zipfian db of SUITE_SIZES[size] records ; saves & returns the results """
+    n_rows = SUITE_SIZES[size]
+    commit, dirty = git_commit()
+    results = {'commit': commit, 'dirty': dirty, 'date': dt.datetime.now().isoformat(timespec='seconds'), 'size': size,
+               'rows': n_rows, 'names': SUITE_NAMES, 'zipf_s': ZIPF_S, 'python': platform.python_version(),
+               'sqlalchemy': sqlalchemy.__version__, 'platform': platform.platform()}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dal = s.DataAccessLayer('sqlite:///' + os.path.join(tmp_dir, 'bench.db'))
+        dal.connect()
+        results['generate_secs'], names = timed(generate_db, dal, n_rows, n_names=SUITE_NAMES, zipf_s=ZIPF_S, repeat=1)
+        dal.create_session()
+        try:
+            results['metrics'] = suite_metrics(dal, names, repeat)
+        finally:
+            dal.session.close()
+            dal.dispose()
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, '%s-%s%s.json' % (size, commit, '-dirty' if dirty else ''))
+    with open(path, 'w') as json_file:
+        json.dump(results, json_file, indent=2, sort_keys=True)
+    for _metric, _value in sorted(results['metrics'].items()):
+        print("%-32s %14.6g" % (_metric, _value))
+    print("... saved to %s" % path)
+    return results
+
+
+def compare(old_path, new_path, ratio=REGRESSION_RATIO):
+    """ prints the metrics of 2 suite results side by side, flagging those more than ratio worse in the new ; returns their names """
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    if (old['rows'], old['zipf_s']) != (new['rows'], new['zipf_s']):
+        print("!! different datasets : %s vs %s rows" % (old['rows'], new['rows']))
+    print("%-32s %12s %12s %8s" % ('metric', old['commit'], new['commit'], 'x'))
+    regressions = []
+    for _metric in sorted(set(old['metrics']) & set(new['metrics'])):
+        _old, _new = old['metrics'][_metric], new['metrics'][_metric]
+        slowdown = (_old / _new if _metric.endswith('_per_sec') else _new / _old) if _old and _new else 1.
+        flag = ' !!' if slowdown > ratio else ''
+        if flag:
+            regressions.append(_metric)
+        print("%-32s %12.6g %12.6g %8.2f%s" % (_metric, _old, _new, slowdown, flag))
+    return regressions
+
+
+BENCHMARKS = {'search_names': bench_search_names,
+              'name_index': bench_name_index,
+              'collapse': bench_collapse,
+              'import': bench_import,
+              'export': bench_export,
+              'time_usage': bench_time_usage,
+              'rollups': bench_rollups,
+              'time_storage': bench_time_storage,
+              'overlaps': bench_overlaps,
+              'dal': bench_dal,
+              'profiles': bench_profiles,
+              'async': bench_async,
+              'server': bench_server,
+              'recorder': bench_recorder,
+              'cat_cache': bench_cat_cache,
+              'search_text': bench_search_text,
+              'startup': bench_startup,
+              'snapshot': bench_snapshot,
+              'parallel': bench_parallel,
+              'partitions': bench_partitions,
+              'migrate': bench_migrate,
+              'suggest_collapses': bench_suggest_collapses}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['suite']:
+        run_suite(*sys.argv[2:3])
+        sys.exit()
+    if sys.argv[1:2] == ['startup']:  # eg in CI : fails if dr_ui takes longer than its budget to start
+        sys.exit(1 if bench_startup() else 0)
+    if sys.argv[1:2] == ['compare']:
+        sys.exit(1 if compare(*sys.argv[2:4]) else 0)
+    for _name in (sys.argv[1:] or BENCHMARKS):
+        print("\n===== %s =====" % _name)
+        BENCHMARKS[_name]()
@@ -2,36 +2,414 @@
 Implements Business Logic Layer (bll) between uil and dal
 """
 
+import re
+import math
+import csv
+import time
+import heapq
+import queue
+import atexit
+import functools
+import threading
+import datetime as dt
+from collections import Counter, defaultdict
+from concurrent.futures import Future
+
 import dr_schema as s
 
+from sqlalchemy import and_, case, event, func, literal_column, or_
 from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import sqlite
+
+
+# ====== CONSTANTS =================================================================================
+NGRAM_N = 3  # length of character n-grams used by NameIndex postings
+COLLAPSE_MIN_SCORE = 0.8  # least share of the shorter name's n-grams 2 names must share for suggest_collapses to pair them
+COLLAPSE_PREFIX_EXTRA = 2  # n-grams suggest_collapses posts & probes beyond the least that finds all pairs : fewer candidates to score
+SEARCH_WEIGHTS = {'a_done': 10., 'comments': 1., 'a_cat': 5.}  # bm25 weights of s.search_table's columns, in its order
+SEARCH_RANK_WINDOW = 5000  # latest matching records ranked by search_acts : so a common word costs the same on any size of db
+MINS_PER_DAY = 24 * 60
+SECS_PER_DAY = MINS_PER_DAY * 60
+IMPORT_CHUNK_ROWS = 50000  # rows read & inserted (executemany) at a time by import_acts
+EXPORT_CHUNK_ROWS = 50000  # rows fetched & written (as 1 record batch) at a time by export_acts
+RECORD_BATCH_ROWS = 500  # most records written per group commit by BufferedRecorder
+RECORD_FLUSH_SECS = 1.0  # longest a record waits in BufferedRecorder's queue for others to join its group commit
+RECORD_QUEUE_SIZE = 10000  # records queued before BufferedRecorder.record blocks
+
+# ====== CHANGE FEED ===============================================================================
+# name changes are noted on the session as they are flushed, & only passed on to listeners (eg a NameIndex)
+# once committed. A change is a tuple, eg ('add', 'act_recs.a_done', name[, count]) or ('rename', 'act_recs.a_done', old_names, new_name),
+# & for act_cats rows ('set', 'act_cats.a_done', a_done, a_cat) or ('remove', 'act_cats.a_done', a_done), or ('reset', 'act_cats.a_done')
+# when they were changed set-based (eg by query.update()) & the rows aren't known.
+# Records changed or deleted as ORM objects are noted as ('update', 'act_recs', a_id) or ('delete', 'act_recs', a_id)
+_change_listeners = []
+
+
+def add_change_listener(listener):
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+
+def remove_change_listener(listener):
+    if listener in _change_listeners:
+        _change_listeners.remove(listener)
+
+
+def note_change(session, change):
+    session.info.setdefault('dr_changes', []).append(change)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_new_names(session, flush_context):
+    for _obj in session.new:
+        if isinstance(_obj, s.ActvtyRec):
+            note_change(session, ('add', 'act_recs.a_done', _obj.a_done))
+        elif isinstance(_obj, s.ActvtyCat):
+            note_change(session, ('add', 'act_cats.a_cat', _obj.a_cat))
+    for _obj in session.dirty:
+        if isinstance(_obj, s.ActvtyRec):
+            note_change(session, ('update', 'act_recs', _obj.a_id))
+    for _obj in session.deleted:
+        if isinstance(_obj, s.ActvtyRec):
+            note_change(session, ('delete', 'act_recs', _obj.a_id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _broadcast_changes(session):
+    for _change in session.info.pop('dr_changes', []):
+        for _listener in list(_change_listeners):
+            _listener(_change)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('dr_changes', None)
+
+
+def search_names(session, column_obj, keyedin_, limit=None):
+    """ returns [(name, count), ..] of distinct values of column_obj containing keyedin_, most used first.
+    Single aggregated query (GROUP BY) instead of one count query per distinct name.
+    """
+    _count = func.count(column_obj)
+    results = (session.query(column_obj, _count)
+               .filter(column_obj.like('%' + keyedin_ + '%'))
+               .group_by(column_obj)
+               .order_by(_count.desc(), column_obj))
+    if limit is not None:
+        results = results.limit(limit)
+    return [(_name, _cnt) for _name, _cnt in results]
+
+
+def fts_query(keyedin_, columns=None):
+    """ FTS5 query of the words keyed in, each matched as a word prefix (all must match), eg 'hath yo' -> "hath"* "yo"* ;
+    within columns (of s.search_table) if given. None if there are no words
+    """
+    words = re.findall(r'\w+', keyedin_)  # so no quotes / operators of the query syntax get through
+    if not words:
+        return None
+    query = ' '.join('"%s"*' % _w for _w in words)
+    return '{%s} : (%s)' % (' '.join(columns), query) if columns else query
+
+
+def _search_matches(session, keyedin_, columns=None):
+    """ (query of the s.search_table rows matching keyedin_, their bm25 score : lower is better), or None if no words.
+    bm25 costs a few us per row, so only the latest SEARCH_RANK_WINDOW matches are queried : found in rowid order, without scoring
+    """
+    query = fts_query(keyedin_, columns)
+    if query is None:
+        return None
+    fts = s.search_table
+    match = literal_column(fts.name).op('MATCH')(query)
+    oldest = session.query(fts.c.rowid).filter(match).order_by(fts.c.rowid.desc()).offset(SEARCH_RANK_WINDOW - 1).limit(1).scalar()
+    matches = session.query(fts).filter(match)
+    if oldest is not None:
+        matches = matches.filter(fts.c.rowid >= oldest)
+    return matches, func.bm25(literal_column(fts.name), *SEARCH_WEIGHTS.values())
+
+
+def search_acts(session, keyedin_, columns=None, limit=None):
+    """ [(a_id, day, startt, endt, a_done, comments, a_cat)] of records with words starting with each word keyed in
+    (in their activity, comments - eg names collapsed into another - or category ; or only in columns), best match first
+    among the latest SEARCH_RANK_WINDOW matching records.
+    Uses the act_search full-text index (sqlite) ; elsewhere, a (slow) LIKE scan, latest first
+    """
+    rec, cat = s.ActvtyRec, s.ActvtyCat
+    if not s.has_search_index(session.connection()):
+        words = re.findall(r'\w+', keyedin_)
+        cols = [{'a_done': rec.a_done, 'comments': rec.comments, 'a_cat': cat.a_cat}[_c] for _c in (columns or SEARCH_WEIGHTS)]
+        results = (session.query(rec.a_id, rec.day, rec.startt, rec.endt, rec.a_done, rec.comments, cat.a_cat)
+                   .outerjoin(cat, rec.a_done == cat.a_done)
+                   .filter(and_(*[or_(*[_col.ilike('%' + _w + '%') for _col in cols]) for _w in words]))
+                   .order_by(rec.a_id.desc()))
+        if limit is not None:
+            results = results.limit(limit)
+        return [tuple(_row) for _row in results]
+    matches = _search_matches(session, keyedin_, columns)
+    if matches is None:
+        return []
+    query, score = matches
+    fts = s.search_table
+    # ranked (& limited) on the index alone, then the few records read ; -1 : no limit
+    ranked = (query.with_entities(fts.c.rowid, score.label('score')).order_by(score, fts.c.rowid.desc())
+              .limit(-1 if limit is None else limit).subquery())
+    results = (session.query(rec.a_id, rec.day, rec.startt, rec.endt, rec.a_done, rec.comments, cat.a_cat)
+               .join(ranked, rec.a_id == ranked.c.rowid)
+               .outerjoin(cat, rec.a_done == cat.a_done)
+               .order_by(ranked.c.score, rec.a_id.desc()))
+    return [tuple(_row) for _row in results]
+
+
+def search_act_names(session, keyedin_, columns=None, limit=None):
+    """ [(a_done, count)] of the activities with records matching keyedin_ (as search_acts), best match first :
+    so eg names collapsed into an activity (now in its records' comments) find it. Counts are of the latest
+    SEARCH_RANK_WINDOW matching records. sqlite only
+    """
+    matches = _search_matches(session, keyedin_, columns)
+    if matches is None:
+        return []
+    query, score = matches
+    fts = s.search_table
+    # bm25 can't be aggregated directly : the LIMIT keeps sqlite from flattening the subquery into the GROUP BY
+    scored = query.with_entities(fts.c.a_done, score.label('score')).limit(-1).subquery()
+    best, count = func.min(scored.c.score), func.count()
+    results = session.query(scored.c.a_done, count).group_by(scored.c.a_done).order_by(best, count.desc(), scored.c.a_done)
+    if limit is not None:
+        results = results.limit(limit)
+    return [(_name, _cnt) for _name, _cnt in results]
+
+
+def ngrams(text, n=NGRAM_N):
+    return {text[_i:_i + n] for _i in range(len(text) - n + 1)}
+
+
+class NameIndex:
+    """ process-local index of the distinct values of a name column (eg ActvtyRec.a_done) with their usage counts.
+    Answers the same question as search_names (case-insensitive substring match, most used first) without touching the db:
+    substrings of NGRAM_N or more chars are looked up via n-gram postings, shorter ones by scanning the (few hundred) names.
+    Usage:
+        name_index = NameIndex(s.ActvtyRec.a_done).load(session)  # once ; kept up to date by committed changes
+        name_index.search('yog', limit=20)
+    """
+
+    def __init__(self, column_obj):
+        self.column_obj = column_obj
+        self.key = "%s.%s" % (column_obj.class_.__tablename__, column_obj.key)  # as used in the change feed
+        self.counts = dict()  # name -> count
+        self.lowered = dict()  # name -> lower-cased name
+        self.postings = defaultdict(set)  # ngram -> names containing it
+
+    def load(self, session):
+        """ (re)loads all names & counts with one query, then follows committed changes """
+        self.counts.clear()
+        self.lowered.clear()
+        self.postings.clear()
+        for _name, _cnt in session.query(self.column_obj, func.count(self.column_obj)).group_by(self.column_obj):
+            if _name is not None:
+                self.add(_name, _cnt)
+        add_change_listener(self.apply_change)
+        return self
+
+    def close(self):
+        remove_change_listener(self.apply_change)
+
+    def add(self, name, count=1):
+        if name not in self.counts:
+            self.counts[name] = 0
+            self.lowered[name] = name.lower()
+            for _gram in ngrams(self.lowered[name]):
+                self.postings[_gram].add(name)
+        self.counts[name] += count
+
+    def remove(self, name):
+        """ removes name, returning its count (0 if unknown) """
+        if name not in self.counts:
+            return 0
+        for _gram in ngrams(self.lowered.pop(name)):
+            self.postings[_gram].discard(name)
+            if not self.postings[_gram]:
+                del self.postings[_gram]
+        return self.counts.pop(name)
+
+    def apply_change(self, change):
+        if change[1] != self.key:
+            return
+        if change[0] == 'add' and change[2] is not None:
+            self.add(change[2], change[3] if len(change) > 3 else 1)
+        elif change[0] == 'rename':
+            moved = sum(self.remove(_name) for _name in change[2] if _name != change[3])
+            if moved:
+                self.add(change[3], moved)
+
+    def search(self, keyedin_, limit=None):
+        """ returns [(name, count), ..] of names containing keyedin_, most used first """
+        keyedin_ = keyedin_.lower()
+        grams = sorted(ngrams(keyedin_), key=lambda _gram: len(self.postings.get(_gram, ())))
+        if grams:  # intersect postings, smallest first
+            candidates = set(self.postings.get(grams[0], ()))
+            for _gram in grams[1:]:
+                if not candidates:
+                    break
+                candidates &= self.postings.get(_gram, set())
+        else:
+            candidates = self.counts
+        matches = [_name for _name in candidates if keyedin_ in self.lowered[_name]]
+        sort_key = lambda _name: (-self.counts[_name], _name)
+        if limit is not None:
+            matches = heapq.nsmallest(limit, matches, key=sort_key)
+        else:
+            matches.sort(key=sort_key)
+        return [(_name, self.counts[_name]) for _name in matches]
+
+
+class CategoryCache:
+    """ process-local copy of act_cats (a_done -> a_cat), so activities can be checked, & missing ones added, before records
+    are inserted : rather than finding out from a foreign key IntegrityError (rollback, add, retry) per new activity.
+    Loaded on first use, then kept up to date by committed changes (ORM changes to ActvtyCat, see the mapper events below,
+    & bll's bulk inserts) ; reloaded after committed query(ActvtyCat).update() / .delete() (see _note_cats_reset).
+    Activities another process added aren't in the cache : they're looked up in the db when asked for. Core or raw sql writes to
+    act_cats bypass the change feed : a caller changing or deleting rows that way should note_change(session, ('reset', key))
+    before committing, else the cache keeps the old categories.
+    Usage:
+        cat_cache = CategoryCache()
+        cat_cache.ensure(session, ['yoga', 'new activity'], default_cat='sport')  # adds 'new activity' ; commit to keep
+        cat_cache.close()  # stops following changes
+    """
+    key = 'act_cats.a_done'  # as used in the change feed
+
+    def __init__(self):
+        self.cats = None  # a_done -> a_cat, once loaded
+
+    def load(self, session):
+        """ (re)loads all of act_cats with one query, then follows committed changes """
+        self.cats = dict(session.query(s.ActvtyCat.a_done, s.ActvtyCat.a_cat))
+        add_change_listener(self.apply_change)
+        return self
+
+    def close(self):
+        remove_change_listener(self.apply_change)
+        self.cats = None
+
+    def apply_change(self, change):
+        if change[1] != self.key or self.cats is None:
+            return
+        if change[0] == 'set':
+            self.cats[change[2]] = change[3]
+        elif change[0] == 'remove':
+            self.cats.pop(change[2], None)
+        elif change[0] == 'reset':  # reloaded on next use
+            self.cats = None
+
+    def get(self, session, a_done, default=None):
+        """ category of a_done, or default if not in act_cats """
+        if a_done in self.unknown(session, [a_done]):
+            return default
+        return self.cats[a_done]
+
+    def unknown(self, session, acts):
+        """ returns the set of acts not in act_cats : those the cache doesn't know are looked up in the db (1 query) """
+        if self.cats is None:
+            self.load(session)
+        misses = {_a for _a in acts if _a not in self.cats}
+        if misses:
+            found = dict(session.query(s.ActvtyCat.a_done, s.ActvtyCat.a_cat).filter(s.ActvtyCat.a_done.in_(misses)))
+            self.cats.update(found)
+            misses.difference_update(found)
+        return misses
+
+    def ensure(self, session, acts, default_cat=None):
+        """ makes sure all acts are in act_cats : those the cache doesn't know are inserted with their category if acts is a dict
+        {a_done: a_cat} (when not None), else default_cat, by 1 bulk INSERT .. ON CONFLICT DO NOTHING, without looking them up first
+        (a name added by another process is left as it is). Part of the session's transaction (the cache gets the new names once
+        committed). Returns the sorted names that were missing from the cache (& not already added in this transaction)
+        """
+        if self.cats is None:
+            self.load(session)
+        missing = {_a for _a in acts if _a not in self.cats}
+        if missing:  # less those already added in this transaction (noted, not yet committed)
+            missing.difference_update(_c[2] for _c in session.info.get('dr_changes', ()) if _c[0] == 'set' and _c[1] == self.key)
+        missing = sorted(missing)
+        if missing:
+            rows = [{'a_done': _a, 'a_cat': (acts.get(_a) if isinstance(acts, dict) else None) or default_cat} for _a in missing]
+            conn = session.connection()
+            result = conn.execute(upsert(conn, s.ActvtyCat.__table__).on_conflict_do_nothing(index_elements=['a_done']), rows)
+            if result.rowcount == len(rows):
+                for _row in rows:
+                    note_change(session, ('set', self.key, _row['a_done'], _row['a_cat']))
+                for _cat, _cnt in Counter(_row['a_cat'] for _row in rows).items():
+                    note_change(session, ('add', 'act_cats.a_cat', _cat, _cnt))
+            else:  # some were there already, with a category of their own : looked up when next asked for
+                for _row in rows:
+                    note_change(session, ('remove', self.key, _row['a_done']))
+        return missing
+
+
+@event.listens_for(s.ActvtyCat, 'after_insert')
+@event.listens_for(s.ActvtyCat, 'after_update')
+def _note_cat_set(mapper, connection, target):
+    session = inspect(target).session
+    old_a_done = inspect(target).attrs.a_done.history.deleted
+    if old_a_done and old_a_done[0] != target.a_done:
+        note_change(session, ('remove', CategoryCache.key, old_a_done[0]))
+    note_change(session, ('set', CategoryCache.key, target.a_done, target.a_cat))
+
+
+@event.listens_for(s.ActvtyCat, 'after_delete')
+def _note_cat_remove(mapper, connection, target):
+    note_change(inspect(target).session, ('remove', CategoryCache.key, target.a_done))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_cats_reset(orm_execute_state):
+    # ORM bulk UPDATE / DELETE (eg query(ActvtyCat).update()) : no mapper events, & the rows changed aren't known
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is inspect(s.ActvtyCat):
+        note_change(orm_execute_state.session, ('reset', CategoryCache.key))
 
 
 def colvalue_is_default(session, orm_class, col_name, row):
-    _is_default = False
-    mapped_table = inspect(orm_class)  # returns a orm.Mapper object
-    if mapped_table.c[col_name].default is not None:  # returns None or ColumnDefault object
-        # print(f"{getattr(row, 'a_done', 0)} , {getattr(row, 'comments', 0)} : {mapped_table.c[col_name].default.arg}")
-        try:
-            _is_default = getattr(row, col_name, 0).lower() == mapped_table.c[col_name].default.arg.lower()  # returns value of default (eg ’NFI’) if ColumnDefault exists
-        except Exception as err:
-            _is_default = getattr(row, col_name, 0) == mapped_table.c[col_name].default.arg
-        # print("debug: %s : %s" % (row.a_done, _is_default))
-    return _is_default
+    return colvalues_are_default(orm_class, col_name, rows=[row])[0]
 
 
-def collapse_acts(session, act_list, updated_actvty_name):
+def colvalues_are_default(orm_class, col_name, values=None, rows=None):
+    """ returns boolean mask [True, False, ..] of whether each value (or each row's col_name value) is col_name's default.
+    Strings are compared case-insensitively ; columns without a (scalar) default are never default.
+    Uses s.COL_DEFAULTS, so no reflection per call.
+    """
+    if rows is not None:
+        values = [getattr(_row, col_name, None) for _row in rows]
+    default = s.COL_DEFAULTS.get(orm_class, {}).get(col_name)
+    if default is None:
+        return [False] * len(values)
+    if isinstance(default, str):
+        return [isinstance(_value, str) and _value.lower() == default for _value in values]
+    return [_value == default for _value in values]
+
+
+def collapse_acts(session, act_list, updated_actvty_name, bulk=True):
     """ collapse many records into 1 record. Move over activity to comments 
-    OBS: Changes objects, but does not commit! 
+    OBS: Changes records, but does not commit! 
+    bulk=True does it set-based, in the db (see collapse_acts_bulk) ; bulk=False loads & changes each ORM object.
+    Both return (num_concated, num_replaced)
     """
+    if bulk:
+        collapse_stats = collapse_acts_bulk(session, act_list, updated_actvty_name)
+        rename_rollups(session, act_list, updated_actvty_name)
+    else:  # rollups get updated record by record, as the changes are flushed
+        collapse_stats = collapse_acts_orm(session, act_list, updated_actvty_name)
+    note_change(session, ('rename', 'act_recs.a_done', tuple(act_list), updated_actvty_name))
+    return collapse_stats
+
+
+def collapse_acts_orm(session, act_list, updated_actvty_name):
     num_concated = 0
     num_replaced = 0
 
     # get all records with a_done in act_list
-    actvties_to_change = session.query(s.ActvtyRec).filter(s.ActvtyRec.a_done.in_(act_list))
-    for _actvty in actvties_to_change:
-        # if comment is default, then override with old a_done. Otherwise, concatenate :
-        if colvalue_is_default(session, orm_class=s.ActvtyRec, col_name='comments', row=_actvty):  # replace
+    actvties_to_change = session.query(s.ActvtyRec).filter(s.ActvtyRec.a_done.in_(act_list)).all()
+    is_default = colvalues_are_default(s.ActvtyRec, 'comments', rows=actvties_to_change)
+    for _actvty, _is_default in zip(actvties_to_change, is_default):
+        # if comment is default (or NULL, as collapse_acts_bulk), then override with old a_done. Otherwise, concatenate :
+        if _is_default or _actvty.comments is None:  # replace
             _actvty.comments = _actvty.a_done
             num_replaced += 1
         else:  # concatenate
@@ -41,5 +419,559 @@ def collapse_acts(session, act_list, updated_actvty_name):
     return (num_concated, num_replaced)
 
 
+def collapse_acts_bulk(session, act_list, updated_actvty_name):
+    """ same as collapse_acts_orm, but as 1 aggregate SELECT (for the stats) + 1 UPDATE .. CASE, so no rows are loaded.
+    NULL comments are treated like the default (ie replaced).
+    ActvtyRec objects already in the session are expired, so they reload the updated values when next accessed.
+    """
+    rec = s.ActvtyRec
+    is_default = or_(rec.comments.is_(None), func.lower(rec.comments) == s.COL_DEFAULTS[rec]['comments'])
+    to_change = rec.a_done.in_(act_list)
+
+    num_replaced, num_total = session.query(func.sum(case((is_default, 1), else_=0)), func.count(rec.a_id)).filter(to_change).one()
+    num_replaced = num_replaced or 0
+
+    session.flush()  # so pending changes to these records aren't lost when expiring them below
+    session.query(rec).filter(to_change).update({rec.comments: case((is_default, rec.a_done), else_=rec.comments + " " + rec.a_done),
+                                                 rec.a_done: updated_actvty_name},
+                                                synchronize_session=False)
+    for _obj in list(session.identity_map.values()):
+        if isinstance(_obj, rec) and inspect(_obj).dict.get('a_done') in act_list:
+            session.expire(_obj)
+    return (num_total - num_replaced, num_replaced)
+
+
+def suggest_collapses(name_counts, min_score=COLLAPSE_MIN_SCORE, prefix_extra=COLLAPSE_PREFIX_EXTRA):
+    """ suggests collapses of near-duplicate names (eg 'yoga' / 'Hatha yoga', 'email' / 'emailing') : returns [(act_list, target), ..],
+    most records moved first, each ready for collapse_acts(session, act_list, target).
+    name_counts : {name: count} (eg NameIndex.counts) or [(name, count), ..] (eg search_names(session, column_obj, '')).
+    Names are compared on the n-grams of their lower-cased words, padded by a space : score = shared / n-grams of the shorter name.
+    Going from most to least used, each name joins the best scoring target (score >= min_score), else becomes a target itself :
+    so the target of a group is its most used name, & groups don't chain ('a' ~ 'ab' ~ 'abc' ..) through names that aren't targets.
+    Candidate targets are looked up in n-gram postings (a blocking index) rather than compared to every name. With its n-grams
+    rarest first, a name sharing min_score of them shares at least need = len(prefix) - (len - ceil(min_score * len)) of its
+    first len - ceil(min_score * len) + 1 + prefix_extra (its prefix) : so targets are posted under their prefix's n-grams (found
+    from any of the name's, when the target is the shorter) & under all theirs (found from the name's prefix's, when the name is),
+    & only those counted at least need times are scored. Only the rare n-grams' postings get probed much.
+    """
+    name_counts = dict(name_counts)
+    keys = {_name: ' '.join(re.findall(r'\w+', _name.lower())) for _name in name_counts}
+    grams = {_name: ngrams(' %s ' % _key) for _name, _key in keys.items() if _key}
+    names_per_gram = Counter(_gram for _grams in grams.values() for _gram in _grams)
+    all_postings = defaultdict(list)  # ngram -> targets containing it
+    prefix_postings = defaultdict(list)  # ngram -> targets with it in their prefix
+    needs = dict()  # target -> least prefix n-grams a name contains to score min_score against it (when the target's the shorter)
+    by_key = dict()  # words -> target, so names differing in case or punctuation only join without scoring
+    collapsed = dict()  # target -> names collapsing into it
+
+    def prefix(name):
+        """ returns (prefix, need) of name """
+        rarest = sorted(grams[name], key=lambda _gram: (names_per_gram[_gram], _gram))
+        spare = len(rarest) - math.ceil(min_score * len(rarest) - 1e-9)  # n-grams name may have that the other one hasn't
+        name_prefix = rarest[:spare + 1 + prefix_extra]
+        return name_prefix, len(name_prefix) - spare
+
+    for _name in sorted(grams, key=lambda _n: (-name_counts[_n], _n)):
+        target = by_key.get(keys[_name])
+        name_grams = grams[_name]
+        name_prefix, need = prefix(_name)
+        if target is None:
+            shorter_targets = Counter(_t for _gram in name_grams for _t in prefix_postings.get(_gram, ()))
+            longer_targets = Counter(_t for _gram in name_prefix for _t in all_postings.get(_gram, ()))
+            candidates = ([_t for _t, _n in shorter_targets.items() if _n >= needs[_t] and len(grams[_t]) <= len(name_grams)]
+                          + [_t for _t, _n in longer_targets.items() if _n >= need and len(grams[_t]) > len(name_grams)])
+            best = max(((len(name_grams & grams[_t]) / min(len(name_grams), len(grams[_t])), name_counts[_t], _t) for _t in candidates),
+                       default=None)
+            if best is not None and best[0] >= min_score:
+                target = best[2]
+        if target is None:  # a new target
+            collapsed[_name] = []
+            needs[_name] = need
+            by_key[keys[_name]] = _name
+            for _gram in name_grams:
+                all_postings[_gram].append(_name)
+            for _gram in name_prefix:
+                prefix_postings[_gram].append(_name)
+        else:
+            collapsed[target].append(_name)
+            by_key.setdefault(keys[_name], target)
+    suggestions = [(_act_list, _target) for _target, _act_list in collapsed.items() if _act_list]
+    suggestions.sort(key=lambda _s: (-sum(name_counts[_n] for _n in _s[0]), _s[1]))
+    return suggestions
+
+
+# ====== DAILY ROLLUPS =============================================================================
+# act_rollups (s.ActvtyRollup) gets the same changes as act_recs, in the same transaction :
+# ORM inserts / updates / deletes of ActvtyRec via mapper events, bulk (Core) writes by calling apply_rollup_deltas / rename_rollups
+
+def interval_pieces(day, startt, endt):
+    """ [(day, minutes), ..] of an interval : 1 piece, or 2 if it crosses midnight ; [] if the day or a time is missing """
+    if day is None or startt is None or endt is None:
+        return []
+    start_min, end_min = startt.hour * 60 + startt.minute, endt.hour * 60 + endt.minute
+    if end_min >= start_min:
+        return [(day, end_min - start_min)]
+    pieces = [(day, MINS_PER_DAY - start_min)]
+    if end_min > 0:
+        pieces.append((day + dt.timedelta(days=1), end_min))
+    return pieces
+
+
+def rollup_deltas(recs, sign=1, deltas=None):
+    """ adds the minutes & counts of recs (tuples of day, startt, endt, a_done) to deltas : {(day, a_done): [minutes, rec_count]} """
+    deltas = defaultdict(lambda: [0, 0]) if deltas is None else deltas
+    for _day, _startt, _endt, _a_done in recs:
+        for _i, (_piece_day, _mins) in enumerate(interval_pieces(_day, _startt, _endt)):
+            _delta = deltas[(_piece_day, _a_done)]
+            _delta[0] += sign * _mins
+            _delta[1] += sign * (_i == 0)
+    return deltas
+
+
+def upsert(connection, table):
+    """ INSERT .. ON CONFLICT statement for table, for the connection's dialect (sqlite or postgresql) """
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects import postgresql  # only then : importing it slows every start
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def apply_rollup_deltas(connection, deltas):
+    """ adds deltas (see rollup_deltas) to act_rollups with 1 executemany upsert ; drops rows brought down to nothing """
+    if not deltas:
+        return
+    roll = s.ActvtyRollup.__table__
+    stmt = upsert(connection, roll)
+    stmt = stmt.on_conflict_do_update(index_elements=[roll.c.day, roll.c.a_done],
+                                      set_={'minutes': roll.c.minutes + stmt.excluded.minutes, 'rec_count': roll.c.rec_count + stmt.excluded.rec_count})
+    connection.execute(stmt, [{'day': _day, 'a_done': _a_done, 'minutes': _mins, 'rec_count': _cnt} for (_day, _a_done), (_mins, _cnt) in deltas.items()])
+    if any(_mins < 0 or _cnt < 0 for _mins, _cnt in deltas.values()):
+        connection.execute(roll.delete().where(roll.c.minutes <= 0, roll.c.rec_count <= 0))
+
+
+def rename_rollups(session, act_list, updated_actvty_name):
+    """ moves act_list's rollups to updated_actvty_name (as collapse_acts does to records) : reads & writes O(days) rows """
+    roll = s.ActvtyRollup
+    old_names = [_a for _a in act_list if _a != updated_actvty_name]
+    moved = (session.query(roll.day, func.sum(roll.minutes), func.sum(roll.rec_count))
+             .filter(roll.a_done.in_(old_names)).group_by(roll.day).all())
+    session.query(roll).filter(roll.a_done.in_(old_names)).delete(synchronize_session=False)
+    apply_rollup_deltas(session.connection(), {(_day, updated_actvty_name): [_mins, _cnt] for _day, _mins, _cnt in moved})
+
+
+def rebuild_rollups(session, chunk_rows=EXPORT_CHUNK_ROWS):
+    """ recomputes act_rollups from scratch, streaming all records (eg after writes that bypassed dr_bll). Does not commit.
+    Returns number of rollup rows
+    """
+    rec = s.ActvtyRec
+    deltas = rollup_deltas(session.query(rec.day, rec.startt, rec.endt, rec.a_done).yield_per(chunk_rows))
+    session.query(s.ActvtyRollup).delete(synchronize_session=False)
+    apply_rollup_deltas(session.connection(), deltas)
+    return len(deltas)
+
+
+def _rec_values(target, previous=False):
+    """ (day, startt, endt, a_done) of an ActvtyRec, as it was before its pending changes if previous """
+    values = []
+    for _key in ('day', 'startt', 'endt', 'a_done'):
+        _history = inspect(target).attrs[_key].history
+        values.append(_history.deleted[0] if previous and _history.deleted else getattr(target, _key))
+    return tuple(values)
+
+
+@event.listens_for(s.ActvtyRec, 'after_insert')
+def _rollup_insert(mapper, connection, target):
+    apply_rollup_deltas(connection, rollup_deltas([_rec_values(target)]))
+
+
+@event.listens_for(s.ActvtyRec, 'before_delete')
+def _rollup_delete(mapper, connection, target):
+    apply_rollup_deltas(connection, rollup_deltas([_rec_values(target, previous=True)], sign=-1))
+
+
+@event.listens_for(s.ActvtyRec, 'after_update')
+def _rollup_update(mapper, connection, target):
+    previous, current = _rec_values(target, previous=True), _rec_values(target)
+    if previous != current:
+        deltas = rollup_deltas([previous], sign=-1)
+        apply_rollup_deltas(connection, rollup_deltas([current], deltas=deltas))
+
+
+# ====== OVERLAPS ==================================================================================
+
+def timeline_interval(day, startt, endt):
+    """ (start, end) of an interval in seconds on a continuous timeline (day number * 86400 + seconds since midnight),
+    end being on the next day if endt < startt (ie crosses midnight)
+    """
+    start = day.toordinal() * SECS_PER_DAY + startt.hour * 3600 + startt.minute * 60 + startt.second
+    end = day.toordinal() * SECS_PER_DAY + endt.hour * 3600 + endt.minute * 60 + endt.second
+    return start, end if end >= start else end + SECS_PER_DAY
+
+
+def find_overlaps(session, day, startt, endt, exclude_id=None):
+    """ returns records overlapping the interval (day, startt, endt), eg before recording it. Intervals merely touching
+    (one ending when the other starts) don't overlap. Range query over the (day, startt) index : only days -1 .. +1 are read
+    """
+    rec = s.ActvtyRec
+    start, end = timeline_interval(day, startt, endt)
+    candidates = session.query(rec).filter(rec.day.between(day - dt.timedelta(days=1), day + dt.timedelta(days=1)),
+                                           rec.startt.isnot(None), rec.endt.isnot(None))
+    if exclude_id is not None:
+        candidates = candidates.filter(rec.a_id != exclude_id)
+    overlaps = []
+    for _rec in candidates.order_by(rec.day, rec.startt):
+        _start, _end = timeline_interval(_rec.day, _rec.startt, _rec.endt)
+        if _start < end and start < _end:
+            overlaps.append(_rec)
+    return overlaps
+
+
+def scan_overlaps(session):
+    """ returns [(a_id, a_id), ..] of all pairs of overlapping records in the history, in O(n log n) (+ number of pairs) :
+    a sweep over the intervals sorted by start, keeping a heap of the ends of those still running. Records without a day or
+    a time aren't on the timeline, so are left out
+    """
+    rec = s.ActvtyRec
+    intervals = sorted((timeline_interval(_day, _startt, _endt), _a_id) for _a_id, _day, _startt, _endt
+                       in session.query(rec.a_id, rec.day, rec.startt, rec.endt).filter(rec.day.isnot(None), rec.startt.isnot(None),
+                                                                                          rec.endt.isnot(None)))
+    running = []  # heap of (end, a_id)
+    overlaps = []
+    for (_start, _end), _a_id in intervals:
+        while running and running[0][0] <= _start:
+            heapq.heappop(running)
+        overlaps.extend((_other_id, _a_id) for _other_end, _other_id in running)
+        heapq.heappush(running, (_end, _a_id))
+    return overlaps
+
+
+# ====== IMPORT ====================================================================================
+
+@functools.lru_cache(maxsize=None)
+def parse_date_str(date_str):
+    """ ISO dates parsed natively ; anything else by dateutil. Cached, since logs repeat the same days over & over """
+    try:
+        return dt.date.fromisoformat(date_str)
+    except ValueError:
+        from dateutil.parser import parse  # only now : most dates are iso, & importing it slows every start (eg dr_ui --record)
+        return parse(date_str).date()
+
+
+@functools.lru_cache(maxsize=None)
+def parse_time_str(time_str):
+    try:
+        return dt.time.fromisoformat(time_str)
+    except ValueError:
+        from dateutil.parser import parse
+        return parse(time_str).time()
+
+
+def read_act_chunks(path, fmt=None, chunk_rows=IMPORT_CHUNK_ROWS):
+    """ yields lists of up to chunk_rows dicts (column name -> value) from a csv or parquet file (fmt from its extension if None) """
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq  # optional dependency, only needed for parquet
+        for _batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield _batch.to_pylist()
+    elif fmt == 'csv':
+        with open(path, newline='') as csv_file:
+            chunk = []
+            for _row in csv.DictReader(csv_file):
+                chunk.append(_row)
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+    else:
+        raise ValueError("Unknown import format : %s (use csv or parquet)" % fmt)
+
+
+def import_acts(session, path, fmt=None, chunk_rows=IMPORT_CHUNK_ROWS, default_cat=None, cat_cache=None):
+    """ bulk loads activity records from a csv / parquet file with columns day, startt, endt, a_done [, comments, a_cat].
+    Reads chunk_rows at a time ; activities missing from act_cats are first added (with the row's a_cat, else default_cat),
+    then the chunk's records are inserted with 1 executemany. All in 1 transaction : commits at the end, rolls back on error.
+    cat_cache : a CategoryCache to check activities against (else a temporary one is loaded)
+    Returns dict of stats : rows, cats_added, secs, rows_per_sec
+    """
+    t0 = time.perf_counter()
+    rec_table = s.ActvtyRec.__table__
+    default_comments = rec_table.c.comments.default.arg
+    conn = session.connection()
+    cats = cat_cache if cat_cache is not None else CategoryCache()
+    num_rows = num_cats = 0
+    try:
+        for _chunk in read_act_chunks(path, fmt, chunk_rows):
+            recs, chunk_cats = [], dict()
+            for _row in _chunk:
+                rec = {'day': _row['day'], 'startt': _row['startt'], 'endt': _row['endt'], 'a_done': _row['a_done'],
+                       'comments': _row.get('comments') or default_comments}
+                for _col, _parse in (('day', parse_date_str), ('startt', parse_time_str), ('endt', parse_time_str)):
+                    if isinstance(rec[_col], str):
+                        rec[_col] = _parse(rec[_col])
+                if chunk_cats.get(rec['a_done']) is None:
+                    chunk_cats[rec['a_done']] = _row.get('a_cat')
+                recs.append(rec)
+            num_cats += len(cats.ensure(session, chunk_cats, default_cat))
+            conn.execute(rec_table.insert(), recs)
+            apply_rollup_deltas(conn, rollup_deltas([(_r['day'], _r['startt'], _r['endt'], _r['a_done']) for _r in recs]))
+            for _act, _cnt in Counter(_rec['a_done'] for _rec in recs).items():
+                note_change(session, ('add', 'act_recs.a_done', _act, _cnt))
+            num_rows += len(recs)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        if cat_cache is None:
+            cats.close()
+    secs = time.perf_counter() - t0
+    return {'rows': num_rows, 'cats_added': num_cats, 'secs': secs, 'rows_per_sec': num_rows / secs if secs else 0.}
+
+
+# ====== EXPORT ====================================================================================
+
+def export_schema():
+    import pyarrow as pa  # optional dependency, only needed for exports
+    return pa.schema([('a_id', pa.int64()), ('day', pa.date32()), ('startt', pa.time32('s')), ('endt', pa.time32('s')),
+                      ('a_done', pa.string()), ('comments', pa.string()), ('a_cat', pa.string())])
+
+
+def query_acts_with_cats(session, day_from=None, day_to=None, a_cat=None):
+    """ query of records (a_id, day, startt, endt, a_done, comments, a_cat), optionally within [day_from, day_to] & of 1 category """
+    rec, cat = s.ActvtyRec, s.ActvtyCat
+    results = session.query(rec.a_id, rec.day, rec.startt, rec.endt, rec.a_done, rec.comments, cat.a_cat).outerjoin(cat, rec.a_done == cat.a_done)
+    if day_from is not None:
+        results = results.filter(rec.day >= day_from)
+    if day_to is not None:
+        results = results.filter(rec.day <= day_to)
+    if a_cat is not None:
+        results = results.filter(cat.a_cat == a_cat)
+    return results.order_by(rec.a_id)
+
+
+def iter_act_batches(session, day_from=None, day_to=None, a_cat=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """ yields pyarrow RecordBatch's of up to chunk_rows records (see query_acts_with_cats), streamed from the db,
+    so memory stays bounded whatever the number of records. Days & times are typed date32 / time32
+    """
+    import pyarrow as pa
+    schema = export_schema()
+
+    def to_batch(rows):
+        return pa.RecordBatch.from_arrays([pa.array(_col, type=_field.type) for _col, _field in zip(zip(*rows), schema)], schema=schema)
+
+    results = query_acts_with_cats(session, day_from, day_to, a_cat).execution_options(stream_results=True).yield_per(chunk_rows)
+    chunk = []
+    for _row in results:
+        chunk.append(_row)
+        if len(chunk) >= chunk_rows:
+            yield to_batch(chunk)
+            chunk = []
+    if chunk:
+        yield to_batch(chunk)
+
+
+def export_acts(session, path, fmt=None, day_from=None, day_to=None, a_cat=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """ writes records joined with their category to a parquet or arrow (IPC file) file, chunk_rows at a time
+    (fmt from path's extension if None : .parquet, .arrow / .feather / .ipc).
+    Returns dict of stats : rows, secs, rows_per_sec
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    t0 = time.perf_counter()
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(path, export_schema())
+    elif fmt in ('arrow', 'feather', 'ipc'):
+        writer = pa.ipc.new_file(path, export_schema())
+    else:
+        raise ValueError("Unknown export format : %s (use parquet or arrow)" % fmt)
+    num_rows = 0
+    with writer:
+        for _batch in iter_act_batches(session, day_from, day_to, a_cat, chunk_rows):
+            writer.write_batch(_batch)
+            num_rows += _batch.num_rows
+    secs = time.perf_counter() - t0
+    return {'rows': num_rows, 'secs': secs, 'rows_per_sec': num_rows / secs if secs else 0.}
+
+
+# ====== BUFFERED RECORDING ========================================================================
+
+class UnknownActivity(ValueError):
+    """ a record's activity isn't in act_cats (& BufferedRecorder wasn't asked to add it) """
+
+
+class BufferedRecorder:
+    """
+    write-behind buffer for activity records fed by automated trackers : records are queued (bounded : record() blocks
+    when RECORD_QUEUE_SIZE are waiting) & written by 1 thread in group commits, of up to max_rows records or whatever
+    arrived within flush_secs of the first, so 1 commit (fsync) is shared by many records.
+    Activities are checked against a CategoryCache (cat_cache, else one of its own) : missing ones are added in the group's
+    transaction (with default_cat), or rejected with UnknownActivity if add_missing is False : no interactive prompting.
+    Durability : record() / submit() return a Future, resolved with the a_id(s) once their group is committed (as durable as
+    the db's profile makes commits, see s.SQLITE_PROFILES), or with the exception if it couldn't be written. Until then records
+    are only in memory : flush() waits for all queued so far, close() flushes & stops ; both also run at interpreter exit
+    (atexit), but a killed process loses what's queued.
+    Usage:
+        recorder = BufferedRecorder(dal)
+        future = recorder.record(s.ActvtyRec(day=.., startt=.., endt=.., a_done='yoga'))
+        ...
+        recorder.close()
+    """
+
+    def __init__(self, dal, max_rows=RECORD_BATCH_ROWS, flush_secs=RECORD_FLUSH_SECS, queue_size=RECORD_QUEUE_SIZE,
+                 default_cat=None, add_missing=True, cat_cache=None):
+        self.dal = dal
+        self.max_rows = max_rows
+        self.flush_secs = flush_secs
+        self.default_cat = default_cat
+        self.add_missing = add_missing
+        self.cat_cache = cat_cache if cat_cache is not None else CategoryCache()
+        self._own_cat_cache = cat_cache is None
+        self.stats = Counter()  # commits, rows, cats_added, rejected
+        self._queue = queue.Queue(queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='BufferedRecorder', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, recs, block=True, timeout=None):
+        """ queues ActvtyRec's that are written together (all or none) ; returns a Future of their a_ids.
+        Raises queue.Full if the queue stays full for timeout secs (or at once if not block)
+        """
+        if self._closed:
+            raise RuntimeError("BufferedRecorder is closed")
+        future = Future()
+        self._queue.put((list(recs), future), block, timeout)
+        return future
+
+    def record(self, rec, block=True, timeout=None):
+        """ queues 1 ActvtyRec ; returns a Future of its a_id """
+        future = Future()
+        self.submit([rec], block, timeout).add_done_callback(
+            lambda _f: future.set_exception(_f.exception()) if _f.exception() else future.set_result(_f.result()[0]))
+        return future
+
+    def flush(self, timeout=None):
+        """ waits until everything queued so far is written (or failed) """
+        if self._closed:
+            raise RuntimeError("BufferedRecorder is closed")
+        future = Future()
+        self._queue.put((None, future))
+        future.result(timeout)
+
+    def close(self):
+        """ flushes, then stops the writer thread ; further records are refused """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if self._own_cat_cache:
+            self.cat_cache.close()
+        atexit.unregister(self.close)
+
+    def _next_group(self):
+        """ [(recs, future)] to write together, or None once closed ; flush markers are answered once what came before is written """
+        item = self._queue.get()
+        if item is None:
+            return None
+        group, flushes, rows = [], [], 0
+        deadline = time.monotonic() + self.flush_secs
+        while True:
+            if item is None:  # close() : write this group, then stop
+                self._queue.put(None)
+                break
+            recs, future = item
+            if recs is None:  # flush()
+                flushes.append(future)
+                break
+            group.append(item)
+            rows += len(recs)
+            if rows >= self.max_rows:
+                break
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+        return group, flushes
+
+    def _resolve_cats(self, session, group):
+        """ adds activities missing from act_cats, or takes the groups with any out ; returns the groups left """
+        acts = {_rec.a_done for _recs, _future in group for _rec in _recs}
+        if self.add_missing:
+            self.stats['cats_added'] += len(self.cat_cache.ensure(session, acts, self.default_cat))
+            return group
+        missing = self.cat_cache.unknown(session, acts)
+        if not missing:
+            return group
+        kept = []
+        for _recs, _future in group:
+            _unknown = sorted({_rec.a_done for _rec in _recs} & missing)
+            if _unknown:
+                self.stats['rejected'] += len(_recs)
+                _future.set_exception(UnknownActivity("Not in the category table : %s" % ', '.join(_unknown)))
+            else:
+                kept.append((_recs, _future))
+        return kept
+
+    def _write(self, group):
+        """ writes group in 1 transaction ; returns [((recs, future), a_ids)] of the (recs, future) still in it.
+        Core inserts (1 per record, for its a_id) & 1 rollup update for the lot, rather than the ORM's flush & per-record rollup events
+        """
+        with self.dal.session_scope() as session:
+            group = self._resolve_cats(session, group)
+            conn, insert = session.connection(), s.ActvtyRec.__table__.insert()
+            cols = ('day', 'startt', 'endt', 'a_done', 'comments')
+            a_ids = []
+            for _recs, _future in group:
+                a_ids.append([conn.execute(insert, {_col: getattr(_rec, _col) for _col in cols if getattr(_rec, _col) is not None})
+                              .inserted_primary_key[0] for _rec in _recs])
+            recs = [_rec for _recs, _future in group for _rec in _recs]
+            apply_rollup_deltas(conn, rollup_deltas([(_r.day, _r.startt, _r.endt, _r.a_done) for _r in recs]))
+            for _act, _cnt in Counter(_rec.a_done for _rec in recs).items():
+                note_change(session, ('add', 'act_recs.a_done', _act, _cnt))
+        self.stats['commits'] += 1
+        self.stats['rows'] += len(recs)
+        return list(zip(group, a_ids))
+
+    def _run(self):
+        while True:
+            next_group = self._next_group()
+            if next_group is None:
+                break
+            group, flushes = next_group
+            try:
+                self._write_group(group)
+            except Exception as err:  # unexpected : fail what's still pending, but keep the writer going for later records
+                for _recs, _future in group:
+                    if not _future.done():
+                        self.stats['rejected'] += len(_recs)
+                        _future.set_exception(err)
+            for _future in flushes:
+                _future.set_result(None)
+
+    def _write_group(self, group):
+        """ writes group, resolving each future with its a_ids or the exception. Futures already resolved (eg records rejected
+        by _resolve_cats before the group's transaction failed) are left as they are
+        """
+        if not group:
+            return
+        try:
+            written = self._write(group)
+        except Exception:  # eg a unique constraint : write each submit on its own, so only the bad ones fail
+            written = []
+            for _item in group:
+                if _item[1].done():
+                    continue
+                try:
+                    written += self._write([_item])
+                except Exception as err:
+                    if not _item[1].done():
+                        self.stats['rejected'] += len(_item[0])
+                        _item[1].set_exception(err)
+        for (_recs, _future), _ids in written:
+            _future.set_result(_ids)
+
 if __name__ == '__main__':
     pass
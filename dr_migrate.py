@@ -0,0 +1,252 @@
+"""
+Chunked, resumable table rebuilds (sqlite), for schema changes sqlite can't ALTER in place (eg adding a constraint) :
+rows are copied from the table into a new one batch_rows at a time, each batch in a short transaction of its own that also
+saves a checkpoint (the last key copied). So memory & lock time stay bounded whatever the table's size, other connections
+keep writing between batches, & an interrupted copy resumes from its checkpoint. Writes to the table while it's copied
+are logged by triggers, & the rows they touched copied again. Finally the new table replaces the old one in 1 transaction
+(indexes & the old table's triggers recreated).
+From an alembic migration (its transaction is committed first, as the copy commits on connections of its own) :
+    def upgrade():
+        with op.get_context().autocommit_block():
+            dr_migrate.TableCopy(op.get_bind().engine, new_act_recs, transform=..).run()
+or, to rebuild a table as dr_schema defines it :
+    python dr_migrate.py rebuild day_record.db act_recs [--batch-rows 20000]
+"""
+
+import time
+import argparse
+from collections import Counter
+
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import dr_schema as s
+
+
+# ====== CONSTANTS =================================================================================
+MIGRATE_BATCH_ROWS = 20000  # rows copied per transaction
+MIGRATE_PAUSE_RATIO = 1.  # pause after each batch, as a ratio of its time : sqlite doesn't queue writers (a busy one retries
+# now & then, so would rarely get the lock between 2 back to back batches)
+PROGRESS_SECS = 2.  # least time between 2 progress reports
+NEW_TABLE_SUFFIX = '__new'
+CHECKPOINTS_DDL = ("CREATE TABLE IF NOT EXISTS dr_migrate_checkpoints (name TEXT PRIMARY KEY, last_key, rows INTEGER NOT NULL DEFAULT 0, "
+                   "recopied INTEGER NOT NULL DEFAULT 0, secs REAL NOT NULL DEFAULT 0)")
+CHANGES_DDL = "CREATE TABLE IF NOT EXISTS dr_migrate_changes (name TEXT, key, PRIMARY KEY (name, key))"
+CHANGE_TRIGGERS = {  # log the keys written to while the table is copied
+    'insert': "AFTER INSERT ON {name} BEGIN INSERT OR IGNORE INTO dr_migrate_changes VALUES ('{name}', new.{key}); END",
+    'update': "AFTER UPDATE ON {name} BEGIN INSERT OR IGNORE INTO dr_migrate_changes VALUES ('{name}', old.{key}); "
+              "INSERT OR IGNORE INTO dr_migrate_changes VALUES ('{name}', new.{key}); END",
+    'delete': "AFTER DELETE ON {name} BEGIN INSERT OR IGNORE INTO dr_migrate_changes VALUES ('{name}', old.{key}); END",
+}
+
+# ===================================================================================================
+
+
+def print_progress(stats):
+    print("... %s : %d / %d rows (%.0f%%), %.0f rows/s, %d copied again, eta %.0f s, longest lock %.3f s"
+          % (stats['table'], stats['rows'], stats['total'], 100. * stats['rows'] / max(stats['total'], 1), stats['rows_per_sec'],
+             stats['recopied'], stats['eta_secs'], stats['max_lock_secs']))
+
+
+class TableCopy:
+    """
+    rebuilds the sqlite table named as table (a Table, its new definition) : copied into <name>__new batch by batch, in the
+    order of key (a column of unique, non null values : by default the primary key's), then swapped in.
+    transform(row) takes a dict of a row's raw db values (as stored : eg day numbers, see s.DayNumber) & returns the dict to
+    insert (only the new table's columns are kept), or None to leave the row out.
+    Progress (dict of table, rows, total, recopied, rows_per_sec, eta_secs, max_lock_secs) is passed to progress every
+    progress_secs, & once done (with swap_secs). Other connections can write during the pauses (pause_ratio : see MIGRATE_PAUSE_RATIO)
+    Usage:
+        stats = TableCopy(engine, s.ActvtyRec.__table__).run()  # again after an interruption : resumes
+    """
+
+    def __init__(self, engine, table, key=None, transform=None, batch_rows=MIGRATE_BATCH_ROWS, pause_ratio=MIGRATE_PAUSE_RATIO,
+                 progress=print_progress, progress_secs=PROGRESS_SECS):
+        if engine.dialect.name != 'sqlite':
+            raise ValueError("TableCopy is for sqlite, not %s" % engine.dialect.name)
+        if key is None:
+            if len(table.primary_key.columns) != 1:
+                raise ValueError("%s has no single column primary key : pass key" % table.name)
+            key = table.primary_key.columns.values()[0].name
+        self.engine = engine
+        self.table = table
+        self.name = table.name
+        self.new_name = table.name + NEW_TABLE_SUFFIX
+        self.key = key
+        self.transform = transform
+        self.batch_rows = batch_rows
+        self.pause_ratio = pause_ratio
+        self.progress = progress
+        self.progress_secs = progress_secs
+        self.stats = Counter()  # batches, max_lock_secs (& rows, recopied, secs : since the copy started, resumes included)
+        self.columns = [_col.name for _col in table.columns]
+
+    def run(self):
+        """ copies what's left (from the checkpoint), then swaps the tables ; returns the last progress dict """
+        raw = self.engine.raw_connection()
+        conn = raw.connection  # sqlite3 connection, in autocommit mode : transactions are begun explicitly
+        isolation_level, conn.isolation_level = conn.isolation_level, None
+        try:
+            self._start(conn)
+            last_report = time.perf_counter()
+            while True:
+                _t = time.perf_counter()
+                copied = self._transaction(conn, self._copy_batch)
+                self._transaction(conn, self._copy_changes)
+                batch_secs = time.perf_counter() - _t
+                self._add_secs(conn, batch_secs)
+                if not copied:
+                    break
+                if self.progress is not None and time.perf_counter() - last_report >= self.progress_secs:
+                    self.progress(self._progress(conn))
+                    last_report = time.perf_counter()
+                time.sleep(batch_secs * self.pause_ratio)
+            stats = self._progress(conn)
+            stats['swap_secs'] = self._swap(conn)
+        finally:
+            conn.isolation_level = isolation_level
+            raw.close()
+        if self.progress is not None:
+            self.progress(stats)
+        return stats
+
+    def _transaction(self, conn, step):
+        """ runs step(conn) in a write transaction (BEGIN IMMEDIATE : the write lock from the start, so reads & writes of
+        the step see the same table) ; returns its result
+        """
+        _t = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = step(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self.stats['max_lock_secs'] = max(self.stats['max_lock_secs'], time.perf_counter() - _t)
+        return result
+
+    def _start(self, conn):
+        """ new table, change triggers & checkpoint : created unless resuming """
+        create = str(CreateTable(self.table).compile(dialect=self.engine.dialect)).strip()  # as the table's, under the new name
+        table_name = self.engine.dialect.identifier_preparer.format_table(self.table)
+        ddl = [CHECKPOINTS_DDL, CHANGES_DDL, create.replace('CREATE TABLE %s ' % table_name, 'CREATE TABLE IF NOT EXISTS %s ' % self.new_name, 1)]
+        ddl += ['CREATE TRIGGER IF NOT EXISTS dr_migrate_%s_%s %s' % (self.name, _event, _sql.format(name=self.name, key=self.key))
+                for _event, _sql in CHANGE_TRIGGERS.items()]
+        ddl.append("INSERT OR IGNORE INTO dr_migrate_checkpoints (name) VALUES ('%s')" % self.name)
+        self._transaction(conn, lambda _conn: [_conn.execute(_sql) for _sql in ddl])
+
+    def _checkpoint(self, conn):
+        return conn.execute("SELECT last_key, rows, recopied, secs FROM dr_migrate_checkpoints WHERE name = ?", (self.name,)).fetchone()
+
+    def _insert(self, conn, names, rows):
+        """ inserts the transformed rows (tuples of the old table's columns names) into the new table """
+        values = []
+        for _row in rows:
+            _row = dict(zip(names, _row))
+            if self.transform is not None:
+                _row = self.transform(_row)
+            if _row is not None:
+                values.append(_row)
+        if values:
+            columns = [_col for _col in self.columns if _col in values[0]]
+            conn.executemany('INSERT INTO %s (%s) VALUES (%s)' % (self.new_name, ', '.join(columns), ', '.join('?' * len(columns))),
+                             [[_row.get(_col) for _col in columns] for _row in values])
+
+    def _copy_batch(self, conn):
+        """ copies the next batch_rows (after the checkpoint) ; returns their number (0 : all copied) """
+        last_key = self._checkpoint(conn)[0]
+        where = '' if last_key is None else 'WHERE %s > ?' % self.key
+        cursor = conn.execute('SELECT * FROM %s %s ORDER BY %s LIMIT %d' % (self.name, where, self.key, self.batch_rows),
+                              () if last_key is None else (last_key,))
+        names, batch = [_d[0] for _d in cursor.description], cursor.fetchall()
+        if not batch:
+            return 0
+        self._insert(conn, names, batch)
+        conn.execute("UPDATE dr_migrate_checkpoints SET last_key = ?, rows = rows + ? WHERE name = ?", (batch[-1][names.index(self.key)], len(batch), self.name))
+        self.stats['batches'] += 1
+        return len(batch)
+
+    def _copy_changes(self, conn, limit=None):
+        """ copies again up to batch_rows (or limit) logged rows that were already copied ; returns number of keys logged """
+        limit = self.batch_rows if limit is None else limit
+        keys = [_k for _k, in conn.execute("SELECT key FROM dr_migrate_changes WHERE name = ? LIMIT ?", (self.name, limit))]
+        if not keys:
+            return 0
+        marks = ', '.join('?' * len(keys))
+        conn.execute("DELETE FROM dr_migrate_changes WHERE name = ? AND key IN (%s)" % marks, [self.name] + keys)
+        last_key = self._checkpoint(conn)[0]
+        copied = [_k for _k in keys if last_key is not None and _k <= last_key]  # the others are still to be copied by batches
+        if copied:
+            marks = ', '.join('?' * len(copied))
+            conn.execute("DELETE FROM %s WHERE %s IN (%s)" % (self.new_name, self.key, marks), copied)
+            cursor = conn.execute("SELECT * FROM %s WHERE %s IN (%s)" % (self.name, self.key, marks), copied)
+            self._insert(conn, [_d[0] for _d in cursor.description], cursor.fetchall())
+            conn.execute("UPDATE dr_migrate_checkpoints SET recopied = recopied + ? WHERE name = ?", (len(copied), self.name))
+        return len(keys)
+
+    def _add_secs(self, conn, secs):
+        conn.execute("UPDATE dr_migrate_checkpoints SET secs = secs + ? WHERE name = ?", (secs, self.name))
+
+    def _progress(self, conn):
+        last_key, rows, recopied, secs = self._checkpoint(conn)
+        total = conn.execute('SELECT count(*) FROM %s' % self.name).fetchone()[0]
+        rows_per_sec = rows / secs if secs else 0.
+        return {'table': self.name, 'rows': rows, 'total': max(total, rows), 'recopied': recopied, 'rows_per_sec': rows_per_sec,
+                'eta_secs': max(total - rows, 0) / rows_per_sec if rows_per_sec else 0., 'max_lock_secs': self.stats['max_lock_secs']}
+
+    def _swap(self, conn):
+        """ in 1 transaction : last rows & logged changes, old table (& its triggers) dropped, new one renamed, indexes & the old
+        triggers recreated. Foreign keys are checked at the end, rather than by the drop (as sqlite's ALTER TABLE recipe).
+        The longest lock : building the indexes reads the whole table. Returns its secs
+        """
+        foreign_keys = conn.execute('PRAGMA foreign_keys').fetchone()[0]
+        conn.execute('PRAGMA foreign_keys=OFF')
+        conn.execute('PRAGMA legacy_alter_table=ON')  # else the rename checks other tables' triggers, some on the dropped table
+
+        def _step(_conn):
+            while self._copy_batch(_conn):  # written since the last batch
+                pass
+            while self._copy_changes(_conn):
+                pass
+            triggers = [_sql for _name, _sql in _conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (self.name,))
+                        if not _name.startswith('dr_migrate_')]
+            _conn.execute('DROP TABLE %s' % self.name)
+            _conn.execute('ALTER TABLE %s RENAME TO %s' % (self.new_name, self.name))
+            for _index in self.table.indexes:
+                _conn.execute(str(CreateIndex(_index).compile(dialect=self.engine.dialect)))
+            for _sql in triggers:
+                _conn.execute(_sql)
+            _conn.execute("DELETE FROM dr_migrate_checkpoints WHERE name = ?", (self.name,))
+            _conn.execute("DELETE FROM dr_migrate_changes WHERE name = ?", (self.name,))
+            if not _conn.execute("SELECT EXISTS (SELECT 1 FROM dr_migrate_checkpoints)").fetchone()[0]:  # no other copy under way
+                _conn.execute('DROP TABLE dr_migrate_checkpoints')
+                _conn.execute('DROP TABLE dr_migrate_changes')
+            if foreign_keys and _conn.execute('PRAGMA foreign_key_check(%s)' % self.name).fetchone():
+                raise ValueError("Rows of the new %s break its foreign keys : PRAGMA foreign_key_check(%s)" % (self.name, self.name))
+        _t = time.perf_counter()
+        try:
+            self._transaction(conn, _step)
+            return time.perf_counter() - _t
+        finally:
+            conn.execute('PRAGMA legacy_alter_table=OFF')
+            conn.execute('PRAGMA foreign_keys=%s' % ('ON' if foreign_keys else 'OFF'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chunked, resumable rebuild of a table as dr_schema defines it (sqlite)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuild = commands.add_parser('rebuild', help="copy a table into its dr_schema definition, batch by batch (resumes if interrupted)")
+    rebuild.add_argument('db', help="sqlite file, eg day_record.db")
+    rebuild.add_argument('table', choices=sorted(s.Base.metadata.tables))
+    rebuild.add_argument('--batch-rows', type=int, default=MIGRATE_BATCH_ROWS)
+    rebuild.add_argument('--pause-ratio', type=float, default=MIGRATE_PAUSE_RATIO, help="pause after each batch, as a ratio of its time [%(default)s]")
+    args = parser.parse_args(argv)
+    dal = s.DataAccessLayer('sqlite:///' + args.db)
+    dal.connect()
+    try:
+        TableCopy(dal.engine, s.Base.metadata.tables[args.table], batch_rows=args.batch_rows, pause_ratio=args.pause_ratio).run()
+    finally:
+        dal.dispose()
+
+
+if __name__ == '__main__':
+    main()
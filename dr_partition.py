@@ -0,0 +1,228 @@
+"""
+Year-partitioned storage (sqlite) : act_recs split into 1 file per year, next to a catalog db holding act_cats & the daily
+rollups (so categories, name searches of act_cats, & reports from the rollups work on the catalog as on 1 file).
+Each partition's indexes only grow with its year, so inserts & vacuums cost what they would on a 1 year db.
+    python dr_partition.py split day_record.db day_record_parts    # copies an existing db into the partitioned layout
+"""
+
+import os
+import re
+import argparse
+import datetime as dt
+from collections import Counter
+
+from sqlalchemy import Column, MetaData, Table, UniqueConstraint, literal_column, select, text, union_all
+
+import dr_schema as s
+import dr_bll as bll
+
+
+# ====== CONSTANTS =================================================================================
+CATALOG_FILE = 'catalog.db'
+PARTITION_FILE = 'act_recs_%d.db'  # per year
+PARTITION_FILE_RE = re.compile(r'^act_recs_(\d{4})\.db$')
+MAX_ATTACHED = 8  # partitions attached to a connection at a time (sqlite allows 10 attached dbs by default)
+A_ID_SPAN = 10 ** 9  # new records of a year get a_ids above year * A_ID_SPAN, so they're unique across partitions
+ATTACHED_PRAGMAS = ('journal_mode', 'synchronous', 'cache_size')  # per-db pragmas of the profile, also set on partitions
+SOURCE_SCHEMA = 'src'  # the monolithic db, while split_db copies it
+
+# ===================================================================================================
+
+
+def schema_name(year):
+    return 'y%d' % year
+
+
+def year_days(year):
+    """ first & last s.DayNumber (date.toordinal) of year """
+    return dt.date(year, 1, 1).toordinal(), dt.date(year, 12, 31).toordinal()
+
+
+def partition_table(metadata, year):
+    """ act_recs of year's partition (attached as schema_name(year)) : s.ActvtyRec's columns, indexes & unique constraints,
+    without the foreign key to act_cats (sqlite can't refer to another file) ; a_ids from year * A_ID_SPAN up (see attach)
+    """
+    recs = s.ActvtyRec.__table__
+    columns = [Column(_col.name, _col.type, primary_key=_col.primary_key, index=_col.index,
+                      default=_col.default.arg if _col.default is not None else None) for _col in recs.columns]
+    uniques = [UniqueConstraint(*_cons.columns.keys(), name=_cons.name) for _cons in recs.constraints if isinstance(_cons, UniqueConstraint)]
+    return Table(recs.name, metadata, *(columns + uniques), schema=schema_name(year), sqlite_autoincrement=True)
+
+
+class PartitionedDataAccessLayer(s.DataAccessLayer):
+    """
+    a DataAccessLayer on the catalog of a year-partitioned directory (CATALOG_FILE & 1 PARTITION_FILE per year) : its
+    sessions see act_cats & act_rollups (the catalog's own act_recs stays empty). Partitions are ATTACHed, as schema_name(year),
+    to the pooled connections that need them (at most MAX_ATTACHED each : the least recently used are detached).
+    Writes (record) are routed to the partition of each record's day, with the rollups kept in the same transaction ;
+    reads (fetch_recs, or any per-partition query through read) go over the partitions of the day range only.
+    sqlite can't enforce the foreign key to act_cats across files : record checks the activities instead.
+    Not partitioned : act_search (full-text search), & bll functions that change records through the ORM (eg collapse_acts)
+    Usage:
+        pdal = PartitionedDataAccessLayer('day_record_parts')
+        pdal.connect()
+        pdal.record([{'day': .., 'startt': .., 'endt': .., 'a_done': 'yoga'}])
+        pdal.fetch_recs(day_from, day_to)
+    """
+
+    def __init__(self, directory, FK_on=s.FK_ON, profile=s.DB_PROFILE):
+        s.DataAccessLayer.__init__(self, 'sqlite:///' + os.path.join(directory, CATALOG_FILE), FK_on, profile)
+        self.directory = directory
+        self.metadata = MetaData()
+
+    def connect(self):
+        os.makedirs(self.directory, exist_ok=True)
+        s.DataAccessLayer.connect(self)
+
+    def partition_path(self, year):
+        return os.path.join(self.directory, PARTITION_FILE % year)
+
+    def years(self, day_from=None, day_to=None):
+        """ years with a partition, in order ; only those with days in [day_from, day_to] (None for no bound) """
+        years = sorted(int(_m.group(1)) for _m in map(PARTITION_FILE_RE.match, os.listdir(self.directory)) if _m)
+        return [_y for _y in years if (day_from is None or _y >= day_from.year) and (day_to is None or _y <= day_to.year)]
+
+    def table(self, year):
+        key = '%s.%s' % (schema_name(year), s.ActvtyRec.__tablename__)
+        return self.metadata.tables[key] if key in self.metadata.tables else partition_table(self.metadata, year)
+
+    def attach(self, conn, years):
+        """ attaches the partitions of years to conn (a Connection, before its transaction writes anything : sqlite can't
+        attach within one), creating those missing ; returns their Tables
+        """
+        if len(years) > MAX_ATTACHED:
+            raise ValueError("At most %d partitions at a time, not %d" % (MAX_ATTACHED, len(years)))
+        attached = conn.info.setdefault('dr_attached', [])  # years, least recently used first (kept with the pooled connection)
+        pragmas = [(_p, _v) for _p, _v in s.SQLITE_PROFILES[self.profile].items() if _p in ATTACHED_PRAGMAS]
+        for year in years:
+            if year in attached:
+                attached.remove(year)
+                attached.append(year)
+                continue
+            for _old in [_y for _y in attached if _y not in years][:max(len(attached) + 1 - MAX_ATTACHED, 0)]:
+                conn.exec_driver_sql('DETACH DATABASE %s' % schema_name(_old))
+                attached.remove(_old)
+            conn.exec_driver_sql('ATTACH DATABASE ? AS %s' % schema_name(year), (self.partition_path(year),))
+            for pragma, value in pragmas:
+                conn.exec_driver_sql('pragma %s.%s=%s' % (schema_name(year), pragma, value))
+            attached.append(year)
+        tables = [self.table(_y) for _y in years]
+        for year, table in zip(years, tables):
+            if not conn.dialect.has_table(conn, table.name, schema=table.schema):
+                table.create(conn)
+                conn.execute(text("INSERT INTO %s.sqlite_sequence (name, seq) VALUES (:name, :seq)" % table.schema),
+                             {'name': table.name, 'seq': year * A_ID_SPAN})
+        return tables
+
+    def record(self, rows):
+        """ inserts act_recs rows (dicts of day, startt, endt, a_done [, comments]) into the partitions of their days, & their
+        minutes into the rollups, in 1 transaction (atomic per file in WAL mode). Raises bll.UnknownActivity (writing nothing)
+        if an activity isn't in act_cats. Returns number of rows
+        """
+        by_year = dict()
+        for _row in rows:
+            by_year.setdefault(_row['day'].year, []).append(_row)
+        years, cat = sorted(by_year), s.ActvtyCat.__table__
+        for _from in range(0, len(years), MAX_ATTACHED):
+            chunk = years[_from:_from + MAX_ATTACHED]
+            with self.session_scope() as session:
+                conn = session.connection()
+                acts = {_r['a_done'] for _y in chunk for _r in by_year[_y]}
+                missing = acts - {_a for _a, in conn.execute(select(cat.c.a_done).where(cat.c.a_done.in_(acts)))}
+                if missing:  # before attaching : no partition is created either
+                    raise bll.UnknownActivity("Not in the category table : %s" % ', '.join(sorted(missing)))
+                tables = self.attach(conn, chunk)
+                recs = []
+                for _year, _table in zip(chunk, tables):
+                    conn.execute(_table.insert(), by_year[_year])
+                    recs.extend(by_year[_year])
+                bll.apply_rollup_deltas(conn, bll.rollup_deltas([(_r['day'], _r['startt'], _r['endt'], _r['a_done']) for _r in recs]))
+                for _act, _cnt in Counter(_r['a_done'] for _r in recs).items():
+                    bll.note_change(session, ('add', 'act_recs.a_done', _act, _cnt))
+        return len(rows)
+
+    def read(self, make_query, day_from=None, day_to=None, order_by=()):
+        """ rows of make_query(table) (a select of 1 partition's act_recs Table, which may join act_cats), UNION ALL over
+        the partitions of [day_from, day_to], MAX_ATTACHED at a time, in year order (& sorted by the order_by result columns)
+        """
+        rows = []
+        years = self.years(day_from, day_to)
+        with self.engine.connect() as conn:
+            for _from in range(0, len(years), MAX_ATTACHED):
+                queries = [make_query(_table) for _table in self.attach(conn, years[_from:_from + MAX_ATTACHED])]
+                query = union_all(*queries) if len(queries) > 1 else queries[0]
+                rows.extend(conn.execute(query.order_by(*map(literal_column, order_by))).fetchall())
+        return rows
+
+    def fetch_recs(self, day_from=None, day_to=None):
+        """ records (a_id, day, startt, endt, a_done, comments, a_cat) with day in [day_from, day_to], by day & start time """
+        cat = s.ActvtyCat.__table__
+
+        def _query(table):
+            query = (select(table.c.a_id, table.c.day, table.c.startt, table.c.endt, table.c.a_done, table.c.comments, cat.c.a_cat)
+                     .outerjoin(cat, table.c.a_done == cat.c.a_done))
+            if day_from is not None:
+                query = query.where(table.c.day >= day_from)
+            if day_to is not None:
+                query = query.where(table.c.day <= day_to)
+            return query
+        return self.read(_query, day_from, day_to, order_by=('day', 'startt', 'a_id'))
+
+
+def split_db(src_url, directory, profile=s.DB_PROFILE):
+    """ copies src_url's sqlite db into a new partitioned layout in directory : act_cats & act_rollups to the catalog, & each
+    year's act_recs (keeping their a_ids) to its partition, 1 INSERT .. SELECT & commit per year (so no rows go through python).
+    Records without a day aren't copied. Returns Counter of rows per year (None : not copied)
+    """
+    if not src_url.startswith('sqlite') or s.is_memory_url(src_url):
+        raise ValueError("Can only split a sqlite file db : %s" % src_url)
+    src = s.DataAccessLayer(src_url)
+    src.connect()  # checks (or creates) its schema
+    src_path = src.engine.url.database
+    pdal = PartitionedDataAccessLayer(directory, profile=profile)
+    pdal.connect()
+    if pdal.years():
+        raise ValueError("%s already has partitions" % directory)
+    rec = s.ActvtyRec.__table__
+    columns = ', '.join(_col.name for _col in rec.columns)
+    counts = Counter()
+    with pdal.engine.connect() as conn:
+        conn.exec_driver_sql('ATTACH DATABASE ? AS %s' % SOURCE_SCHEMA, (src_path,))
+        try:
+            with conn.begin():
+                for _table in (s.ActvtyCat.__table__, s.ActvtyRollup.__table__):
+                    conn.exec_driver_sql('INSERT INTO main.%s SELECT * FROM %s.%s' % (_table.name, SOURCE_SCHEMA, _table.name))
+            first, last = conn.exec_driver_sql('SELECT min(day), max(day) FROM %s.act_recs' % SOURCE_SCHEMA).one()
+            counts[None] = conn.exec_driver_sql('SELECT count(*) FROM %s.act_recs WHERE day IS NULL' % SOURCE_SCHEMA).scalar()
+            years = range(dt.date.fromordinal(first).year, dt.date.fromordinal(last).year + 1) if first is not None else []
+            for year in years:
+                day_range = year_days(year)
+                exists_ = 'SELECT EXISTS (SELECT 1 FROM %s.act_recs WHERE day BETWEEN ? AND ?)' % SOURCE_SCHEMA
+                if not conn.exec_driver_sql(exists_, day_range).scalar():
+                    continue
+                table = pdal.attach(conn, [year])[0]
+                with conn.begin():
+                    counts[year] = conn.exec_driver_sql('INSERT INTO %s.%s (%s) SELECT %s FROM %s.act_recs WHERE day BETWEEN ? AND ?'
+                                                        % (table.schema, table.name, columns, columns, SOURCE_SCHEMA), day_range).rowcount
+        finally:
+            conn.exec_driver_sql('DETACH DATABASE %s' % SOURCE_SCHEMA)
+    src.dispose()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Year-partitioned storage of activity records")
+    commands = parser.add_subparsers(dest='command', required=True)
+    split = commands.add_parser('split', help="copy a db into a new partitioned layout")
+    split.add_argument('db', help="sqlite file to split, eg day_record.db")
+    split.add_argument('directory', help="new directory for the catalog & partitions")
+    args = parser.parse_args(argv)
+    counts = split_db('sqlite:///' + args.db, args.directory)
+    for _year, _rows in sorted((_y, _n) for _y, _n in counts.items() if _y is not None):
+        print("%6d %10d rows" % (_year, _rows))
+    if counts[None]:
+        print("... %d records without a day not copied" % counts[None])
+
+
+if __name__ == '__main__':
+    main()
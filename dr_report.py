@@ -0,0 +1,386 @@
+"""
+Reporting : how time was spent, per activity or category, in total or per day / week / month.
+Records are fetched with 1 query into a pandas DataFrame and aggregated column-wise (no ORM objects)
+"""
+
+import os
+import datetime as dt
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import Integer, exists, func, select, type_coerce
+
+import dr_schema as s
+import dr_bll as bll
+
+
+# ====== CONSTANTS =================================================================================
+MINS_PER_DAY = 24 * 60
+EPOCH_DAY_NUMBER = dt.date(1970, 1, 1).toordinal()  # s.DayNumber of 1970-01-01
+PERIODS = ('day', 'week', 'month')  # weeks start on Mondays
+GROUP_BYS = ('a_done', 'a_cat')
+SNAPSHOT_COLUMNS = {'a_id': np.int64, 'day': np.int32, 'start_min': np.int16, 'end_min': np.int16, 'a_done': np.int32}
+NO_TIME = -1  # ActSnapshot's start_min / end_min of a record without start / end time
+NO_CODE = -1  # ActSnapshot's a_done code of a record without activity, & name_cats of an activity without category
+SNAPSHOT_READ_IDS = 500  # changed records re-read per query by ActSnapshot.refresh
+SNAPSHOT_READ_ROWS = 50000  # rows fetched & converted at a time by ActSnapshot.refresh
+REPORT_WORKERS = os.cpu_count() or 1  # default processes of parallel_time_usage
+PARTITIONS_PER_WORKER = 4  # day ranges per worker process, so 1 busier range doesn't leave the others idle
+
+# ===================================================================================================
+
+
+def to_minutes(times):
+    """ minutes since midnight of a Series of python time objects """
+    return pd.Series([_t.hour * 60 + _t.minute for _t in times], index=times.index, dtype='int64')
+
+
+def fetch_intervals(session, day_from=None, day_to=None):
+    """ returns DataFrame of records (day, start_min, end_min, a_done, a_cat) with day in [day_from, day_to], from 1 query
+    (records without a day or a time are left out).
+    On sqlite the integer days & times (see s.DayNumber, s.SecondsTime) are fetched raw & converted column-wise,
+    rather than into python objects row by row
+    """
+    rec, cat = s.ActvtyRec, s.ActvtyCat
+    raw_ints = session.get_bind().dialect.name == 'sqlite'
+    time_cols = [rec.day, rec.startt, rec.endt]
+    if raw_ints:
+        time_cols = [type_coerce(_col, Integer).label(_col.key) for _col in time_cols]
+    query = select(*time_cols, rec.a_done, cat.a_cat).outerjoin(cat, rec.a_done == cat.a_done)
+    query = query.where(rec.day.isnot(None), rec.startt.isnot(None), rec.endt.isnot(None))  # as the rollups, which skip those
+    if day_from is not None:
+        query = query.where(rec.day >= day_from)
+    if day_to is not None:
+        query = query.where(rec.day <= day_to)
+    raw = pd.DataFrame(session.execute(query).fetchall(), columns=['day', 'startt', 'endt', 'a_done', 'a_cat'])
+    if raw_ints:
+        days = pd.to_datetime(raw['day'].astype('int64') - EPOCH_DAY_NUMBER, unit='D')
+        start_min, end_min = raw['startt'].astype('int64') // 60, raw['endt'].astype('int64') // 60
+    else:
+        days, start_min, end_min = pd.to_datetime(raw['day']), to_minutes(raw['startt']), to_minutes(raw['endt'])
+    return pd.DataFrame({'day': days, 'start_min': start_min, 'end_min': end_min, 'a_done': raw['a_done'], 'a_cat': raw['a_cat']})
+
+
+def fetch_rollups(session, day_from=None, day_to=None):
+    """ returns DataFrame of daily rollups (day, a_done, a_cat, minutes) with day in [day_from, day_to] : already split at midnight """
+    roll, cat = s.ActvtyRollup, s.ActvtyCat
+    query = select(roll.day, roll.a_done, cat.a_cat, roll.minutes).outerjoin(cat, roll.a_done == cat.a_done)
+    if day_from is not None:
+        query = query.where(roll.day >= day_from)
+    if day_to is not None:
+        query = query.where(roll.day <= day_to)
+    pieces = pd.DataFrame(session.execute(query).fetchall(), columns=['day', 'a_done', 'a_cat', 'minutes'])
+    return pieces.assign(day=pd.to_datetime(pieces['day']), minutes=pieces['minutes'].astype('int64'))
+
+
+def rollups_available(session):
+    """ False if act_rollups is empty while act_recs isn't (eg db created before rollups existed & not yet rebuilt) """
+    has_rows = lambda _table: session.query(exists().select_from(_table)).scalar()
+    return has_rows(s.ActvtyRollup.__table__) or not has_rows(s.ActvtyRec.__table__)
+
+
+def split_midnight(intervals):
+    """ returns intervals with a 'minutes' column, where those ending before they start (ie crossing midnight)
+    are split in 2 : the minutes up to midnight on their day, & the rest on the next day
+    """
+    crosses = intervals['end_min'] < intervals['start_min']
+    pieces = intervals.assign(minutes=np.where(crosses, MINS_PER_DAY - intervals['start_min'], intervals['end_min'] - intervals['start_min']))
+    after = intervals[crosses & (intervals['end_min'] > 0)]
+    after = after.assign(day=after['day'] + pd.Timedelta(days=1), minutes=after['end_min'])
+    return pd.concat([pieces, after], ignore_index=True)
+
+
+def period_start(days, period):
+    """ first day of the day / week (Monday) / month each of days is in """
+    if period == 'day':
+        return days
+    if period == 'week':
+        return days - pd.to_timedelta(days.dt.weekday, unit='D')
+    if period == 'month':
+        return days - pd.to_timedelta(days.dt.day - 1, unit='D')
+    raise ValueError("Unknown period : %s (use one of %s)" % (period, PERIODS))
+
+
+def aggregate_usage(pieces, by='a_cat', period=None):
+    """ sums minutes of (split) intervals per by (& per period), as Series named 'minutes', largest first within each period """
+    if by not in GROUP_BYS:
+        raise ValueError("Unknown group by : %s (use one of %s)" % (by, GROUP_BYS))
+    frame = pieces.assign(**{by: pieces[by].fillna('(none)')})
+    keys = [by]
+    if period is not None:
+        frame[period] = period_start(frame['day'], period)
+        keys = [period, by]
+    return order_usage(frame.groupby(keys)['minutes'].sum().reset_index(), keys)
+
+
+def order_usage(usage, keys):
+    """ usage (DataFrame of keys & minutes, sorted by keys) as Series named 'minutes', largest first within each period """
+    usage = usage.sort_values(keys[:-1] + ['minutes'], ascending=[True] * (len(keys) - 1) + [False], kind='stable')
+    return usage.set_index(keys)['minutes']
+
+
+def merge_usage(partials, by='a_cat', period=None):
+    """ sums results of time_usage over disjoint day ranges, into the result of time_usage over all of them """
+    keys = [by] if period is None else [period, by]
+    return order_usage(pd.concat(partials).groupby(level=keys).sum().reset_index(), keys)
+
+
+def time_usage(session, by='a_cat', period=None, day_from=None, day_to=None, use_rollups=True, snapshot=None):
+    """ minutes spent per activity (by='a_done') or category (by='a_cat'), in total or per period ('day', 'week', 'month'),
+    between day_from & day_to (inclusive ; None for no bound). Intervals crossing midnight count towards both days.
+    Reads the daily rollups if use_rollups (& they're available), else all records in the range : from snapshot (an ActSnapshot,
+    refreshed first) if given.
+    Returns pandas Series named 'minutes', indexed by by, or by (period, by)
+    """
+    if use_rollups and rollups_available(session):
+        return aggregate_usage(fetch_rollups(session, day_from, day_to), by, period)
+    fetch_from = day_from - dt.timedelta(days=1) if day_from is not None else None  # may cross into day_from
+    if snapshot is not None:
+        intervals = snapshot.refresh(session).intervals(fetch_from, day_to)
+    else:
+        intervals = fetch_intervals(session, fetch_from, day_to)
+    pieces = split_midnight(intervals)
+    if day_from is not None:
+        pieces = pieces[pieces['day'] >= pd.Timestamp(day_from)]
+    if day_to is not None:
+        pieces = pieces[pieces['day'] <= pd.Timestamp(day_to)]
+    return aggregate_usage(pieces, by, period)
+
+
+# ====== PARALLEL ==================================================================================
+# the records' day range is split into partitions, each aggregated by time_usage in a worker process (on a read-only
+# connection of its own), & the partial results summed. Minutes are integers, so the sum is exact whatever the split
+
+def day_partitions(day_from, day_to, n):
+    """ up to n contiguous (first, last) day ranges of about equal length, covering day_from to day_to """
+    n_days = (day_to - day_from).days + 1
+    n = max(1, min(n, n_days))
+    firsts = [day_from + dt.timedelta(days=n_days * _i // n) for _i in range(n + 1)]
+    return [(firsts[_i], firsts[_i + 1] - dt.timedelta(days=1)) for _i in range(n)]
+
+
+def _partition_usage(db_url, by, period, day_from, day_to):
+    # in a worker process : its engine (& read-only connections) is cached for the next partitions it gets
+    dal = s.DataAccessLayer(db_url, profile=s.READ_ONLY_PROFILE)
+    dal.connect()
+    with dal.session_scope() as session:
+        return time_usage(session, by, period, day_from, day_to, use_rollups=False)
+
+
+def parallel_time_usage(db_url, by='a_cat', period=None, day_from=None, day_to=None, workers=REPORT_WORKERS,
+                        partitions_per_worker=PARTITIONS_PER_WORKER):
+    """ time_usage(use_rollups=False) of db_url's records, computed by workers processes over partitions of the day range
+    (see day_partitions) & merged (see merge_usage) : the same Series as from 1 process.
+    Workers are spawned (not forked : they'd inherit the parent's sqlite connections), so each first imports this module.
+    db_url must be a file or server db : an in-memory db exists in 1 process only
+    """
+    if s.is_memory_url(db_url):
+        raise ValueError("An in-memory db can't be read by other processes : %s" % db_url)
+    if by not in GROUP_BYS:
+        raise ValueError("Unknown group by : %s (use one of %s)" % (by, GROUP_BYS))
+    if period is not None and period not in PERIODS:
+        raise ValueError("Unknown period : %s (use one of %s)" % (period, PERIODS))
+    rec = s.ActvtyRec
+    dal = s.DataAccessLayer(db_url, profile=s.READ_ONLY_PROFILE)
+    dal.connect()
+    with dal.session_scope() as session:
+        first, last = session.query(func.min(rec.day), func.max(rec.day)).one()
+        if first is not None:  # the records' days within the range asked
+            first, last = max(first, day_from or first), min(last, day_to or last)
+        if first is None or first > last or workers <= 1:
+            return time_usage(session, by, period, day_from, day_to, use_rollups=False)
+    partitions = day_partitions(first, last, workers * partitions_per_worker)
+    # the outer bounds stay as asked : eg with no day_to, the last day's records crossing midnight count on the next day
+    partitions[0], partitions[-1] = (day_from, partitions[0][1]), (partitions[-1][0], day_to)
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        partials = list(pool.map(_partition_usage, *zip(*[(db_url, by, period, _from, _to) for _from, _to in partitions])))
+    return merge_usage(partials, by, period)
+
+
+# ====== SNAPSHOT ==================================================================================
+
+def _minutes(seconds):
+    """ int16 minutes of raw s.SecondsTime values (None : NO_TIME) """
+    seconds = np.array(seconds, dtype=np.float64)  # None -> nan
+    return np.where(np.isnan(seconds), NO_TIME, seconds // 60).astype(np.int16)
+
+
+class ActSnapshot:
+    """ process-local, columnar copy of act_recs for analyses : numpy arrays of a_id, day (s.DayNumber : date.toordinal()),
+    start & end minutes & a_done as a code into names, ie 20 bytes per record instead of an ORM object (or row tuple) each.
+    Categories are per activity : name_cats holds the code into cats of each a_done code (NO_CODE if none).
+    refresh only reads the records with an a_id above the watermark (the largest read so far), & those changed or deleted as ORM
+    objects. collapse_acts' renames & category changes are applied to the codes, without reading anything (but act_cats is read
+    again after a bulk update / delete of it, noted as a 'reset'). All as committed
+    by this process (see bll's change feed) : other processes' changes to existing records are only seen by a new snapshot.
+    Usage:
+        snapshot = ActSnapshot().refresh(session)
+        ...
+        snapshot.refresh(session)  # new & changed records only
+        snapshot.intervals(day_from, day_to)  # as fetch_intervals
+        snapshot.close()
+    """
+
+    def __init__(self):
+        self.n = 0
+        self._cols = {_col: np.empty(0, _type) for _col, _type in SNAPSHOT_COLUMNS.items()}  # n used, the rest spare
+        self.names, self.name_codes = [], dict()
+        self.cats, self.cat_codes = [], dict()
+        self.name_cats = []
+        self.watermark = None  # None : not loaded yet
+        self.pending = []  # committed changes, applied by the next refresh (they may come from another thread's commit)
+        self.stats = Counter()  # refreshes, rows_read, rows_reread, rows_deleted, renames
+
+    def close(self):
+        bll.remove_change_listener(self.apply_change)
+
+    def apply_change(self, change):
+        if change[1] in ('act_recs', 'act_recs.a_done', bll.CategoryCache.key) and change[0] != 'add':
+            self.pending.append(change)
+
+    def column(self, col):
+        """ the numpy array of col (one of SNAPSHOT_COLUMNS), in a_id order """
+        return self._cols[col][:self.n]
+
+    @property
+    def nbytes(self):
+        """ bytes of the arrays, including room for records to come """
+        return sum(_arr.nbytes for _arr in self._cols.values())
+
+    def name_code(self, name):
+        if name not in self.name_codes:
+            self.name_codes[name] = len(self.names)
+            self.names.append(name)
+            self.name_cats.append(NO_CODE)
+        return self.name_codes[name]
+
+    def set_cat(self, a_done, a_cat):
+        if a_cat is not None and a_cat not in self.cat_codes:
+            self.cat_codes[a_cat] = len(self.cats)
+            self.cats.append(a_cat)
+        code = self.name_code(a_done)
+        self.name_cats[code] = NO_CODE if a_cat is None else self.cat_codes[a_cat]
+
+    def refresh(self, session):
+        """ brings the snapshot up to date with the db (as described above) ; returns itself """
+        rec = s.ActvtyRec
+        loading = self.watermark is None
+        if loading:  # listening first : changes committed while reading are applied (again) by the next refresh
+            bll.add_change_listener(self.apply_change)
+            self._load_cats(session)
+            self.watermark = 0
+        changes, self.pending = self.pending, []
+        changed, deleted = set(), set()
+        if any(_change[0] == 'reset' for _change in changes):  # the categories as committed : including any changes noted after
+            self._load_cats(session)
+        for _change in changes:
+            if _change[0] == 'rename':
+                self._rename(_change[2], _change[3])
+            elif _change[0] == 'set':
+                self.set_cat(_change[2], _change[3])
+            elif _change[0] == 'remove':
+                self.set_cat(_change[2], None)
+            elif _change[0] == 'update':
+                changed.add(_change[2])
+            elif _change[0] == 'delete':
+                deleted.add(_change[2])
+        if deleted:
+            self._delete(deleted)
+        changed = sorted(_id for _id in changed - deleted if _id <= self.watermark)
+        for _from in range(0, len(changed), SNAPSHOT_READ_IDS):
+            for _cols in self._read(session, rec.a_id.in_(changed[_from:_from + SNAPSHOT_READ_IDS])):
+                self._reread(_cols)
+        for _cols in self._read(session, rec.a_id > self.watermark):
+            self._append(_cols)
+        if loading:  # no spare room left from growing while loading
+            self._cols = {_col: _arr[:self.n].copy() for _col, _arr in self._cols.items()}
+        self.stats['refreshes'] += 1
+        return self
+
+    def _load_cats(self, session):
+        """ (re)reads the category of every activity from act_cats """
+        self.name_cats = [NO_CODE] * len(self.names)
+        for _a_done, _a_cat in session.query(s.ActvtyCat.a_done, s.ActvtyCat.a_cat):
+            self.set_cat(_a_done, _a_cat)
+
+    def _read(self, session, condition):
+        """ yields {col: numpy array} of the records matching condition, in a_id order, SNAPSHOT_READ_ROWS at a time
+        (Core rows, streamed : the ORM's result processing would take as long again, & all rows as tuples ~15 times the arrays)
+        """
+        rec = s.ActvtyRec
+        raw_ints = session.get_bind().dialect.name == 'sqlite'
+        time_cols = [rec.day, rec.startt, rec.endt]
+        if raw_ints:  # as in fetch_intervals
+            time_cols = [type_coerce(_col, Integer).label(_col.key) for _col in time_cols]
+        query = select(rec.a_id, *time_cols, rec.a_done).where(condition).order_by(rec.a_id)
+        for rows in session.connection().execution_options(stream_results=True).execute(query).partitions(SNAPSHOT_READ_ROWS):
+            self.stats['rows_read'] += len(rows)
+            a_ids, days, starts, ends, a_dones = zip(*rows)
+            if not raw_ints:
+                days = [_d and _d.toordinal() for _d in days]
+                starts, ends = [[_t and _t.hour * 3600 + _t.minute * 60 for _t in _times] for _times in (starts, ends)]
+            codes, uniques = pd.factorize(np.array(a_dones, dtype=object))  # None : -1
+            code_map = np.array([self.name_code(_name) for _name in uniques] + [NO_CODE], dtype=np.int32)
+            yield {'a_id': np.array(a_ids, dtype=np.int64), 'day': np.array([_d or 0 for _d in days], dtype=np.int32),
+                   'start_min': _minutes(starts), 'end_min': _minutes(ends), 'a_done': code_map[codes]}
+
+    def _append(self, cols):
+        added = len(cols['a_id'])
+        if self.n + added > len(self._cols['a_id']):  # grows by doubling, so appends cost O(rows added) on average
+            capacity = max(2 * len(self._cols['a_id']), self.n + added)
+            for _col, _arr in self._cols.items():
+                grown = np.empty(capacity, _arr.dtype)
+                grown[:self.n] = _arr[:self.n]
+                self._cols[_col] = grown
+        for _col, _arr in cols.items():
+            self._cols[_col][self.n:self.n + added] = _arr
+        self.n += added
+        self.watermark = int(cols['a_id'][-1])
+
+    def _reread(self, cols):
+        a_ids = self.column('a_id')
+        pos = np.searchsorted(a_ids, cols['a_id'])
+        for _col, _arr in cols.items():
+            self._cols[_col][pos] = _arr
+        self.stats['rows_reread'] += len(pos)
+
+    def _delete(self, a_ids):
+        keep = ~np.isin(self.column('a_id'), np.fromiter(a_ids, dtype=np.int64))
+        kept = int(keep.sum())
+        for _col, _arr in self._cols.items():
+            _arr[:kept] = _arr[:self.n][keep]
+        self.stats['rows_deleted'] += self.n - kept
+        self.n = kept
+        # sqlite may give the largest a_id again once deleted
+        self.watermark = int(self._cols['a_id'][self.n - 1]) if self.n else 0
+
+    def _rename(self, old_names, new_name):
+        old_codes = [self.name_codes[_name] for _name in old_names if _name in self.name_codes and _name != new_name]
+        if not old_codes:
+            return
+        remap = np.arange(len(self.names), dtype=np.int32)
+        remap[old_codes] = self.name_code(new_name)
+        codes = self.column('a_done')
+        has_name = codes != NO_CODE
+        codes[has_name] = remap[codes[has_name]]
+        self.stats['renames'] += 1
+
+    def intervals(self, day_from=None, day_to=None):
+        """ DataFrame of records (day, start_min, end_min, a_done, a_cat) with day in [day_from, day_to], as fetch_intervals """
+        day, start_min, end_min, codes = [self.column(_col) for _col in ('day', 'start_min', 'end_min', 'a_done')]
+        keep = (start_min != NO_TIME) & (end_min != NO_TIME) & (day != 0)
+        if day_from is not None:
+            keep &= day >= day_from.toordinal()
+        if day_to is not None:
+            keep &= day <= day_to.toordinal()
+        codes = codes[keep]
+        names = np.array(self.names + [None], dtype=object)  # code NO_CODE (-1) : None
+        cats = np.array(self.cats + [None], dtype=object)
+        cat_codes = np.array(self.name_cats + [NO_CODE], dtype=np.int32)[codes]
+        return pd.DataFrame({'day': pd.to_datetime(day[keep].astype('int64') - EPOCH_DAY_NUMBER, unit='D'),
+                             'start_min': start_min[keep].astype('int64'), 'end_min': end_min[keep].astype('int64'),
+                             'a_done': names[codes], 'a_cat': cats[cat_codes]})
@@ -1,22 +1,22 @@
 
 # ==================================================================================================
 
-from sqlalchemy import create_engine
+import time
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, inspect, MetaData, Table
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy import Column, Integer, String, Date  # Text, Time
 from sqlalchemy import ForeignKey, PrimaryKeyConstraint, UniqueConstraint, CheckConstraint, ForeignKeyConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, backref
 
-# import datetime as dt
-
-# for working around sqlite problem with Time
-from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.types import TIME
-
+import datetime as dt
 
-@compiles(TIME, "sqlite")
-def compile_time_sqlite(type_, compiler, **kw):
-    return "TEXT"
+# for working around sqlite having no Time / Date types : stored as integers instead (see below)
+from sqlalchemy.types import TIME, TypeDecorator
 
 # import sqlalchemy.types as types
 # from dateutil.parser import parse
@@ -24,46 +24,355 @@ def compile_time_sqlite(type_, compiler, **kw):
 
 # ============ CONSTANTS ================================================================
 FK_ON = True  # turns on Foreign Key constraint if sqlite db
+POOL_SIZE = 5  # connections kept open per (file / server) db
+POOL_MAX_OVERFLOW = 10  # extra connections allowed when all are checked out
+QUERY_CACHE_SIZE = 1200  # compiled statements kept by each engine (sqlalchemy's default is 500)
+# sqlite pragmas set on every new connection, per performance profile. WAL lets readers run alongside a writer ;
+# 'durable' still fsyncs each commit (synchronous=FULL), 'fast' only at checkpoints (NORMAL : a power cut may lose the last commits, not corrupt the db)
+SQLITE_PROFILES = {
+    'plain': {},  # sqlite's defaults : rollback journal, synchronous FULL, ~2MB page cache
+    'durable': {'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': -16000, 'mmap_size': 0, 'temp_store': 'MEMORY'},
+    'fast': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -64000, 'mmap_size': 256 * 2 ** 20, 'temp_store': 'MEMORY'},
+    # for readers of an existing db (eg report workers) : any write fails, so the journal mode is left as is & no tables are created
+    'readonly': {'query_only': 'ON', 'cache_size': -64000, 'mmap_size': 256 * 2 ** 20, 'temp_store': 'MEMORY'},
+}  # cache_size < 0 : in KiB
+DB_PROFILE = 'durable'
+READ_ONLY_PROFILE = 'readonly'
+SCHEMA_REVISION = '9c3e5b7a1f2d'  # alembic revision the tables below are at : dbs stamped with another one need `alembic upgrade head`
+SLOW_QUERY_SECS = 0.05  # statements taking longer are kept by QueryProfiler, with their query plan (sqlite)
+SLOW_QUERIES_KEPT = 20  # the slowest ones
 # connect to database
 Base = declarative_base()
 
 # ========================================================================================
 
 
+class SecondsTime(TypeDecorator):
+    """ time of day, stored on sqlite as integer seconds since midnight (microseconds are dropped) ; native TIME elsewhere.
+    So range comparisons & durations are integer arithmetic, & indexes are small. Python time objects at the ORM boundary
+    """
+    impl = TIME
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(Integer() if dialect.name == 'sqlite' else TIME())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'sqlite':
+            return value
+        return value.hour * 3600 + value.minute * 60 + value.second
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name != 'sqlite':
+            return value
+        return dt.time(value // 3600, value // 60 % 60, value % 60)
+
+
+class DayNumber(TypeDecorator):
+    """ date, stored on sqlite as integer day number (date.toordinal) ; native DATE elsewhere. Python date objects at the ORM boundary
+    """
+    impl = Date
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(Integer() if dialect.name == 'sqlite' else Date())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'sqlite':
+            return value
+        return value.toordinal()
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name != 'sqlite':
+            return value
+        return dt.date.fromordinal(value)
+
+
 class DataAccessLayer:
     """
     instead of using loadSession stand-alone function that returns session, engine; use this
     (advs: attributes can be easily added, and thereby much more easily accessed than returning arrays)
+    Engines are cached per db url (see get_engine), so connecting again, or from another DataAccessLayer on the same db,
+    reuses its connection pool & skips the schema check.
     Usage:
         dal = DataAccessLayer(db_url)
         dal.connect()
         dal.create_session()
         a_session = dal.session
+    or, for a session that commits (or rolls back on exception) & closes by itself :
+        with dal.session_scope() as a_session:
+            ...
+    profile picks the sqlite pragmas of every connection (see SQLITE_PROFILES) ; ignored by other dbs
     """
 
-    def __init__(self, db_url='some conn string', FK_on=FK_ON):
+    def __init__(self, db_url='some conn string', FK_on=FK_ON, profile=DB_PROFILE):
+        if profile not in SQLITE_PROFILES:
+            raise ValueError("Unknown profile : %s (use one of %s)" % (profile, tuple(SQLITE_PROFILES)))
         self.engine = None
         self.session = None
+        self.Session = None
         self.db_url = db_url
-        self.is_sqlite = 'sqlite' in db_url
         self.FK_on = FK_on
+        self.profile = profile
+        self.profiler = None
+
+    @property
+    def is_sqlite(self):
+        return self.db_url.startswith('sqlite')
+
+    @property
+    def stats(self):
+        """ counters of the cached engine : connects (new db connections), checkouts (from the pool), schema_checks """
+        return ENGINE_STATS[(self.db_url, self.FK_on, self.profile)]
 
     def connect(self):
-        """ creates a session which can then be accessed as the attribute of the instance
+        """ gets the (cached) engine, and a session factory bound to it. Raises SchemaOutOfDate if the db needs migrating
         """
         try:
-            self.engine = create_engine(self.db_url, pool_pre_ping=True)
-            Base.metadata.create_all(self.engine, checkfirst=True)
+            self.engine = get_engine(self.db_url, self.FK_on, self.profile)
+        except SchemaOutOfDate:
+            raise
         except Exception as exc_:
             print("Error: (caught) : Exception encountered in trying to connnect to db! ")
             print(exc_)
         else:
-            self.Session = sessionmaker(bind=self.engine)
+            self.Session = SESSION_FACTORIES[self.engine]
 
     def create_session(self):
         self.session = self.Session()
-        if self.FK_on and self.is_sqlite:
-            self.session.execute('pragma foreign_keys=on')
+
+    @contextmanager
+    def session_scope(self):
+        """ yields a new session ; commits it at the end, or rolls back on exception, then closes it """
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def start_profiling(self, slow_secs=SLOW_QUERY_SECS, explain=True):
+        """ starts recording the statements run on the engine (by any session), per operation (see operation) ; returns the QueryProfiler """
+        if self.profiler is None:
+            self.profiler = QueryProfiler(self.engine, slow_secs, explain).start()
+        return self.profiler
+
+    def stop_profiling(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+
+    def dispose(self):
+        """ closes all pooled connections & forgets the cached engine (so an in-memory db is gone) """
+        self.stop_profiling()
+        dispose_engine(self.db_url, self.FK_on, self.profile)
+        self.engine = self.session = self.Session = None
+
+
+# ======== ENGINES =================================================================================
+# 1 engine (with its pool & session factory) per (db url, FK_on, profile), created & schema-checked once per process
+
+_engines = dict()  # (db_url, FK_on, profile) -> engine
+SESSION_FACTORIES = dict()  # engine -> sessionmaker
+ENGINE_STATS = defaultdict(Counter)  # (db_url, FK_on, profile) -> counters
+_schema_checked = set()  # engines whose tables have been created / checked
+
+
+class SchemaOutOfDate(Exception):
+    """ the db was made by older code : it needs `alembic upgrade head` before this code can read it """
+
+
+def is_memory_url(db_url):
+    return db_url in ('sqlite://', 'sqlite:///:memory:') or db_url.startswith('sqlite:///:memory:?')
+
+
+def sqlite_pragmas(FK_on=FK_ON, profile=DB_PROFILE):
+    """ list of (pragma, value) to set on each new sqlite connection """
+    pragmas = [('foreign_keys', 'on')] if FK_on else []
+    return pragmas + list(SQLITE_PROFILES[profile].items())
+
+
+def get_engine(db_url, FK_on=FK_ON, profile=DB_PROFILE):
+    """ returns the cached engine for db_url, creating it (& its tables if missing) the first time.
+    sqlite : in-memory dbs get a StaticPool (1 connection shared, else each connection would be a new empty db),
+    files a QueuePool ; foreign keys & the profile's pragmas are set once per new connection (not per session).
+    Raises SchemaOutOfDate if the db needs migrating (see check_schema_revision). READ_ONLY_PROFILE engines don't create tables
+    """
+    key = (db_url, FK_on, profile)
+    engine = _engines.get(key)
+    if engine is None:
+        stats = ENGINE_STATS[key]
+        if db_url.startswith('sqlite'):
+            pool_kw = {'poolclass': StaticPool} if is_memory_url(db_url) else {'poolclass': QueuePool, 'pool_size': POOL_SIZE, 'max_overflow': POOL_MAX_OVERFLOW}
+            engine = create_engine(db_url, connect_args={'check_same_thread': False}, query_cache_size=QUERY_CACHE_SIZE, **pool_kw)
+            pragmas = sqlite_pragmas(FK_on, profile)
+        else:
+            engine = create_engine(db_url, pool_pre_ping=True, pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW, query_cache_size=QUERY_CACHE_SIZE)
+            pragmas = []
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_conn, conn_record):
+            stats['connects'] += 1
+            cursor = dbapi_conn.cursor()
+            for pragma, value in pragmas:
+                cursor.execute('pragma %s=%s' % (pragma, value))
+            cursor.close()
+
+        @event.listens_for(engine, 'checkout')
+        def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+            stats['checkouts'] += 1
+
+        _engines[key] = engine
+        SESSION_FACTORIES[engine] = sessionmaker(bind=engine)
+    if engine not in _schema_checked:
+        check_schema_revision(engine, db_url)  # before create_all : so the migrations find the db as they left it
+        if profile != READ_ONLY_PROFILE:
+            Base.metadata.create_all(engine, checkfirst=True)
+        _schema_checked.add(engine)
+        ENGINE_STATS[key]['schema_checks'] += 1
+    return engine
+
+
+def check_schema_revision(engine, db_url):
+    """ raises SchemaOutOfDate if the db is stamped with another alembic revision than SCHEMA_REVISION, or (not stamped) its
+    act_recs still hold days & times as TEXT (sqlite, before 436a561180ec) : rather than failing on the first record read
+    """
+    with engine.connect() as conn:
+        tables = inspect(conn).get_table_names()
+        if 'alembic_version' in tables:
+            revision = conn.exec_driver_sql("SELECT version_num FROM alembic_version").scalar()
+            if revision is not None and revision != SCHEMA_REVISION:
+                raise SchemaOutOfDate("db %s is at alembic revision %s, this code needs %s : run `alembic upgrade head` on it"
+                                      % (db_url, revision, SCHEMA_REVISION))
+        elif 'act_recs' in tables and engine.dialect.name == 'sqlite':
+            text_values = conn.exec_driver_sql("SELECT typeof(day) = 'text' OR typeof(startt) = 'text' FROM act_recs "
+                                               "WHERE day IS NOT NULL OR startt IS NOT NULL LIMIT 1").scalar()
+            if text_values:
+                raise SchemaOutOfDate("db %s stores days & times as TEXT : stamp it with the alembic revision it's at "
+                                      "(`alembic stamp <revision>`), then run `alembic upgrade head` on it" % db_url)
+
+
+def dispose_engine(db_url, FK_on=FK_ON, profile=DB_PROFILE):
+    ENGINE_STATS.pop((db_url, FK_on, profile), None)
+    engine = _engines.pop((db_url, FK_on, profile), None)
+    if engine is not None:
+        SESSION_FACTORIES.pop(engine, None)
+        _schema_checked.discard(engine)
+        engine.dispose()
+
+
+@event.listens_for(Base.metadata, 'after_drop')
+def _forget_schema_check(metadata, connection, **kw):
+    # tables were dropped (eg by tests) : next connect re-creates them
+    _schema_checked.discard(connection.engine)
+
+
+# ======== PROFILING ===============================================================================
+# opt-in : statements are only timed while a QueryProfiler is started on the engine. Callers name the logical operation
+# they're in (eg a ui task, or prompt_for_name within it) with `with operation(name):`, which is next to free otherwise
+
+_operations = threading.local()
+
+
+@contextmanager
+def operation(name):
+    """ statements run (in this thread) inside the with block are counted towards name, nested in any enclosing operation """
+    stack = _operations.__dict__.setdefault('stack', [])
+    stack.append(name)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def current_operation():
+    stack = getattr(_operations, 'stack', None)
+    return '/'.join(stack) if stack else '(none)'
+
+
+class QueryProfiler:
+    """
+    counts & times the statements run on an engine per operation, keeping the slowest ones (those over slow_secs)
+    with their EXPLAIN QUERY PLAN on sqlite.
+    Usage:
+        profiler = dal.start_profiling()
+        with operation('collapse_acts'):
+            ...
+        print(profiler.report())  # or profiler.summary(), profiler.slow_statements
+    """
+
+    def __init__(self, engine, slow_secs=SLOW_QUERY_SECS, explain=True):
+        self.engine = engine
+        self.slow_secs = slow_secs
+        self.explain = explain and engine.dialect.name == 'sqlite'
+        self.stats = defaultdict(Counter)  # operation -> statements, secs (& max_secs)
+        self.slow_statements = []  # dicts (operation, statement, parameters, secs, plan), slowest first
+        self._lock = threading.Lock()
+
+    def start(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        event.listen(self.engine, 'after_cursor_execute', self._after)
+        return self
+
+    def stop(self):
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+            del self.slow_statements[:]
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('dr_query_start', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        secs = time.perf_counter() - conn.info['dr_query_start'].pop()
+        op = current_operation()
+        with self._lock:
+            stats = self.stats[op]
+            stats['statements'] += 1
+            stats['secs'] += secs
+            stats['max_secs'] = max(stats['max_secs'], secs)
+        if secs >= self.slow_secs:
+            plan = self.query_plan(cursor, statement, parameters) if self.explain and not executemany else None
+            with self._lock:
+                self.slow_statements.append({'operation': op, 'statement': statement, 'parameters': parameters, 'secs': secs, 'plan': plan})
+                self.slow_statements.sort(key=lambda _s: -_s['secs'])
+                del self.slow_statements[SLOW_QUERIES_KEPT:]
+
+    @staticmethod
+    def query_plan(cursor, statement, parameters):
+        """ sqlite's EXPLAIN QUERY PLAN of statement, as its detail lines (on a cursor of its own, so the statement's rows are untouched) """
+        plan_cursor = cursor.connection.cursor()
+        try:
+            plan_cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return [_row[-1] for _row in plan_cursor.fetchall()]
+        except Exception as exc_:  # eg a statement sqlite can't explain
+            return ['(no plan : %s)' % exc_]
+        finally:
+            plan_cursor.close()
+
+    def summary(self):
+        """ [{operation, statements, secs, max_secs}], most time first """
+        with self._lock:
+            rows = [dict(operation=_op, statements=_st['statements'], secs=_st['secs'], max_secs=_st['max_secs']) for _op, _st in self.stats.items()]
+        return sorted(rows, key=lambda _r: -_r['secs'])
+
+    def report(self):
+        """ summary & slow statements as text """
+        lines = ["%-40s %10s %10s %10s" % ('operation', 'statements', 'total ms', 'max ms')]
+        for _row in self.summary():
+            lines.append("%-40s %10d %10.1f %10.1f" % (_row['operation'], _row['statements'], _row['secs'] * 1e3, _row['max_secs'] * 1e3))
+        if self.slow_statements:
+            lines.append("slow statements (over %.0f ms) :" % (self.slow_secs * 1e3))
+        for _slow in self.slow_statements:
+            lines.append("  %.1f ms in %s : %s" % (_slow['secs'] * 1e3, _slow['operation'], ' '.join(_slow['statement'].split())))
+            lines.extend("      plan : %s" % _line for _line in (_slow['plan'] or []))
+        return '\n'.join(lines)
 
 
 # === SCHEMA =======================================================================================
@@ -73,15 +382,15 @@ class ActvtyRec(Base):  # activity record
     """
     __tablename__ = 'act_recs'
     a_id = Column(Integer, primary_key=True)
-    day = Column(Date, index=True)
-    startt = Column(TIME, index=True)  # Time not supported by sqlite3; therefore need to convert to string from time if setting, from string to time if getting
-    endt = Column(TIME)
+    day = Column(DayNumber, index=True)
+    startt = Column(SecondsTime, index=True)  # Time not supported by sqlite3; therefore stored as seconds since midnight (see SecondsTime)
+    endt = Column(SecondsTime)
     a_done = Column(String(40), ForeignKey('act_cats.a_done'), index=True)  # many-to-one
     comments = Column(String(50), default='NFI')
 
-    __tableargs__ = (UniqueConstraint(day, startt, name='uniq_startt'),
-                     UniqueConstraint(day, endt, name='uniq_endt'),
-                     )
+    __table_args__ = (UniqueConstraint(day, startt, name='uniq_startt'),  # also the (day, startt) index used by overlap checks
+                      UniqueConstraint(day, endt, name='uniq_endt'),
+                      )
 
     def __repr__(self):
         return "<activity record ('%s','%s','%s','%s','%s')>" % (self.day, self.startt, self.endt, self.a_done, self.comments)
@@ -95,7 +404,102 @@ class ActvtyCat(Base):  # an activity category
     activities = relationship('ActvtyRec', backref='category')
 
 
+class ActvtyRollup(Base):  # daily totals per activity
+    """ minutes spent & number of records per (day, activity), kept up to date on every write to act_recs (see dr_bll),
+    so reports read O(days) rows instead of O(records). Intervals crossing midnight count their minutes towards both days,
+    but are only counted (rec_count) on the day they started. Records without start or end time are left out
+    """
+    __tablename__ = 'act_rollups'
+    day = Column(DayNumber, primary_key=True)
+    a_done = Column(String(40), primary_key=True)
+    minutes = Column(Integer, nullable=False, default=0)
+    rec_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<activity rollup ('%s','%s','%s','%s')>" % (self.day, self.a_done, self.minutes, self.rec_count)
+
+
+# ======== FULL-TEXT SEARCH ========================================================================
+# sqlite only : act_search, an FTS5 table with 1 row per act_recs row (rowid = a_id) holding its a_done, comments & category,
+# kept in the same transaction as the writes by triggers (so ORM, Core & raw sql writes alike). Created with the schema
+# (or by the alembic migration), indexing the records already there. Words are matched by prefix : see bll.search_acts
+
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE act_search USING fts5(a_done, comments, a_cat, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    # records
+    "CREATE TRIGGER act_search_rec_insert AFTER INSERT ON act_recs BEGIN "
+    "INSERT INTO act_search (rowid, a_done, comments, a_cat) VALUES (new.a_id, new.a_done, new.comments, "
+    "(SELECT a_cat FROM act_cats WHERE a_done = new.a_done)); END",
+    "CREATE TRIGGER act_search_rec_update AFTER UPDATE OF a_id, a_done, comments ON act_recs BEGIN "
+    "DELETE FROM act_search WHERE rowid = old.a_id; "
+    "INSERT INTO act_search (rowid, a_done, comments, a_cat) VALUES (new.a_id, new.a_done, new.comments, "
+    "(SELECT a_cat FROM act_cats WHERE a_done = new.a_done)); END",
+    "CREATE TRIGGER act_search_rec_delete AFTER DELETE ON act_recs BEGIN "
+    "DELETE FROM act_search WHERE rowid = old.a_id; END",
+    # categories : the records of the activity (found via the a_done index) get the new category
+    "CREATE TRIGGER act_search_cat_insert AFTER INSERT ON act_cats BEGIN "
+    "UPDATE act_search SET a_cat = new.a_cat WHERE rowid IN (SELECT a_id FROM act_recs WHERE a_done = new.a_done); END",
+    "CREATE TRIGGER act_search_cat_update AFTER UPDATE OF a_done, a_cat ON act_cats BEGIN "
+    "UPDATE act_search SET a_cat = NULL WHERE rowid IN (SELECT a_id FROM act_recs WHERE a_done = old.a_done); "
+    "UPDATE act_search SET a_cat = new.a_cat WHERE rowid IN (SELECT a_id FROM act_recs WHERE a_done = new.a_done); END",
+    "CREATE TRIGGER act_search_cat_delete AFTER DELETE ON act_cats BEGIN "
+    "UPDATE act_search SET a_cat = NULL WHERE rowid IN (SELECT a_id FROM act_recs WHERE a_done = old.a_done); END",
+]
+SEARCH_TRIGGERS = ['act_search_rec_insert', 'act_search_rec_update', 'act_search_rec_delete',
+                   'act_search_cat_insert', 'act_search_cat_update', 'act_search_cat_delete']
+SEARCH_FILL = ("INSERT INTO act_search (rowid, a_done, comments, a_cat) "
+               "SELECT act_recs.a_id, act_recs.a_done, act_recs.comments, act_cats.a_cat FROM act_recs "
+               "LEFT OUTER JOIN act_cats ON act_cats.a_done = act_recs.a_done")
+
+# for queries only : not part of Base.metadata, so create_all / drop_all leave it to the functions below
+search_table = Table('act_search', MetaData(), Column('rowid', Integer, primary_key=True), Column('a_done', String),
+                     Column('comments', String), Column('a_cat', String))
+
+
+def has_search_index(connection):
+    return (connection.dialect.name == 'sqlite'
+            and connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'act_search'").first() is not None)
+
+
+@event.listens_for(Base.metadata, 'after_create')
+def create_search_index(metadata, connection, **kw):
+    """ creates act_search & its triggers if missing (sqlite only), indexing the records already there """
+    if connection.dialect.name != 'sqlite' or has_search_index(connection):
+        return
+    for _ddl in SEARCH_DDL:
+        connection.exec_driver_sql(_ddl)
+    connection.exec_driver_sql(SEARCH_FILL)
+
+
+@event.listens_for(Base.metadata, 'before_drop')
+def drop_search_index(metadata, connection, **kw):
+    """ drops act_search & its triggers (so writes no longer keep it up to date) """
+    if connection.dialect.name == 'sqlite':
+        for _trigger in SEARCH_TRIGGERS:
+            connection.exec_driver_sql("DROP TRIGGER IF EXISTS %s" % _trigger)
+        connection.exec_driver_sql("DROP TABLE IF EXISTS act_search")
+
+
+# ======== COLUMN DEFAULTS =========================================================================
+
+def column_defaults(base=Base):
+    """ returns {orm_class: {col_name: default value}} for all mapped classes' scalar column defaults,
+    string defaults lower-cased (for case-insensitive comparison)
+    """
+    registry = dict()
+    for _mapper in base.registry.mappers:
+        _defaults = dict()
+        for _col_name, _col in _mapper.columns.items():
+            if _col.default is not None and _col.default.is_scalar:
+                _arg = _col.default.arg
+                _defaults[_col_name] = _arg.lower() if isinstance(_arg, str) else _arg
+        registry[_mapper.class_] = _defaults
+    return registry
+
+
 # ======== STARTERS ================================================================================
 
+COL_DEFAULTS = column_defaults()  # built once, so no per-row reflection needed
+
 
 dal = DataAccessLayer()  # starting instance can be used by others (needs to have attributes modified)
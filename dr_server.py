@@ -0,0 +1,170 @@
+"""
+Local HTTP / JSON api on top of dr_bll, for scripts & tools to record & query activities (standard library only).
+    POST /acts       {"day": "2019-05-01", "startt": "09:00", "endt": "10:00", "a_done": "yoga"[, "comments": ".."]}, or a list of them
+                     -> 201 {"a_ids": [..]}
+    GET  /names?q=yo[&column=a_done|a_cat][&limit=20]
+                     -> 200 {"names": [[name, count], ..]}
+    POST /collapse   {"act_list": [..], "updated_actvty_name": ".."}
+                     -> 200 {"num_concated": .., "num_replaced": ..}
+Errors are {"error": ".."} with 400 (bad request), 404 (no such endpoint), 409 (eg unknown activity : foreign key) or 500 (db error).
+Records posted at about the same time are written together, in 1 transaction (see bll.BufferedRecorder).
+Usage: python dr_server.py [--db sqlite:///day_record.db] [--port 8765] [--profile durable]
+"""
+
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from sqlalchemy import exc
+
+import dr_schema as s
+import dr_bll as bll
+
+
+# ====== CONSTANTS =================================================================================
+DEFAULT_DB_URL = 'sqlite:///day_record.db'  # as dr_ui's default
+DEFAULT_PORT = 8765
+BATCH_MAX_ROWS = 500  # most records written per transaction
+BATCH_WAIT_SECS = 0.002  # how long the first request of a batch waits for others to join it
+SEARCH_COLUMNS = {'a_done': s.ActvtyRec.a_done, 'a_cat': s.ActvtyCat.a_cat}
+SEARCH_LIMIT = 20
+
+# ===================================================================================================
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_act(act):
+    """ ActvtyRec of 1 posted json object """
+    if not isinstance(act, dict):
+        raise BadRequest("Expected an object per activity, got : %r" % (act,))
+    missing = [_k for _k in ('day', 'startt', 'endt', 'a_done') if not act.get(_k)]
+    if missing:
+        raise BadRequest("Missing : %s" % ', '.join(missing))
+    try:
+        rec = s.ActvtyRec(day=bll.parse_date_str(act['day']), startt=bll.parse_time_str(act['startt']),
+                          endt=bll.parse_time_str(act['endt']), a_done=act['a_done'])
+    except (ValueError, TypeError, OverflowError) as err:
+        raise BadRequest("Bad day / time in %r : %s" % (act, err))
+    if act.get('comments'):
+        rec.comments = act['comments']
+    return rec
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive : clients can send many requests per connection (all replies have a Content-Length)
+    disable_nagle_algorithm = True  # else the body, written after the headers, waits for the client's (delayed) ack : ~40ms per reply
+
+    def log_message(self, format_, *args):  # quiet : 1 line per request would cost more than the request
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'null')
+        except ValueError as err:
+            raise BadRequest("Invalid json : %s" % err)
+
+    def handle_api(self, method):
+        url = urlsplit(self.path)
+        route = self.server.routes.get((method, url.path))
+        if route is None:
+            return self.send_json(404, {'error': "No such endpoint : %s %s" % (method, url.path)})
+        try:
+            status, body = route(self, parse_qs(url.query))
+        except BadRequest as err:
+            status, body = 400, {'error': str(err)}
+        except bll.UnknownActivity as err:
+            status, body = 409, {'error': str(err)}
+        except exc.IntegrityError as err:
+            status, body = 409, {'error': str(err.orig)}
+        except exc.SQLAlchemyError as err:  # eg db locked for too long
+            status, body = 500, {'error': str(err)}
+        self.send_json(status, body)
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    # ------ endpoints : (status, json body) ------
+
+    def post_acts(self, params):
+        acts = self.read_json()
+        recs = [parse_act(_act) for _act in (acts if isinstance(acts, list) else [acts])]
+        if not recs:
+            raise BadRequest("No activities")
+        return 201, {'a_ids': self.server.recorder.submit(recs).result()}
+
+    def get_names(self, params):
+        column = params.get('column', ['a_done'])[0]
+        if column not in SEARCH_COLUMNS:
+            raise BadRequest("Unknown column : %s (use one of %s)" % (column, tuple(SEARCH_COLUMNS)))
+        try:
+            limit = int(params.get('limit', [SEARCH_LIMIT])[0])
+        except ValueError:
+            raise BadRequest("limit must be an integer")
+        with self.server.dal.session_scope() as session:
+            names = bll.search_names(session, SEARCH_COLUMNS[column], params.get('q', [''])[0], limit)
+        return 200, {'names': names}
+
+    def post_collapse(self, params):
+        body = self.read_json()
+        if not isinstance(body, dict) or not body.get('act_list') or not body.get('updated_actvty_name'):
+            raise BadRequest("Expected {\"act_list\": [..], \"updated_actvty_name\": \"..\"}")
+        with self.server.dal.session_scope() as session:
+            num_concated, num_replaced = bll.collapse_acts(session, list(body['act_list']), body['updated_actvty_name'])
+        return 200, {'num_concated': num_concated, 'num_replaced': num_replaced}
+
+
+class ApiServer(ThreadingHTTPServer):
+    """ 1 thread per connection ; they share the dal's engine (pool) & 1 bll.BufferedRecorder (unknown activities are refused) """
+    daemon_threads = True
+    routes = {('POST', '/acts'): ApiHandler.post_acts,
+              ('GET', '/names'): ApiHandler.get_names,
+              ('POST', '/collapse'): ApiHandler.post_collapse}
+
+    def __init__(self, address, dal, batch_rows=BATCH_MAX_ROWS, batch_wait=BATCH_WAIT_SECS):
+        ThreadingHTTPServer.__init__(self, address, ApiHandler)
+        self.dal = dal
+        self.recorder = bll.BufferedRecorder(dal, max_rows=batch_rows, flush_secs=batch_wait, add_missing=False)
+
+    def server_close(self):
+        ThreadingHTTPServer.server_close(self)
+        self.recorder.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP / JSON api to record & query activities")
+    parser.add_argument('--db', default=DEFAULT_DB_URL, help="db url [%(default)s]")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--profile', default=s.DB_PROFILE, choices=[_p for _p in s.SQLITE_PROFILES if _p != s.READ_ONLY_PROFILE])
+    args = parser.parse_args(argv)
+    dal = s.DataAccessLayer(args.db, profile=args.profile)
+    dal.connect()
+    server = ApiServer((args.host, args.port), dal)
+    print("... serving %s on http://%s:%d (Ctrl-C to stop)" % (args.db, args.host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dal.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,7 @@
-from dateutil.parser import parse
+import sys
+import argparse
 import datetime as dt
-
-import myutil as u
-import dr_schema as s
-import dr_bll as bll
-
-from sqlalchemy import exc  # for exceptions
-import pandas as pd
+import importlib.util
 
 
 # ====== CONSTANTS =================================================================================
@@ -16,6 +11,34 @@ SHOW_RESULTS_NO = 20
 # ===================================================================================================
 
 
+def lazy_import(name):
+    """ module name, only executed when one of its attributes is first used (importlib.util.LazyLoader).
+    Heavier modules used in a task or 2 only (pandas, dateutil, myutil / readline) are imported within them instead
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# sqlalchemy & the models take most of the start up : loaded by the first db task (or quick_record), not before the menu shows.
+# dr_bll registers its session & mapper events once loaded : refresh_session & quick_record use it before anything is written
+s = lazy_import('dr_schema')
+bll = lazy_import('dr_bll')
+
+
+def format_counts(names, counts):
+    """ names & their counts as aligned lines, most used first as given (as a pandas Series prints, without loading pandas) """
+    if not names:
+        return "(none)"
+    width = max(len(_n) for _n in names)
+    return '\n'.join("%-*s %8d" % (width, _n, _c) for _n, _c in zip(names, counts))
+
+
 def prompt_for_db():
     # assumes sqlite
     subchoice = input("... Please specify db to use [db hardkeyed] >> ")
@@ -32,6 +55,7 @@ def choose_date(return_none=False, greeting='Enter date: ([today]) >>>'):
     """
     def parse_date(date_str, return_none=False):
         if date_str != '':
+            from dateutil.parser import parse
             return parse(date_str).date()
         else:
             if return_none:
@@ -48,6 +72,7 @@ def choose_time(return_none=False, greeting='Enter time: [now] >>>'):
     """
     def parse_time(time_str, return_none=False):
         if time_str != '':
+            from dateutil.parser import parse
             t = parse(time_str).time()
         else:
             if return_none:
@@ -64,8 +89,10 @@ class Task:
     """ A semi-abstract class for one of the user-implemented methods chosen by user
     """
 
-    def __init__(self, session):
+    def __init__(self, session, name_indexes=(), cat_cache=None):
         self.session = session
+        self.name_indexes = name_indexes  # bll.NameIndex's kept by TaskMenu, searched instead of db if available
+        self.cat_cache = cat_cache  # bll.CategoryCache kept by TaskMenu, to check activities before inserting them
 
     def run(self):
         """ runs the given Task sub-class"""
@@ -74,41 +101,58 @@ class Task:
     def prompt_for_name(self, column_obj, greeting='Enter name: >>>'):
         """ prompts user to choose activity"""
         keyedin_ = input(greeting)
+        _names, _counts = [], []
         while keyedin_ != '':
-            distinct_stats = dict()  # effectively clears previous results
-            results = self.session.query(column_obj).filter(column_obj.like('%' + keyedin_ + '%'))
-            for _result in results.distinct():
-                distinct_stats[_result[0]] = results.filter(column_obj == _result[0]).count()  # since distinct returns 1-item tuple : eg (queryresult, )
-            _names, _counts = list(distinct_stats.keys()), list(distinct_stats.values())
-            # print a nice pandas series frame :
-            print(pd.Series(_counts, index=_names).sort_values(ascending=False).head(SHOW_RESULTS_NO), "\n")
+            name_index = next((_ix for _ix in self.name_indexes if _ix.column_obj is column_obj), None)
+            with s.operation('prompt_for_name'):
+                if name_index is not None:
+                    name_counts = name_index.search(keyedin_, limit=SHOW_RESULTS_NO)  # already sorted by count
+                else:
+                    name_counts = bll.search_names(self.session, column_obj, keyedin_, limit=SHOW_RESULTS_NO)
+            _names, _counts = [_n for _n, _c in name_counts], [_c for _n, _c in name_counts]
+            print(format_counts(_names, _counts), "\n")
             keyedin_ = input("Re-enter? " + greeting)
         return _names, _counts, keyedin_
 
     def handle_IE_exc(self, err, event_):
-        # handles integrity error exception
+        """ handles an integrity error in recording event_ (after the session's rollback) ; returns True if the insert is worth
+        retrying : ie the foreign key failed & the activity's category has now been added
+        """
         # ?? perhaps make this a separate class with user-methods having this object as an attribute which can then get actioned?
         # advantages: allows definition of object
         print("***** handle_IE_exc : IE encountered in recording event_")
         print(err)
         #  foreign key error : head category doesn't exist; therefore prompt to add:
-        if 'foreign key' in str(err).lower():
-            proceed_ = input(f"... !! {event_.a_done} isn't in the category table. Would you like to add it ? ([y]/n >>> ")
-            # double check here that it isn't in the next level category table ?
-            if proceed_ != 'n':
-                greeting = f"... Enter activity category for {event_.a_done} >>> "
-                _name_choices, _counts, keyedin_ = self.prompt_for_name(column_obj=s.ActvtyCat.a_cat, greeting=greeting)
-                u.readline.set_completer(u.MyCompleter(_name_choices).complete)
-                _final_choice = input("... complete activity category choice >>  ")
-                _new_catgrzn = s.ActvtyCat(a_cat=_final_choice, a_done=event_.a_done)
-                self.session.add(_new_catgrzn)
+        if 'foreign key' not in str(err).lower():  # eg unique constraint : retrying would fail the same way
+            if 'unique' in str(err).lower():
+                print(f"... !! {event_} clashes with an activity already recorded on that day (same start or end time) : not recorded")
+            return False
+        _final_choice = self.add_category(event_.a_done)
+        if _final_choice is None:
+            return False
         try:
             self.session.commit()
         except Exception as err:
             print(f"... ! Exception occured in trying to commit {event_.a_done} : {_final_choice} relationship")
             print(err)
-        else:
-            print('... added...')
+            self.session.rollback()
+            return False
+        print('... added...')
+        return True
+
+    def add_category(self, a_done):
+        """ prompts to add a_done to the category table (added to the session, not committed) ; returns its category, or None """
+        proceed_ = input(f"... !! {a_done} isn't in the category table. Would you like to add it ? ([y]/n >>> ")
+        # double check here that it isn't in the next level category table ?
+        if proceed_ == 'n':
+            return None
+        greeting = f"... Enter activity category for {a_done} >>> "
+        _name_choices, _counts, keyedin_ = self.prompt_for_name(column_obj=s.ActvtyCat.a_cat, greeting=greeting)
+        import myutil as u  # (& readline) only when completing a name
+        u.readline.set_completer(u.MyCompleter(_name_choices).complete)
+        _final_choice = input("... complete activity category choice >>  ")
+        self.session.add(s.ActvtyCat(a_cat=_final_choice, a_done=a_done))
+        return _final_choice
 
     def choose_activity(self, greeting='Enter activity >>> '):
         # enter some characters (eg4) -> send sql query (select where like '%cha%') to bl which sends back results
@@ -117,6 +161,7 @@ class Task:
         greeting = "... Choose activity : please enter some letters for activity and hit enter >>> "  # override
         _name_choices, _counts, keyedin_ = self.prompt_for_name(column_obj=s.ActvtyRec.a_done, greeting=greeting)
         # now use this as basis for myCompleter :
+        import myutil as u
         u.readline.set_completer(u.MyCompleter(_name_choices).complete)
         _final_choice = input("Complete activity choice >>  ")
         return _final_choice
@@ -126,20 +171,31 @@ class RecordActivity(Task):
     """ User gets to record an event : eg 20:00 to 22:00, coded dayplanner.
     """
 
-    def __init__(self, session):
-        Task.__init__(self, session)
+    def __init__(self, session, name_indexes=(), cat_cache=None):
+        Task.__init__(self, session, name_indexes, cat_cache)
 
     def run(self):
         """
         Record activity : allows entering some activity, & then returns matching entries in that db
         Records time spent in activity, given start time and end Time
         """
+        from sqlalchemy import exc  # for exceptions
         d = choose_date()
         st = choose_time(greeting='Enter start time [now] (eg 22:39) >>> ')
         et = choose_time(greeting='Enter end time [now] (eg 22:39) >>> ')
         acty = self.choose_activity()
+        if self.cat_cache is not None and self.cat_cache.unknown(self.session, [acty]):
+            self.add_category(acty)  # now, rather than from a foreign key error (& rollback) at commit
         event_ = s.ActvtyRec(day=d, startt=st, endt=et, a_done=acty)
-        proceed_ = input(f"... Proceed to enter {event_} ([y]/n)? >> ")
+        overlaps = bll.find_overlaps(self.session, d, st, et)
+        if overlaps:
+            print("... !! overlaps with already recorded :")
+            for _rec in overlaps:
+                print(f"      {_rec}")
+            proceed_ = input(f"... Proceed to enter {event_} anyway (y/[n])? >> ")
+            proceed_ = 'y' if proceed_ == 'y' else 'n'
+        else:
+            proceed_ = input(f"... Proceed to enter {event_} ([y]/n)? >> ")
         if proceed_ != 'n':
             while True:
                 try:
@@ -148,7 +204,9 @@ class RecordActivity(Task):
                     self.session.commit()
                 except (exc.IntegrityError, exc.OperationalError) as err:  # eg foreign key error
                     self.session.rollback()
-                    self.handle_IE_exc(err, event_)
+                    if not self.handle_IE_exc(err, event_):  # retried only once the missing category is added
+                        print("... aborted.")
+                        break
                 except Exception as e:
                     print("... !! Unspecified non-IntegrityError for feeding in row : %s" % event_)
                     print(e)
@@ -159,16 +217,16 @@ class RecordActivity(Task):
                     break
         else:
             print("... aborted.")
-        session.close()
+        self.session.close()
 
 
 class CollapseActivity(Task):
-    def __init__(self, session):
-        Task.__init__(self, session)
+    def __init__(self, session, name_indexes=(), cat_cache=None):
+        Task.__init__(self, session, name_indexes, cat_cache)
 
-    def run(self, _act_names, _counts):
+    def run(self, _act_names=None, _counts=None):
         """give option to collapse all activities below certain counts to the same activity,
-        moving over activity name to comments
+        moving over activity name to comments. Run from TaskMenu, first offers to review suggested collapses of similar activities
 
         implementation eg :
         # option to collapse entries :
@@ -183,6 +241,13 @@ class CollapseActivity(Task):
         collapse_stats = (0, 0)
 
         session = self.session
+        if _act_names is None and input("... Review suggested collapses of similar activities (y/[n]) >>> ").lower() == 'y':
+            self.review_suggestions()
+            session.close()
+            return
+        if _act_names is None:  # eg when run from TaskMenu : search for names (and their counts) first
+            greeting = "... Choose activities to collapse : please enter some letters for activity and hit enter >>> "
+            _act_names, _counts, keyedin_ = self.prompt_for_name(column_obj=s.ActvtyRec.a_done, greeting=greeting)
         count_thresh = input(collapse_prompt_2)
         try:
             count_thresh = int(count_thresh)
@@ -192,23 +257,190 @@ class CollapseActivity(Task):
             updated_actvty_name = input(collapse_prompt_3)
             _act_names = [_a for _i, _a in enumerate(_act_names) if _counts[_i] <= count_thresh]
             print(_act_names)
-            collapse_stats = bll.collapse_acts(session, act_list=_act_names, updated_actvty_name=updated_actvty_name)
+            with s.operation('collapse_acts'):
+                collapse_stats = bll.collapse_acts(session, act_list=_act_names, updated_actvty_name=updated_actvty_name)
             collapse_prompt_3 = f" ... Proceed with {collapse_stats[0]} concatenations and {collapse_stats[1]} replacements for {updated_actvty_name} (y/[n])? >>> "
             if input(collapse_prompt_3) == 'y':
                 session.commit()
         session.close()
 
+    def review_suggestions(self):
+        """ goes through bll.suggest_collapses of all activity names, most records moved first : user accepts, skips or stops
+        at each. The accepted ones are committed together, after confirming
+        """
+        session = self.session
+        column_obj = s.ActvtyRec.a_done
+        name_index = next((_ix for _ix in self.name_indexes if _ix.column_obj is column_obj), None)
+        with s.operation('suggest_collapses'):
+            if name_index is not None:
+                name_counts = dict(name_index.counts)
+            else:
+                name_counts = bll.search_names(session, column_obj, '')
+            suggestions = bll.suggest_collapses(name_counts)
+        name_counts = dict(name_counts)
+        print(f"... {len(suggestions)} suggested collapses")
+        collapse_stats, accepted = [0, 0], 0
+        for _act_list, _target in suggestions:
+            print(format_counts(_act_list, [name_counts[_a] for _a in _act_list]))
+            choice = input(f"... Collapse into {_target} ({name_counts[_target]}) : (y/[n]/q to stop) >>> ").lower()
+            if choice == 'q':
+                break
+            if choice == 'y':
+                with s.operation('collapse_acts'):
+                    _stats = bll.collapse_acts(session, act_list=_act_list, updated_actvty_name=_target)
+                collapse_stats = [_total + _n for _total, _n in zip(collapse_stats, _stats)]
+                accepted += 1
+        if accepted and input(f" ... Proceed with {collapse_stats[0]} concatenations and {collapse_stats[1]} replacements "
+                              f"for {accepted} collapses (y/[n])? >>> ") == 'y':
+            session.commit()
+        else:
+            session.rollback()
+
+
+class ImportActivities(Task):
+    """ User gets to bulk load activity records from a csv or parquet file (eg historical logs)
+    """
+
+    def __init__(self, session, name_indexes=(), cat_cache=None):
+        Task.__init__(self, session, name_indexes, cat_cache)
+
+    def run(self):
+        path = input("... Enter path of csv / parquet file to import (columns day, startt, endt, a_done [, comments, a_cat]) >>> ")
+        if path == '':
+            print("... aborted.")
+            return
+        default_cat = input("... Enter category for activities not yet categorised [none] >>> ") or None
+        try:
+            import_stats = bll.import_acts(self.session, path, default_cat=default_cat, cat_cache=self.cat_cache)
+        except Exception as err:
+            print("... !! Import failed, nothing imported : ")
+            print(err)
+        else:
+            print("... imported {rows} records ({cats_added} new categories) in {secs:.1f}s : {rows_per_sec:.0f} rows/s".format(**import_stats))
+        self.session.close()
+
+
+class ExportActivities(Task):
+    """ User gets to export activity records (with their category) to a parquet / arrow file, eg for analysis elsewhere
+    """
+
+    def __init__(self, session, name_indexes=(), cat_cache=None):
+        Task.__init__(self, session, name_indexes, cat_cache)
+
+    def run(self):
+        path = input("... Enter path of file to export to (.parquet or .arrow) >>> ")
+        if path == '':
+            print("... aborted.")
+            return
+        from dateutil.parser import parse
+        filters = dict()
+        for _key, _greeting in (('day_from', "... From day [first] >>> "), ('day_to', "... To day [last] >>> ")):
+            _day = input(_greeting)
+            filters[_key] = parse(_day).date() if _day else None
+        filters['a_cat'] = input("... Only category [all] >>> ") or None
+        try:
+            export_stats = bll.export_acts(self.session, path, **filters)
+        except Exception as err:
+            print("... !! Export failed : ")
+            print(err)
+        else:
+            print("... exported {rows} records in {secs:.1f}s : {rows_per_sec:.0f} rows/s".format(**export_stats))
+        self.session.close()
+
+
+class ReportTimeUsage(Task):
+    """ User gets to see how time was spent : hours per activity or category, in total or per day / week / month
+    """
+
+    def __init__(self, session, name_indexes=(), cat_cache=None):
+        Task.__init__(self, session, name_indexes, cat_cache)
+
+    def run(self):
+        import pandas as pd
+        import dr_report as rep
+        from dateutil.parser import parse
+        by = 'a_done' if input("... Report per activity or per category (a/[c]) >>> ") == 'a' else 'a_cat'
+        period = input("... Per period : day, week, month or [total] >>> ") or None
+        days = [input(_greeting) for _greeting in ("... From day [first] >>> ", "... To day [last] >>> ")]
+        day_from, day_to = [parse(_day).date() if _day else None for _day in days]
+        try:
+            if not rep.rollups_available(self.session):
+                print("... daily rollups are empty : reading all records (run 'Rebuild daily rollups' to speed this up)")
+            usage = rep.time_usage(self.session, by=by, period=period, day_from=day_from, day_to=day_to)
+        except ValueError as err:
+            print(err)
+        else:
+            with pd.option_context('display.max_rows', None):
+                print((usage / 60).round(1).rename('hours'), "\n")
+        self.session.close()
+
+
+class RebuildRollups(Task):
+    """ User gets to recompute the daily rollups (used by reports) from all records, eg after writing to the db by other means
+    """
+
+    def __init__(self, session, name_indexes=(), cat_cache=None):
+        Task.__init__(self, session, name_indexes, cat_cache)
+
+    def run(self):
+        num_rollups = bll.rebuild_rollups(self.session)
+        self.session.commit()
+        print(f"... rebuilt {num_rollups} daily rollups.")
+        self.session.close()
+
+
+class CheckOverlaps(Task):
+    """ User gets to list all pairs of recorded activities overlapping each other
+    """
+
+    def __init__(self, session, name_indexes=(), cat_cache=None):
+        Task.__init__(self, session, name_indexes, cat_cache)
+
+    def run(self):
+        overlaps = bll.scan_overlaps(self.session)
+        recs = {_r.a_id: _r for _r in self.session.query(s.ActvtyRec).filter(s.ActvtyRec.a_id.in_({_id for _pair in overlaps for _id in _pair}))}
+        for _id_1, _id_2 in overlaps:
+            print(f"... {recs[_id_1]} overlaps {recs[_id_2]}")
+        print(f"... found {len(overlaps)} overlapping pairs.")
+        self.session.close()
+
+
+class SearchActivities(Task):
+    """ User gets to search records by words in their activity, comments (eg activities collapsed into another) or category,
+    best matches first
+    """
+
+    def __init__(self, session, name_indexes=(), cat_cache=None):
+        Task.__init__(self, session, name_indexes, cat_cache)
+
+    def run(self):
+        import pandas as pd
+        keyedin_ = input("... Search for (beginnings of) words in activities, comments & categories >>> ")
+        while keyedin_ != '':
+            results = bll.search_acts(self.session, keyedin_, limit=SHOW_RESULTS_NO)
+            if results:
+                columns = ['a_id', 'day', 'startt', 'endt', 'a_done', 'comments', 'a_cat']
+                print(pd.DataFrame(results, columns=columns).set_index('a_id').to_string(), "\n")
+            else:
+                print("... nothing found\n")
+            keyedin_ = input("... Search again (Enter to stop) >>> ")
+        self.session.close()
+
 
 class TaskMenu:
     # class variables
     std_prompt = "\nPlease choose the integer corresponding to task to perform (or Enter to exit): >> "
     std_farewell = "Bye-bye!"
 
-    def __init__(self, task_choices, task_procedures):
+    def __init__(self, task_choices, task_procedures, profile=False, db_url=None):
         self.task_choices = task_choices  # string of task explanations
         self.task_procedures = task_procedures  # functions corresponding to above
+        self.profile = profile  # print the statements run (counts, time, slow ones) after each task
         self.session = None
-        self.db_url = None
+        self.db_url = db_url  # asked for by the first task if None
+        self.dal = None
+        self.name_indexes = []
+        self.cat_cache = None
 
     def refresh_session(self):
         # if self.session:
@@ -216,10 +448,20 @@ class TaskMenu:
         if not self.session:  # connect to a session
             if not self.db_url:
                 self.db_url = prompt_for_db()
-            dal = s.DataAccessLayer(self.db_url)
-            dal.connect()
-            dal.create_session()
-            self.session = dal.session
+            self.dal = s.DataAccessLayer(self.db_url)  # engine (pool, pragmas, schema check) is cached per db url
+            self.dal.connect()
+            self.dal.create_session()
+            self.session = self.dal.session
+            if self.profile:
+                self.dal.start_profiling()
+            # load activity / category names once per session; thereafter kept up to date by committed changes
+            for _ix in self.name_indexes:
+                _ix.close()
+            self.name_indexes = [bll.NameIndex(s.ActvtyRec.a_done).load(self.session),
+                                 bll.NameIndex(s.ActvtyCat.a_cat).load(self.session)]
+            if self.cat_cache is not None:
+                self.cat_cache.close()
+            self.cat_cache = bll.CategoryCache().load(self.session)
 
     def user_choose(self, session=None, welcome_str=std_prompt, farewell_str=std_farewell):
         """prompt user to choose, implement choice & then begin again """
@@ -235,15 +477,76 @@ class TaskMenu:
             else:
                 self.refresh_session()
                 choice = int(choice)
-                chosen_task = self.task_procedures[choice - 1](self.session)
-                chosen_task.run()
+                chosen_task = self.task_procedures[choice - 1](self.session, self.name_indexes, self.cat_cache)
+                with s.operation(type(chosen_task).__name__):
+                    chosen_task.run()
+                if self.dal is not None and self.dal.profiler is not None:
+                    print("\n... statements run :")
+                    print(self.dal.profiler.report())
+                    self.dal.profiler.reset()
             print("\n")
         print(farewell_str)
 
 
-if __name__ == '__main__':
-    main_choices = ["Record activity", "Collapse activity"]
-    main_methods = [RecordActivity, CollapseActivity]
+def quick_record(db_url, a_done, startt, endt=None, day=None, comments=None, a_cat=None, force=False):
+    """ records 1 activity without any prompt (eg from a hotkey) & commits it ; returns its a_id.
+    Times & day are strings as keyed in ('9:30', '2019-05-01', ..) ; endt defaults to now, day to today.
+    Raises bll.UnknownActivity if a_done isn't in act_cats & no a_cat is given to add it with, ValueError if it overlaps
+    already recorded activities (unless force)
+    """
+    now = dt.datetime.now()
+    day = bll.parse_date_str(day) if day else now.date()
+    startt = bll.parse_time_str(startt)
+    endt = bll.parse_time_str(endt) if endt else now.time().replace(second=0, microsecond=0)
+    dal = s.DataAccessLayer(db_url)
+    dal.connect()
+    try:
+        with dal.session_scope() as session:
+            if session.get(s.ActvtyCat, a_done) is None:
+                if not a_cat:
+                    raise bll.UnknownActivity("%s isn't in the category table : give its category to add it" % a_done)
+                session.add(s.ActvtyCat(a_done=a_done, a_cat=a_cat))
+            overlaps = bll.find_overlaps(session, day, startt, endt)
+            if overlaps and not force:
+                raise ValueError("overlaps with already recorded : %s" % ', '.join(str(_rec) for _rec in overlaps))
+            rec = s.ActvtyRec(day=day, startt=startt, endt=endt, a_done=a_done)
+            if comments:
+                rec.comments = comments
+            session.add(rec)
+            session.flush()
+            return rec.a_id
+    finally:
+        dal.dispose()
+
 
-    main_task = TaskMenu(main_choices, main_methods)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record & report daily activities")
+    parser.add_argument('--profile', action='store_true', help="print the sql statements run (counts, time, slow ones) after each task")
+    parser.add_argument('--db', help="sqlite db file [asked for ; %s with --record]" % DEFAULT_DB)
+    quick = parser.add_argument_group("quick record", "record 1 activity without any prompt, & exit")
+    quick.add_argument('--record', metavar='ACTIVITY')
+    quick.add_argument('--start', metavar='TIME', help="eg 9:30")
+    quick.add_argument('--end', metavar='TIME', help="[now]")
+    quick.add_argument('--day', help="[today]")
+    quick.add_argument('--comments')
+    quick.add_argument('--cat', help="category, to add the activity with if it's new")
+    quick.add_argument('--force', action='store_true', help="record even if it overlaps already recorded activities")
+    args = parser.parse_args()
+    if args.record:
+        if not args.start:
+            parser.error("--record needs --start")
+        from sqlalchemy import exc
+        try:
+            a_id = quick_record('sqlite:///' + (args.db or DEFAULT_DB), args.record, args.start, args.end, args.day,
+                                comments=args.comments, a_cat=args.cat, force=args.force)
+        except (ValueError, OverflowError, exc.SQLAlchemyError) as err:  # eg unknown activity, bad time, same start time as another
+            sys.exit("... !! %s not recorded : %s" % (args.record, err))
+        print("... recorded %s (a_id %d)" % (args.record, a_id))
+        sys.exit()
+    main_choices = ["Record activity", "Collapse activity", "Import activities", "Export activities", "Report time usage",
+                    "Rebuild daily rollups", "Check for overlapping activities", "Search activities & comments"]
+    main_methods = [RecordActivity, CollapseActivity, ImportActivities, ExportActivities, ReportTimeUsage,
+                    RebuildRollups, CheckOverlaps, SearchActivities]
+
+    main_task = TaskMenu(main_choices, main_methods, profile=args.profile, db_url=args.db and 'sqlite:///' + args.db)
     main_task.user_choose()
@@ -1,11 +1,30 @@
 
+import os
+import sys
+import json
+import sqlite3
+import asyncio
 import unittest
+import threading
+import subprocess
+import urllib.request
+from urllib.error import HTTPError
+import tempfile
 import datetime as dt
 from dateutil.parser import parse
+import pandas as pd
+
+from sqlalchemy import event, exc, func
 
 import dr_schema as s
 from dr_schema import dal
 import dr_bll as bl
+import dr_report as rep
+import dr_async as da
+import dr_server as srv
+import dr_ui as ui
+import dr_partition as dp
+import dr_migrate as dm
 
 
 def prep_db(session):
@@ -20,6 +39,8 @@ def prep_db(session):
     et = parse('10:02').time()
     acty = 'hatha yoga'
     A2 = s.ActvtyRec(day=d, startt=st, endt=et, a_done=acty)
+    # categories for all activities used in TestDayRecord (foreign keys are on)
+    dal.session.add_all([s.ActvtyCat(a_done=_a, a_cat='test') for _a in ('yoga', 'hatha yoga', 'email', 'email hatha', 'Emailing')])
     dal.session.add_all([A1, A2])
     dal.session.commit()
 
@@ -98,6 +119,11 @@ class TestDayRecord(unittest.TestCase):
         # check that comments
         self.assertEqual([str(_.comments) for _ in results.filter(s.ActvtyRec.a_done == 'email hatha')], ['testing'])
 
+    def test_2_search_names(self):
+        self.assertEqual(bl.search_names(dal.session, s.ActvtyRec.a_done, 'yoga'), [('hatha yoga', 1), ('yoga', 1)])
+        self.assertEqual(bl.search_names(dal.session, s.ActvtyRec.a_done, 'a', limit=2), [('email', 1), ('email hatha', 1)])
+        self.assertEqual(bl.search_names(dal.session, s.ActvtyRec.a_done, 'zzz'), [])
+
     def test_3_collapse_acts(self):
         def test_query():
             return dal.session.query(s.ActvtyRec).filter(s.ActvtyRec.a_done == updated_actvty_name)
@@ -105,7 +131,7 @@ class TestDayRecord(unittest.TestCase):
         updated_actvty_name = 'Emailing'
         act_list = ['email', 'email hatha']
         self.assertEqual(test_query().count(), 0)
-        bl.collapse_acts(dal.session, act_list, updated_actvty_name, count_thresh=1)
+        bl.collapse_acts(dal.session, act_list, updated_actvty_name)
 
         results = test_query()
         self.assertEqual(results.count(), 2)
@@ -115,5 +141,966 @@ class TestDayRecord(unittest.TestCase):
         #     self.assertTrue(u.check_that('cat'))
 
 
+class TestIntegerStorage(unittest.TestCase):
+
+    def test_roundtrip_and_raw_values(self):
+        dal = s.DataAccessLayer('sqlite://')
+        dal.connect()
+        dal.create_session()
+        dal.session.add_all([s.ActvtyCat(a_done='yoga', a_cat='sport'),
+                             s.ActvtyRec(day=dt.date(2019, 5, 1), startt=dt.time(10, 30, 15), endt=dt.time(23, 59), a_done='yoga'),
+                             s.ActvtyRec(day=dt.date(2019, 5, 2), startt=dt.time(0), endt=None, a_done='yoga')])
+        dal.session.commit()
+        recs = dal.session.query(s.ActvtyRec.day, s.ActvtyRec.startt, s.ActvtyRec.endt).order_by(s.ActvtyRec.a_id).all()
+        self.assertEqual(recs, [(dt.date(2019, 5, 1), dt.time(10, 30, 15), dt.time(23, 59)), (dt.date(2019, 5, 2), dt.time(0), None)])
+        raw = dal.session.execute("select day, startt, endt from act_recs order by a_id").fetchall()
+        self.assertEqual(raw, [(dt.date(2019, 5, 1).toordinal(), 37815, 86340), (dt.date(2019, 5, 2).toordinal(), 0, None)])
+        later = dal.session.query(s.ActvtyRec).filter(s.ActvtyRec.startt > dt.time(9), s.ActvtyRec.day >= dt.date(2019, 5, 1))
+        self.assertEqual(later.count(), 1)
+        dal.session.close()
+        dal.dispose()
+
+    def test_unmigrated_db_refused(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'old.db')
+            db_url = 'sqlite:///' + path
+            with sqlite3.connect(path) as conn:  # as before 436a561180ec : TEXT days & times
+                conn.execute("CREATE TABLE act_recs (a_id INTEGER PRIMARY KEY, day DATE, startt TIME, endt TIME, a_done VARCHAR(40), comments VARCHAR)")
+                conn.execute("INSERT INTO act_recs (day, startt, endt, a_done) VALUES ('2019-05-01', '10:00:00.000000', NULL, 'yoga')")
+            with self.assertRaisesRegex(s.SchemaOutOfDate, 'alembic upgrade head'):
+                s.DataAccessLayer(db_url).connect()
+            with sqlite3.connect(path) as conn:
+                self.assertNotIn('act_rollups', [_r[0] for _r in conn.execute("SELECT name FROM sqlite_master")])  # nothing created
+                conn.execute("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)")
+                conn.execute("INSERT INTO alembic_version VALUES ('2b8dfc406f65')")
+            with self.assertRaisesRegex(s.SchemaOutOfDate, '2b8dfc406f65'):
+                s.DataAccessLayer(db_url).connect()
+            with sqlite3.connect(path) as conn:  # as the migrations leave it
+                conn.execute("UPDATE act_recs SET day = %d, startt = 36000" % dt.date(2019, 5, 1).toordinal())
+                conn.execute("UPDATE alembic_version SET version_num = ?", (s.SCHEMA_REVISION,))
+            dal = s.DataAccessLayer(db_url)
+            dal.connect()
+            with dal.session_scope() as session:
+                self.assertEqual(session.query(s.ActvtyRec.day, s.ActvtyRec.startt).all(), [(dt.date(2019, 5, 1), dt.time(10))])
+            dal.dispose()
+
+
+class TestDataAccessLayer(unittest.TestCase):
+
+    def test_engine_cached_and_schema_checked_once(self):
+        dals = [s.DataAccessLayer('sqlite://') for _ in range(3)]
+        for _dal in dals:
+            _dal.connect()
+            _dal.connect()
+        self.assertTrue(all(_dal.engine is dals[0].engine for _dal in dals))
+        self.assertEqual(dals[0].stats['schema_checks'], 1)
+        for _i in range(3):
+            with dals[1].session_scope() as session:
+                session.add(s.ActvtyCat(a_done='yoga %d' % _i, a_cat='sport'))
+        with dals[2].session_scope() as session:
+            self.assertEqual(session.query(s.ActvtyCat).count(), 3)
+        self.assertEqual(dals[0].stats['connects'], 1)  # in-memory : 1 shared connection, so 1 pragma
+        self.assertGreaterEqual(dals[0].stats['checkouts'], 3)
+        dals[0].dispose()
+
+    def test_foreign_keys_on_for_every_session(self):
+        dal = s.DataAccessLayer('sqlite://')
+        dal.connect()
+        for _ in range(2):
+            with self.assertRaises(exc.IntegrityError):
+                with dal.session_scope() as session:
+                    session.add(s.ActvtyRec(day=dt.date(2019, 5, 1), startt=dt.time(9), endt=dt.time(10), a_done='uncategorised'))
+        dal.dispose()
+
+    def test_profile_pragmas_on_every_connection(self):
+        with self.assertRaises(ValueError):
+            s.DataAccessLayer('sqlite://', profile='reckless')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_url = 'sqlite:///' + os.path.join(tmp_dir, 'profile.db')
+            for profile, journal_mode, synchronous in (('plain', 'delete', 2), ('fast', 'wal', 1), ('durable', 'wal', 2)):
+                dal = s.DataAccessLayer(db_url, profile=profile)
+                dal.connect()
+                conns = [dal.engine.connect() for _ in range(2)]  # 2 pooled connections, each with its pragmas
+                for _conn in conns:
+                    self.assertEqual(_conn.exec_driver_sql('pragma journal_mode').scalar(), journal_mode)
+                    self.assertEqual(_conn.exec_driver_sql('pragma synchronous').scalar(), synchronous)
+                    self.assertEqual(_conn.exec_driver_sql('pragma foreign_keys').scalar(), 1)
+                for _conn in conns:
+                    _conn.close()
+                self.assertEqual(dal.stats['connects'], 2)
+                dal.dispose()
+
+    def test_query_profiler_per_operation(self):
+        dal = s.DataAccessLayer('sqlite://')
+        dal.connect()
+        profiler = dal.start_profiling(slow_secs=0)  # every statement is 'slow' : all get a plan
+        with s.operation('record'):
+            with dal.session_scope() as session:
+                session.add(s.ActvtyCat(a_done='yoga', a_cat='sport'))
+        with s.operation('search'), s.operation('names'):
+            with dal.session_scope() as session:
+                bl.search_names(session, s.ActvtyCat.a_done, 'yo')
+        ops = {_row['operation']: _row for _row in profiler.summary()}
+        self.assertGreaterEqual(ops['record']['statements'], 1)
+        self.assertEqual(ops['search/names']['statements'], 1)
+        self.assertEqual(s.current_operation(), '(none)')
+        search = next(_slow for _slow in profiler.slow_statements if _slow['operation'] == 'search/names')
+        self.assertTrue(search['plan'] and any('act_cats' in _line for _line in search['plan']))
+        self.assertIn('search/names', profiler.report())
+        profiler.reset()
+        dal.stop_profiling()
+        with dal.session_scope() as session:
+            session.query(s.ActvtyCat).count()
+        self.assertEqual(profiler.summary(), [])  # stopped : nothing recorded
+        dal.dispose()
+
+
+class TestNameIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        self.session = self.dal.session
+        d = dt.date(2019, 5, 1)
+        self.session.add_all([s.ActvtyCat(a_done=_a, a_cat='sport') for _a in ('yoga', 'hatha yoga', 'Yoga nidra', 'Emailing')]
+                             + [s.ActvtyRec(day=d, startt=dt.time(10, _i), endt=dt.time(10, _i + 1), a_done=_a)
+                                for _i, _a in enumerate(['yoga', 'yoga', 'hatha yoga', 'Yoga nidra'])])
+        self.session.commit()
+        self.name_index = bl.NameIndex(s.ActvtyRec.a_done).load(self.session)
+
+    def tearDown(self):
+        self.name_index.close()
+        self.session.close()
+        self.dal.dispose()
+
+    def test_search_matches_db(self):
+        for keyedin_ in ('yoga', 'YO', 'a', 'nid', 'zzz', ''):
+            self.assertEqual(self.name_index.search(keyedin_), bl.search_names(self.session, s.ActvtyRec.a_done, keyedin_))
+        self.assertEqual(self.name_index.search('yoga', limit=1), [('yoga', 2)])
+
+    def test_follows_committed_changes(self):
+        self.session.add(s.ActvtyRec(day=dt.date(2019, 5, 2), startt=dt.time(9), endt=dt.time(10), a_done='hatha yoga'))
+        self.session.flush()
+        self.assertEqual(self.name_index.search('hatha'), [('hatha yoga', 1)])  # not committed yet
+        self.session.commit()
+        self.assertEqual(self.name_index.search('hatha'), [('hatha yoga', 2)])
+
+        bl.collapse_acts(self.session, ['hatha yoga', 'Yoga nidra'], 'Emailing')
+        self.session.rollback()
+        self.assertEqual(self.name_index.search('mail'), [])
+        bl.collapse_acts(self.session, ['hatha yoga', 'Yoga nidra'], 'Emailing')
+        self.session.commit()
+        self.assertEqual(self.name_index.search('a'), bl.search_names(self.session, s.ActvtyRec.a_done, 'a'))
+        self.assertEqual(self.name_index.search('mail'), [('Emailing', 3)])
+
+
+class TestCategoryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        self.session = self.dal.session
+        self.session.add_all([s.ActvtyCat(a_done='yoga', a_cat='sport'), s.ActvtyCat(a_done='email', a_cat='work')])
+        self.session.commit()
+        self.cat_cache = bl.CategoryCache()
+        self.queries = []
+        event.listen(self.dal.engine, 'before_cursor_execute', self.count_query)
+
+    def count_query(self, conn, cursor, statement, *args):
+        self.queries.append(statement)
+
+    def tearDown(self):
+        event.remove(self.dal.engine, 'before_cursor_execute', self.count_query)
+        self.cat_cache.close()
+        self.session.close()
+        self.dal.dispose()
+
+    def test_ensure_inserts_missing_in_bulk(self):
+        self.assertEqual(self.cat_cache.ensure(self.session, ['yoga', 'email'], default_cat='misc'), [])  # 1 query : the load
+        self.session.execute(s.ActvtyCat.__table__.insert(), {'a_done': 'run', 'a_cat': 'sport'})  # behind the cache's back
+        del self.queries[:]
+        self.assertEqual(self.cat_cache.ensure(self.session, {'swim': 'sport', 'nap': None}, default_cat='misc'), ['nap', 'swim'])
+        self.assertEqual(len(self.queries), 1)  # 1 INSERT .. ON CONFLICT DO NOTHING
+        self.assertIn('ON CONFLICT', self.queries[0].upper())
+        self.assertEqual(self.cat_cache.ensure(self.session, {'run': 'chores', 'walk': None}, default_cat='misc'), ['run', 'walk'])  # run : no error
+        self.assertEqual(self.cat_cache.unknown(self.session, ['nap']), set())  # (uncommitted, found in the db)
+        self.session.commit()
+        del self.queries[:]
+        self.assertEqual([self.cat_cache.get(self.session, _a) for _a in ('nap', 'swim', 'run', 'walk', 'nope')],
+                         ['misc', 'sport', 'sport', 'misc', None])
+        self.assertEqual(len(self.queries), 3)  # 1 per name not cached : run & walk (forgotten, as run was there already), & nope
+        self.session.add(s.ActvtyRec(day=dt.date(2019, 5, 1), startt=dt.time(9), endt=dt.time(10), a_done='nap'))
+        self.session.commit()
+
+    def test_follows_committed_changes_only(self):
+        self.cat_cache.load(self.session)
+        self.cat_cache.ensure(self.session, ['walk'])
+        self.session.add(s.ActvtyCat(a_done='bike', a_cat='sport'))
+        self.session.rollback()
+        self.assertNotIn('walk', self.cat_cache.cats)
+        self.assertNotIn('bike', self.cat_cache.cats)
+        self.session.add(s.ActvtyCat(a_done='bike', a_cat='sport'))
+        self.session.query(s.ActvtyCat).filter_by(a_done='email').one().a_cat = 'chores'
+        self.session.delete(self.session.query(s.ActvtyCat).filter_by(a_done='yoga').one())
+        self.session.commit()
+        self.assertEqual(self.cat_cache.cats, {'email': 'chores', 'bike': 'sport'})
+
+    def test_reloads_after_bulk_writes(self):
+        self.cat_cache.load(self.session)
+        self.session.query(s.ActvtyCat).filter(s.ActvtyCat.a_done == 'email').update({'a_cat': 'chores'}, synchronize_session=False)
+        self.session.query(s.ActvtyCat).filter(s.ActvtyCat.a_done == 'yoga').delete(synchronize_session=False)
+        self.assertEqual(self.cat_cache.cats, {'yoga': 'sport', 'email': 'work'})  # not committed yet
+        self.session.commit()
+        self.assertEqual(self.cat_cache.get(self.session, 'email'), 'chores')
+        self.assertIsNone(self.cat_cache.get(self.session, 'yoga'))
+        # Core statements aren't seen : the caller notes the reset
+        self.session.execute(s.ActvtyCat.__table__.update().values(a_cat='work'))
+        self.session.commit()
+        self.assertEqual(self.cat_cache.get(self.session, 'email'), 'chores')  # stale
+        self.session.execute(s.ActvtyCat.__table__.update().values(a_cat='work'))
+        bl.note_change(self.session, ('reset', bl.CategoryCache.key))
+        self.session.commit()
+        self.assertEqual(self.cat_cache.get(self.session, 'email'), 'work')
+
+
+class TestSearchActs(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        self.session = self.dal.session
+        self.session.add_all([s.ActvtyCat(a_done=_a, a_cat=_c) for _a, _c in (('hatha yoga', 'sport'), ('run', 'sport'), ('email', 'work'))])
+        self.session.flush()
+        for _i, (_a, _comments) in enumerate((('hatha yoga', 'morning'), ('run', 'yoga after'), ('email', 'NFI'), ('email', 'Crème brûlée'))):
+            self.session.add(s.ActvtyRec(day=dt.date(2019, 5, 1), startt=dt.time(_i), endt=dt.time(_i, 30), a_done=_a, comments=_comments))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.dal.dispose()
+
+    def search(self, keyedin_, **kw):
+        return [(_r[4], _r[5], _r[6]) for _r in bl.search_acts(self.session, keyedin_, **kw)]
+
+    def test_ranked_prefix_search(self):
+        self.assertEqual(self.search('yo'), [('hatha yoga', 'morning', 'sport'), ('run', 'yoga after', 'sport')])  # names weigh most
+        self.assertEqual(self.search('yo aft'), [('run', 'yoga after', 'sport')])  # all words
+        self.assertEqual(self.search('yoga', columns=['a_done']), [('hatha yoga', 'morning', 'sport')])
+        self.assertEqual(self.search('creme'), [('email', 'Crème brûlée', 'work')])  # diacritics / case insensitive
+        self.assertEqual([_r[0] for _r in self.search('wor')], ['email', 'email'])
+        self.assertEqual(len(self.search('wor', limit=1)), 1)
+        self.assertEqual(self.search('" OR *'), [])  # no words : no query syntax passed on
+        self.assertEqual(bl.search_act_names(self.session, 'yo'), [('hatha yoga', 1), ('run', 1)])
+
+    def test_follows_writes(self):
+        self.session.add(s.ActvtyCat(a_done='yoga', a_cat='sport'))
+        self.session.flush()
+        bl.collapse_acts(self.session, ['hatha yoga'], 'yoga')  # bulk UPDATE : old name moves to comments
+        self.session.query(s.ActvtyCat).filter(s.ActvtyCat.a_done == 'email').update({'a_cat': 'chores'}, synchronize_session=False)
+        self.session.query(s.ActvtyRec).filter(s.ActvtyRec.a_done == 'run').delete(synchronize_session=False)
+        self.session.commit()
+        self.assertEqual(self.search('hatha'), [('yoga', 'morning hatha yoga', 'sport')])
+        self.assertEqual(self.search('run'), [])
+        self.assertEqual(len(self.search('chores', columns=['a_cat'])), 2)
+        with self.dal.engine.begin() as conn:  # rebuilt, as by a migration, from the records
+            s.drop_search_index(s.Base.metadata, conn)
+            s.create_search_index(s.Base.metadata, conn)
+        self.assertEqual(self.search('hatha'), [('yoga', 'morning hatha yoga', 'sport')])
+
+
+class TestQuickRecord(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_url = 'sqlite:///' + os.path.join(self.tmp_dir.name, 'quick.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_ui_starts_without_db_modules(self):
+        code = "import sys, dr_ui ; print(sorted({'sqlalchemy', 'pandas', 'dateutil', 'myutil'} & set(sys.modules)))"
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.stdout.strip(), '[]', out.stderr)
+
+    def test_quick_record(self):
+        with self.assertRaises(bl.UnknownActivity):
+            ui.quick_record(self.db_url, 'yoga', '09:00', '10:00', '2019-05-01')
+        a_id = ui.quick_record(self.db_url, 'yoga', '09:00', '10:00', '2019-05-01', comments='hatha', a_cat='sport')
+        with self.assertRaises(ValueError):  # overlaps
+            ui.quick_record(self.db_url, 'yoga', '09:30', '10:30', '2019-05-01')
+        ui.quick_record(self.db_url, 'yoga', '09:30', '10:30', '2019-05-01', force=True)
+        qdal = s.DataAccessLayer(self.db_url)
+        qdal.connect()
+        with qdal.session_scope() as session:
+            self.assertEqual(session.get(s.ActvtyRec, a_id).comments, 'hatha')
+            self.assertEqual(session.query(s.ActvtyRollup.minutes).filter_by(a_done='yoga').scalar(), 120)
+        qdal.dispose()
+
+
+class TestColDefaults(unittest.TestCase):
+
+    def test_registry(self):
+        self.assertEqual(s.COL_DEFAULTS[s.ActvtyRec], {'comments': 'nfi'})
+        self.assertEqual(s.COL_DEFAULTS[s.ActvtyCat], {})
+
+    def test_mask(self):
+        values = ['NFI', 'nfi', 'NFI plus', None, 3]
+        self.assertEqual(bl.colvalues_are_default(s.ActvtyRec, 'comments', values), [True, True, False, False, False])
+        self.assertEqual(bl.colvalues_are_default(s.ActvtyRec, 'a_done', values), [False] * 5)
+        rows = [s.ActvtyRec(comments=_v) for _v in values]
+        self.assertEqual(bl.colvalues_are_default(s.ActvtyRec, 'comments', rows=rows), [True, True, False, False, False])
+        self.assertTrue(bl.colvalue_is_default(None, s.ActvtyRec, 'comments', rows[1]))
+
+
+class TestCollapseBulk(unittest.TestCase):
+    act_list = ['email', 'email hatha', 'mail']
+    comments = ['NFI', 'nfi', 'testing', 'NFI plus', 'x']
+
+    def make_session(self):
+        self.dal = dal = s.DataAccessLayer('sqlite://')
+        dal.connect()
+        dal.create_session()
+        d = dt.date(2019, 5, 1)
+        dal.session.add_all([s.ActvtyCat(a_done=_a, a_cat='work') for _a in self.act_list + ['Emailing', 'other']])
+        dal.session.add_all([s.ActvtyRec(day=d, startt=dt.time(_i // 60, _i % 60), endt=dt.time(_i // 60, _i % 60),
+                                         a_done=(self.act_list + ['other'])[_i % 4], comments=self.comments[_i % 5])
+                             for _i in range(40)])
+        dal.session.add(s.ActvtyRec(day=d, startt=dt.time(12), endt=dt.time(13), a_done='email'))  # default comments
+        dal.session.add(s.ActvtyRec(day=d, startt=dt.time(13), endt=dt.time(14), a_done='mail'))
+        dal.session.flush()
+        dal.session.execute("update act_recs set comments = NULL where startt = %d" % (13 * 3600))  # None would get the default
+        dal.session.commit()
+        return dal.session
+
+    def collapsed(self, bulk):
+        session = self.make_session()
+        loaded = session.query(s.ActvtyRec).filter(s.ActvtyRec.a_done == 'mail').first()
+        collapse_stats = bl.collapse_acts(session, self.act_list, 'Emailing', bulk=bulk)
+        self.assertEqual(loaded.a_done, 'Emailing')  # objects already in the session see the change
+        session.commit()
+        recs = [(_r.a_id, _r.a_done, _r.comments) for _r in session.query(s.ActvtyRec).order_by(s.ActvtyRec.a_id)]
+        session.close()
+        self.dal.dispose()
+        return collapse_stats, recs
+
+    def test_bulk_matches_orm(self):
+        orm_stats, orm_recs = self.collapsed(bulk=False)
+        bulk_stats, bulk_recs = self.collapsed(bulk=True)
+        self.assertEqual(bulk_stats, orm_stats)
+        self.assertEqual(bulk_recs, orm_recs)
+        self.assertEqual(orm_stats, (18, 14))
+        self.assertEqual(orm_recs[-1][1:], ('Emailing', 'mail'))  # NULL comments replaced, as the default
+
+
+class TestSuggestCollapses(unittest.TestCase):
+
+    def test_groups_near_duplicates(self):
+        name_counts = {'email': 5, 'emailing': 2, 'E-mail': 1, 'Email!': 1, 'run': 6, 'running': 2, 'sleep': 9,
+                       'yoga': 9, 'hatha yoga': 3, 'hatha yoga flow': 1, 'flow': 1}
+        self.assertEqual(bl.suggest_collapses(name_counts),  # 'flow' isn't chained to 'yoga' through 'hatha yoga flow'
+                         [(['hatha yoga', 'hatha yoga flow'], 'yoga'), (['emailing', 'Email!'], 'email')])
+        self.assertEqual(bl.suggest_collapses(name_counts, min_score=0.6),
+                         [(['emailing', 'E-mail', 'Email!'], 'email'), (['hatha yoga', 'hatha yoga flow'], 'yoga'), (['running'], 'run')])
+        self.assertEqual(bl.suggest_collapses(name_counts, min_score=1.),  # contained names only
+                         [(['hatha yoga', 'hatha yoga flow'], 'yoga'), (['Email!'], 'email')])
+
+    def test_feeds_collapse_acts(self):
+        dal = s.DataAccessLayer('sqlite://')
+        dal.connect()
+        d = dt.date(2019, 5, 1)
+        with dal.session_scope() as session:
+            session.add_all([s.ActvtyCat(a_done=_a, a_cat='sport') for _a in ('yoga', 'hatha yoga', 'Yoga nidra', 'Emailing')]
+                            + [s.ActvtyRec(day=d, startt=dt.time(10, _i), endt=dt.time(10, _i + 1), a_done=_a)
+                               for _i, _a in enumerate(['yoga', 'yoga', 'hatha yoga', 'Yoga nidra', 'Emailing'])])
+        with dal.session_scope() as session:
+            suggestions = bl.suggest_collapses(bl.search_names(session, s.ActvtyRec.a_done, ''))
+            self.assertEqual(suggestions, [(['Yoga nidra', 'hatha yoga'], 'yoga')])
+            for _act_list, _target in suggestions:
+                bl.collapse_acts(session, _act_list, _target)
+        with dal.session_scope() as session:
+            self.assertEqual(bl.search_names(session, s.ActvtyRec.a_done, ''), [('yoga', 4), ('Emailing', 1)])
+        dal.dispose()
+
+
+class TestImportActs(unittest.TestCase):
+    csv_lines = ["day,startt,endt,a_done,comments,a_cat",
+                 "2019-05-01,10:00,10:30,yoga,,sport",
+                 "2019-05-01,10:30:00,11:00,email,inbox zero,",
+                 "1 May 2019,7:05,7:10,yoga,,"]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        self.dal.session.add(s.ActvtyCat(a_done='email', a_cat='work'))
+        self.dal.session.commit()
+
+    def tearDown(self):
+        self.dal.session.close()
+        self.dal.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_import_csv(self):
+        path = os.path.join(self.tmp_dir.name, 'acts.csv')
+        with open(path, 'w') as csv_file:
+            csv_file.write("\n".join(self.csv_lines))
+        import_stats = bl.import_acts(self.dal.session, path, chunk_rows=2, default_cat='misc')
+        self.assertEqual((import_stats['rows'], import_stats['cats_added']), (3, 1))
+        recs = [(_r.day, _r.startt, _r.endt, _r.a_done, _r.comments) for _r in self.dal.session.query(s.ActvtyRec).order_by(s.ActvtyRec.a_id)]
+        self.assertEqual(recs, [(dt.date(2019, 5, 1), dt.time(10), dt.time(10, 30), 'yoga', 'NFI'),
+                                (dt.date(2019, 5, 1), dt.time(10, 30), dt.time(11), 'email', 'inbox zero'),
+                                (dt.date(2019, 5, 1), dt.time(7, 5), dt.time(7, 10), 'yoga', 'NFI')])
+        self.assertEqual(self.dal.session.query(s.ActvtyCat.a_cat).filter(s.ActvtyCat.a_done == 'yoga').scalar(), 'sport')
+
+    def test_import_rolls_back(self):
+        path = os.path.join(self.tmp_dir.name, 'acts.csv')
+        with open(path, 'w') as csv_file:
+            csv_file.write("\n".join(self.csv_lines + ["not a day,10:00,11:00,yoga,,"]))
+        with self.assertRaises(ValueError):
+            bl.import_acts(self.dal.session, path, chunk_rows=2)
+        self.assertEqual(self.dal.session.query(s.ActvtyRec).count(), 0)
+        self.assertEqual(self.dal.session.query(s.ActvtyCat).count(), 1)
+
+
+class TestExportActs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        self.dal.session.add_all([s.ActvtyCat(a_done='yoga', a_cat='sport'), s.ActvtyCat(a_done='email', a_cat='work')]
+                                 + [s.ActvtyRec(day=dt.date(2019, 5, _d), startt=dt.time(10 + _h, _d), endt=dt.time(10 + _h, 30), a_done=_a)
+                                    for _d in range(1, 6) for _h, _a in enumerate(('yoga', 'email'))])
+        self.dal.session.commit()
+
+    def tearDown(self):
+        self.dal.session.close()
+        self.dal.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_export(self):
+        try:
+            import pyarrow.parquet as pq
+            import pyarrow.ipc
+        except ImportError:
+            self.skipTest("pyarrow not installed")
+        path = os.path.join(self.tmp_dir.name, 'acts.parquet')
+        export_stats = bl.export_acts(self.dal.session, path, day_from=dt.date(2019, 5, 2), day_to=dt.date(2019, 5, 4), chunk_rows=4)
+        self.assertEqual(export_stats['rows'], 6)
+        table = pq.read_table(path)
+        self.assertEqual(table.column('day').to_pylist()[:2], [dt.date(2019, 5, 2)] * 2)
+        self.assertEqual(table.column('startt').to_pylist()[0], dt.time(10, 2))
+        self.assertEqual(table.column('a_cat').to_pylist()[:2], ['sport', 'work'])
+
+        path = os.path.join(self.tmp_dir.name, 'acts.arrow')
+        bl.export_acts(self.dal.session, path, a_cat='work', chunk_rows=4)
+        table = pyarrow.ipc.open_file(path).read_all()
+        self.assertEqual(table.column('a_done').to_pylist(), ['email'] * 5)
+        self.assertEqual(str(table.schema.field('endt').type), 'time32[s]')
+
+
+def prep_usage_db(session):
+    session.add_all([s.ActvtyCat(a_done='sleep', a_cat='rest'), s.ActvtyCat(a_done='yoga', a_cat='sport'),
+                     s.ActvtyCat(a_done='run', a_cat='sport'), s.ActvtyCat(a_done='nap', a_cat=None)])
+    session.add_all([s.ActvtyRec(day=dt.date(2019, 4, 30), startt=dt.time(23), endt=dt.time(7), a_done='sleep'),  # crosses midnight
+                     s.ActvtyRec(day=dt.date(2019, 5, 1), startt=dt.time(8), endt=dt.time(9, 30), a_done='yoga'),
+                     s.ActvtyRec(day=dt.date(2019, 5, 6), startt=dt.time(8), endt=dt.time(8, 45), a_done='run'),
+                     s.ActvtyRec(day=dt.date(2019, 5, 6), startt=dt.time(14), endt=dt.time(14, 20), a_done='nap'),
+                     s.ActvtyRec(day=dt.date(2019, 5, 6), startt=dt.time(22), endt=dt.time(0), a_done='sleep')])
+    session.commit()
+
+
+class TestTimeUsage(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        prep_usage_db(self.dal.session)
+
+    def tearDown(self):
+        self.dal.session.close()
+        self.dal.dispose()
+
+    def test_totals(self):
+        self.assertEqual(rep.time_usage(self.dal.session).to_dict(), {'rest': 600, 'sport': 135, '(none)': 20})
+        self.assertEqual(rep.time_usage(self.dal.session, by='a_done', day_from=dt.date(2019, 5, 1)).to_dict(),
+                         {'sleep': 540, 'yoga': 90, 'run': 45, 'nap': 20})
+
+    def test_periods(self):
+        weekly = rep.time_usage(self.dal.session, by='a_done', period='week')
+        self.assertEqual(list(weekly.items()), [((pd.Timestamp(2019, 4, 29), 'sleep'), 480), ((pd.Timestamp(2019, 4, 29), 'yoga'), 90),
+                                                ((pd.Timestamp(2019, 5, 6), 'sleep'), 120), ((pd.Timestamp(2019, 5, 6), 'run'), 45),
+                                                ((pd.Timestamp(2019, 5, 6), 'nap'), 20)])
+        monthly = rep.time_usage(self.dal.session, period='month', day_to=dt.date(2019, 4, 30))
+        self.assertEqual(monthly.to_dict(), {(pd.Timestamp(2019, 4, 1), 'rest'): 60})
+
+    def test_dayless_records_left_out(self):
+        self.dal.session.add_all([s.ActvtyRec(day=None, startt=dt.time(23), endt=dt.time(1), a_done='yoga'),
+                                  s.ActvtyRec(day=dt.date(2019, 5, 2), startt=dt.time(23), endt=None, a_done='yoga')])
+        self.dal.session.commit()
+        for _use_rollups in (True, False):
+            self.assertEqual(rep.time_usage(self.dal.session, use_rollups=_use_rollups).to_dict(), {'rest': 600, 'sport': 135, '(none)': 20})
+
+
+class TestActSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        self.session = self.dal.session
+        prep_usage_db(self.session)
+        self.snapshot = rep.ActSnapshot().refresh(self.session)
+
+    def tearDown(self):
+        self.snapshot.close()
+        self.session.close()
+        self.dal.dispose()
+
+    def assertSameAsDb(self):
+        by_day = ['day', 'start_min', 'a_done']
+        expected = rep.fetch_intervals(self.session).sort_values(by_day, ignore_index=True)
+        got = self.snapshot.refresh(self.session).intervals().sort_values(by_day, ignore_index=True)
+        pd.testing.assert_frame_equal(got, expected, check_dtype=False)  # (object vs string columns)
+        for by in rep.GROUP_BYS:
+            self.assertTrue(rep.time_usage(self.session, by, 'week', use_rollups=False, snapshot=self.snapshot)
+                            .equals(rep.time_usage(self.session, by, 'week', use_rollups=False)))
+
+    def test_compact_columns(self):
+        self.assertEqual({_col: self.snapshot.column(_col).dtype.itemsize for _col in rep.SNAPSHOT_COLUMNS},
+                         {'a_id': 8, 'day': 4, 'start_min': 2, 'end_min': 2, 'a_done': 4})
+        self.assertEqual(self.snapshot.nbytes, 20 * self.snapshot.n)
+        self.assertSameAsDb()
+
+    def test_follows_changes(self):
+        reads = self.snapshot.stats['rows_read']
+        self.snapshot.refresh(self.session)
+        self.assertEqual(self.snapshot.stats['rows_read'], reads)  # nothing new : nothing read
+        self.session.add(s.ActvtyCat(a_done='stretch', a_cat='sport'))
+        self.session.add(s.ActvtyRec(day=dt.date(2019, 5, 9), startt=dt.time(7), endt=dt.time(7, 30), a_done='stretch'))
+        self.session.commit()
+        self.assertSameAsDb()
+        self.assertEqual(self.snapshot.stats['rows_read'], reads + 1)
+        bl.collapse_acts(self.session, ['yoga', 'run'], 'stretch')  # bulk : renamed in the snapshot, not read
+        self.session.commit()
+        self.assertSameAsDb()
+        self.assertEqual((self.snapshot.stats['rows_read'], self.snapshot.stats['renames']), (reads + 1, 1))
+        first, last = [self.session.query(s.ActvtyRec).order_by(_order).first() for _order in (s.ActvtyRec.a_id, s.ActvtyRec.a_id.desc())]
+        first.endt = dt.time(23, 59)
+        self.session.delete(last)  # sqlite gives its a_id to the next record
+        self.session.query(s.ActvtyCat).filter_by(a_done='sleep').one().a_cat = 'night'
+        self.session.commit()
+        self.session.add(s.ActvtyRec(day=dt.date(2019, 5, 10), startt=dt.time(7), endt=dt.time(8), a_done='stretch'))
+        self.session.commit()
+        self.assertSameAsDb()
+
+    def test_bulk_category_changes(self):
+        self.session.query(s.ActvtyCat).filter(s.ActvtyCat.a_cat == 'sport').update({'a_cat': 'chores'}, synchronize_session=False)
+        self.session.commit()
+        self.assertSameAsDb()
+        self.session.query(s.ActvtyCat).filter_by(a_done='sleep').update({'a_cat': None}, synchronize_session=False)
+        self.session.commit()
+        self.assertSameAsDb()
+        self.assertEqual(self.snapshot.stats['rows_reread'], 0)  # categories only : no records read again
+
+
+class TestParallelTimeUsage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_url = 'sqlite:///' + os.path.join(self.tmp_dir.name, 'usage.db')
+        self.dal = s.DataAccessLayer(self.db_url)
+        self.dal.connect()
+        self.dal.create_session()
+        prep_usage_db(self.dal.session)
+        self.dal.session.add(s.ActvtyRec(day=dt.date(2019, 5, 10), startt=dt.time(23), endt=dt.time(6), a_done='sleep'))
+        self.dal.session.commit()
+
+    def tearDown(self):
+        self.dal.session.close()
+        self.dal.dispose()
+        s.dispose_engine(self.db_url, profile=s.READ_ONLY_PROFILE)
+        self.tmp_dir.cleanup()
+
+    def test_day_partitions(self):
+        self.assertEqual(rep.day_partitions(dt.date(2019, 5, 1), dt.date(2019, 5, 5), 2),
+                         [(dt.date(2019, 5, 1), dt.date(2019, 5, 2)), (dt.date(2019, 5, 3), dt.date(2019, 5, 5))])
+        self.assertEqual(len(rep.day_partitions(dt.date(2019, 5, 1), dt.date(2019, 5, 2), 8)), 2)
+
+    def test_same_as_one_process(self):
+        # 6 partitions of 11 days : records crossing midnight into the next partition, & past the last day
+        cases = [('a_cat', None, None, None), ('a_done', 'week', None, None), ('a_done', 'day', dt.date(2019, 5, 1), dt.date(2019, 5, 10))]
+        for by, period, day_from, day_to in cases:
+            expected = rep.time_usage(self.dal.session, by, period, day_from, day_to, use_rollups=False)
+            got = rep.parallel_time_usage(self.db_url, by, period, day_from, day_to, workers=2, partitions_per_worker=3)
+            pd.testing.assert_series_equal(got, expected)
+        with self.assertRaises(ValueError):
+            rep.parallel_time_usage('sqlite://')
+        reader = s.DataAccessLayer(self.db_url, profile=s.READ_ONLY_PROFILE)  # as the workers'
+        reader.connect()
+        with self.assertRaises(exc.OperationalError):
+            with reader.session_scope() as session:
+                session.add(s.ActvtyCat(a_done='stretch', a_cat='sport'))
+
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_url = 'sqlite:///' + os.path.join(self.tmp_dir.name, 'usage.db')
+        self.dal = s.DataAccessLayer(self.db_url)
+        self.dal.connect()
+        self.dal.create_session()
+        prep_usage_db(self.dal.session)
+        self.dal.session.add_all([s.ActvtyRec(day=dt.date(2018, 12, 31), startt=dt.time(23), endt=dt.time(1), a_done='sleep'),
+                                  s.ActvtyRec(day=dt.date(2020, 2, 1), startt=dt.time(9), endt=dt.time(10), a_done='yoga')])
+        self.dal.session.commit()
+        self.counts = dp.split_db(self.db_url, os.path.join(self.tmp_dir.name, 'parts'))
+        self.pdal = dp.PartitionedDataAccessLayer(os.path.join(self.tmp_dir.name, 'parts'))
+        self.pdal.connect()
+
+    def tearDown(self):
+        self.dal.session.close()
+        self.dal.dispose()
+        self.pdal.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_split_and_read(self):
+        self.assertEqual(self.counts, {2018: 1, 2019: 5, 2020: 1, None: 0})
+        self.assertEqual(self.pdal.years(), [2018, 2019, 2020])
+        self.assertEqual(self.pdal.years(dt.date(2019, 5, 1), dt.date(2019, 5, 31)), [2019])
+        rec, cat = s.ActvtyRec, s.ActvtyCat
+        expected = (self.dal.session.query(rec.a_id, rec.day, rec.startt, rec.endt, rec.a_done, rec.comments, cat.a_cat)
+                    .outerjoin(cat, rec.a_done == cat.a_done).order_by(rec.day, rec.startt).all())
+        self.assertEqual([tuple(_r) for _r in self.pdal.fetch_recs()], [tuple(_r) for _r in expected])
+        self.assertEqual([_r.a_id for _r in self.pdal.fetch_recs(dt.date(2019, 5, 6), dt.date(2020, 12, 31))], [3, 4, 5, 7])
+        with self.pdal.session_scope() as session:  # the rollups are in the catalog
+            self.assertTrue(rep.time_usage(session, 'a_done', 'month').equals(rep.time_usage(self.dal.session, 'a_done', 'month')))
+
+    def test_record_routed_by_day(self):
+        self.pdal.record([{'day': dt.date(2021, 1, 1), 'startt': dt.time(8), 'endt': dt.time(9), 'a_done': 'run'},
+                          {'day': dt.date(2019, 5, 7), 'startt': dt.time(8), 'endt': dt.time(9), 'a_done': 'run'}])
+        self.assertEqual(self.pdal.years(), [2018, 2019, 2020, 2021])
+        self.assertEqual([_r.a_id for _r in self.pdal.fetch_recs(dt.date(2021, 1, 1))], [2021 * dp.A_ID_SPAN + 1])
+        self.assertEqual([_r.a_id for _r in self.pdal.fetch_recs(dt.date(2019, 5, 7), dt.date(2019, 5, 7))], [2019 * dp.A_ID_SPAN + 1])
+        with self.pdal.session_scope() as session:
+            self.assertEqual(rep.time_usage(session, 'a_done', day_from=dt.date(2019, 5, 7)).to_dict(), {'run': 120, 'yoga': 60})
+        with self.assertRaises(bl.UnknownActivity):
+            self.pdal.record([{'day': dt.date(2022, 1, 1), 'startt': dt.time(8), 'endt': dt.time(9), 'a_done': 'bogus'}])
+        self.assertEqual(self.pdal.years(), [2018, 2019, 2020, 2021])
+
+
+class TestTableCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dal = s.DataAccessLayer('sqlite:///' + os.path.join(self.tmp_dir.name, 'copy.db'))
+        self.dal.connect()
+        self.dal.create_session()
+        prep_usage_db(self.dal.session)
+
+    def tearDown(self):
+        self.dal.session.close()
+        self.dal.dispose()
+        self.tmp_dir.cleanup()
+
+    def schema(self):
+        return self.dal.session.execute("SELECT type, name FROM sqlite_master WHERE tbl_name = 'act_recs' ORDER BY name").fetchall()
+
+    def test_resumes_and_recopies_changed_rows(self):
+        schema, calls = self.schema(), []
+
+        def _transform(row):
+            calls.append(row['a_id'])
+            if len(calls) == 3:
+                raise KeyboardInterrupt  # eg Ctrl-C during the 2nd batch
+            return dict(row, comments=row['comments'].lower())
+        with self.assertRaises(KeyboardInterrupt):
+            dm.TableCopy(self.dal.engine, s.ActvtyRec.__table__, transform=_transform, batch_rows=2, progress=None).run()
+        session = self.dal.session
+        self.assertEqual(session.execute("SELECT last_key, rows FROM dr_migrate_checkpoints").fetchall(), [(2, 2)])
+        session.query(s.ActvtyRec).filter(s.ActvtyRec.a_id == 1).update({'comments': 'Moved'})  # already copied : logged
+        session.query(s.ActvtyRec).filter(s.ActvtyRec.a_id == 2).delete()
+        session.commit()
+        stats = dm.TableCopy(self.dal.engine, s.ActvtyRec.__table__, transform=_transform, batch_rows=2, progress=None).run()
+        self.assertEqual((stats['rows'], stats['recopied']), (5, 2))
+        self.assertEqual(session.execute("SELECT a_id, comments FROM act_recs ORDER BY a_id").fetchall(),
+                         [(1, 'moved'), (3, 'nfi'), (4, 'nfi'), (5, 'nfi')])
+        self.assertEqual(self.schema(), schema)  # indexes & the act_search triggers are back
+        self.assertFalse(session.execute("SELECT name FROM sqlite_master WHERE name LIKE 'dr_migrate%'").fetchall())
+        session.add(s.ActvtyRec(day=dt.date(2019, 5, 7), startt=dt.time(8), endt=dt.time(9), a_done='yoga', comments='after'))
+        session.commit()
+        self.assertEqual([_r[5] for _r in bl.search_acts(session, 'after')], ['after'])
+
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        prep_usage_db(self.dal.session)
+
+    def tearDown(self):
+        self.dal.session.close()
+        self.dal.dispose()
+
+    def rollups(self):
+        roll = s.ActvtyRollup
+        return [(_r.day, _r.a_done, _r.minutes, _r.rec_count) for _r in self.dal.session.query(roll).order_by(roll.day, roll.a_done)]
+
+    def assert_rollups_match_records(self):
+        maintained = self.rollups()
+        bl.rebuild_rollups(self.dal.session)
+        self.assertEqual(maintained, self.rollups())
+        for _period in (None, 'day'):
+            self.assertEqual(rep.time_usage(self.dal.session, 'a_done', _period).to_dict(),
+                             rep.time_usage(self.dal.session, 'a_done', _period, use_rollups=False).to_dict())
+
+    def test_maintained_on_insert(self):
+        self.assertEqual(self.rollups()[:2], [(dt.date(2019, 4, 30), 'sleep', 60, 1), (dt.date(2019, 5, 1), 'sleep', 420, 0)])
+        self.assert_rollups_match_records()
+
+    def test_maintained_on_collapse(self):
+        for _bulk in (False, True):
+            bl.collapse_acts(self.dal.session, ['yoga', 'run'] if _bulk else ['sleep', 'nap'], 'yoga', bulk=_bulk)
+            self.dal.session.commit()
+            self.assert_rollups_match_records()
+        self.assertEqual({_a for _d, _a, _m, _c in self.rollups()}, {'yoga'})
+
+    def test_maintained_on_update_delete(self):
+        first = self.dal.session.query(s.ActvtyRec).order_by(s.ActvtyRec.a_id).first()
+        first.endt = dt.time(6)
+        self.dal.session.commit()
+        self.assert_rollups_match_records()
+        self.dal.session.delete(first)
+        self.dal.session.commit()
+        self.assert_rollups_match_records()
+        self.assertEqual(self.rollups()[0], (dt.date(2019, 5, 1), 'yoga', 90, 1))
+
+    def test_dayless_records_have_no_rollups(self):
+        maintained = self.rollups()
+        dayless = s.ActvtyRec(day=None, startt=dt.time(23), endt=dt.time(1), a_done='yoga')
+        self.dal.session.add(dayless)
+        self.dal.session.commit()
+        self.assertEqual(self.rollups(), maintained)
+        self.assertEqual(bl.rebuild_rollups(self.dal.session), len(maintained))
+        self.assertEqual(self.rollups(), maintained)
+        dayless.startt = dt.time(22)
+        self.dal.session.commit()
+        self.dal.session.delete(dayless)
+        self.dal.session.commit()
+        self.assertEqual(self.rollups(), maintained)
+
+
+class TestOverlaps(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = s.DataAccessLayer('sqlite://')
+        self.dal.connect()
+        self.dal.create_session()
+        prep_usage_db(self.dal.session)  # non overlapping, incl 2 crossing midnight
+
+    def tearDown(self):
+        self.dal.session.close()
+        self.dal.dispose()
+
+    def overlapping(self, day, startt, endt):
+        return [_r.a_done for _r in bl.find_overlaps(self.dal.session, day, startt, endt)]
+
+    def test_find_overlaps(self):
+        self.assertEqual(self.overlapping(dt.date(2019, 5, 1), dt.time(6), dt.time(8, 30)), ['sleep', 'yoga'])  # sleep started the day before
+        self.assertEqual(self.overlapping(dt.date(2019, 5, 1), dt.time(7), dt.time(8)), [])  # touching only
+        self.assertEqual(self.overlapping(dt.date(2019, 5, 5), dt.time(23), dt.time(8, 1)), ['run'])  # crosses into next day
+        self.assertEqual(self.overlapping(dt.date(2019, 5, 6), dt.time(23), dt.time(1)), ['sleep'])
+
+    def test_scan_overlaps(self):
+        self.assertEqual(bl.scan_overlaps(self.dal.session), [])
+        self.dal.session.add_all([s.ActvtyRec(day=dt.date(2019, 5, 1), startt=dt.time(6, 59), endt=dt.time(8, 1), a_done='nap'),
+                                  s.ActvtyRec(day=dt.date(2019, 5, 6), startt=dt.time(23, 30), endt=dt.time(23, 45), a_done='nap')])
+        self.dal.session.commit()
+        ids = {(_r.day, _r.startt): _r.a_id for _r in self.dal.session.query(s.ActvtyRec)}
+        self.assertEqual(sorted(bl.scan_overlaps(self.dal.session)),
+                         sorted([(ids[(dt.date(2019, 4, 30), dt.time(23))], ids[(dt.date(2019, 5, 1), dt.time(6, 59))]),
+                                 (ids[(dt.date(2019, 5, 1), dt.time(6, 59))], ids[(dt.date(2019, 5, 1), dt.time(8))]),
+                                 (ids[(dt.date(2019, 5, 6), dt.time(22))], ids[(dt.date(2019, 5, 6), dt.time(23, 30))])]))
+
+    def test_dayless_records_left_out(self):
+        self.dal.session.add(s.ActvtyRec(day=None, startt=dt.time(6), endt=dt.time(9), a_done='nap'))
+        self.dal.session.commit()
+        self.assertEqual(bl.scan_overlaps(self.dal.session), [])
+        self.assertEqual(self.overlapping(dt.date(2019, 5, 1), dt.time(8), dt.time(9)), ['yoga'])
+
+
+class TestAsyncDAL(unittest.TestCase):
+
+    async def concurrent_clients(self, db_url):
+        adal = da.AsyncDataAccessLayer(db_url)
+        await adal.connect()
+        await adal.write(lambda _session: _session.add_all([s.ActvtyCat(a_done='yoga %d' % _i, a_cat='sport') for _i in range(3)]))
+        day = dt.date(2019, 5, 1)
+        ids = await asyncio.gather(*[da.record_act(adal, day, dt.time(_m // 60, _m % 60), dt.time(_m // 60, _m % 60, 30), 'yoga %d' % (_m % 3))
+                                     for _m in range(30)])
+        self.assertEqual(len(set(ids)), 30)
+        found = await asyncio.gather(*[da.search_names(adal, s.ActvtyRec.a_done, 'yoga') for _ in range(4)])
+        self.assertEqual(found, [[('yoga 0', 10), ('yoga 1', 10), ('yoga 2', 10)]] * 4)
+        with self.assertRaises(exc.IntegrityError):  # rolled back, & the writer carries on
+            await da.record_act(adal, day, dt.time(12), dt.time(13), 'uncategorised')
+        self.assertEqual(await da.collapse_acts(adal, ['yoga 1', 'yoga 2'], 'yoga 0'), (0, 20))
+        self.assertEqual(await da.search_names(adal, s.ActvtyRec.a_done, 'yoga'), [('yoga 0', 30)])
+        await adal.close()
+
+    def test_file_db(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            asyncio.run(self.concurrent_clients('sqlite:///' + os.path.join(tmp_dir, 'async.db')))
+
+    def test_memory_db(self):
+        asyncio.run(self.concurrent_clients('sqlite://'))
+
+
+class TestBufferedRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dal = s.DataAccessLayer('sqlite:///' + os.path.join(self.tmp_dir.name, 'buffered.db'))
+        self.dal.connect()
+        with self.dal.session_scope() as session:
+            session.add(s.ActvtyCat(a_done='run', a_cat='sport'))
+
+    def tearDown(self):
+        self.dal.dispose()
+        self.tmp_dir.cleanup()
+
+    def rec(self, minute, a_done='run'):
+        return s.ActvtyRec(day=dt.date(2019, 5, 1), startt=dt.time(minute // 60, minute % 60), endt=dt.time(minute // 60, minute % 60, 30),
+                           a_done=a_done)
+
+    def test_group_commits_by_size_and_flush(self):
+        recorder = bl.BufferedRecorder(self.dal, max_rows=20, flush_secs=10)
+        futures = [recorder.record(self.rec(_m)) for _m in range(50)]
+        recorder.flush()
+        self.assertTrue(all(_f.done() for _f in futures))
+        self.assertEqual(len({_f.result() for _f in futures}), 50)
+        self.assertEqual((recorder.stats['commits'], recorder.stats['rows']), (3, 50))  # 20 + 20 + 10 (flushed)
+        with self.dal.session_scope() as session:
+            self.assertEqual(session.query(func.sum(s.ActvtyRollup.rec_count), func.sum(s.ActvtyRollup.minutes)).one(), (50, 0))
+        recorder.close()
+        with self.assertRaises(RuntimeError):
+            recorder.record(self.rec(60))
+        with self.assertRaises(RuntimeError):  # rather than waiting forever on the stopped writer
+            recorder.flush()
+
+    def test_flush_on_interval_and_close(self):
+        recorder = bl.BufferedRecorder(self.dal, max_rows=1000, flush_secs=0.05)
+        self.assertIsInstance(recorder.record(self.rec(0)).result(timeout=5), int)
+        recorder.flush_secs = 10
+        future = recorder.record(self.rec(1))
+        recorder.close()
+        self.assertTrue(future.done())
+        with self.dal.session_scope() as session:
+            self.assertEqual(session.query(s.ActvtyRec).count(), 2)
+
+    def test_missing_cats_and_bad_records(self):
+        recorder = bl.BufferedRecorder(self.dal, flush_secs=10, default_cat='tracked')
+        ok = recorder.submit([self.rec(0, 'walk'), self.rec(1, 'walk'), self.rec(2, 'bike')])
+        clash = recorder.record(self.rec(0))  # same day & startt as above
+        recorder.close()
+        self.assertEqual(len(ok.result()), 3)
+        with self.assertRaises(exc.IntegrityError):
+            clash.result()
+        with self.dal.session_scope() as session:
+            self.assertEqual(sorted(session.query(s.ActvtyCat.a_done).filter_by(a_cat='tracked')), [('bike',), ('walk',)])
+
+        recorder = bl.BufferedRecorder(self.dal, flush_secs=10, add_missing=False)
+        unknown, ok = recorder.submit([self.rec(10), self.rec(11, 'swim')]), recorder.record(self.rec(12))
+        recorder.close()
+        with self.assertRaises(bl.UnknownActivity):
+            unknown.result()
+        self.assertIsInstance(ok.result(), int)
+        self.assertEqual((recorder.stats['commits'], recorder.stats['rejected']), (1, 2))
+
+    def test_unknown_activity_and_clash_in_one_group(self):
+        recorder = bl.BufferedRecorder(self.dal, flush_secs=10, add_missing=False)
+        first = recorder.record(self.rec(0))
+        recorder.flush()
+        unknown, clash, ok = recorder.record(self.rec(1, 'swim')), recorder.record(self.rec(0)), recorder.record(self.rec(2))
+        recorder.flush(timeout=5)  # the writer survived the group
+        with self.assertRaises(bl.UnknownActivity):
+            unknown.result()
+        with self.assertRaises(exc.IntegrityError):
+            clash.result()
+        self.assertIsInstance(ok.result(), int)
+        self.assertEqual(recorder.stats['rejected'], 2)  # once each
+        later = recorder.record(self.rec(3))
+        recorder.flush(timeout=5)
+        self.assertIsInstance(later.result(), int)
+        recorder.close()
+        self.assertIsInstance(first.result(), int)
+
+
+class TestApiServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dal = s.DataAccessLayer('sqlite:///' + os.path.join(self.tmp_dir.name, 'api.db'))
+        self.dal.connect()
+        with self.dal.session_scope() as session:
+            session.add_all([s.ActvtyCat(a_done=_a, a_cat='sport') for _a in ('yoga', 'hatha yoga', 'run')])
+        self.server = srv.ApiServer(('127.0.0.1', 0), self.dal, batch_wait=0.05)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.dal.dispose()
+        self.tmp_dir.cleanup()
+
+    def call(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request('http://127.0.0.1:%d%s' % (self.server.server_port, path), data=data, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as err:
+            return err.code, json.loads(err.read())
+
+    def test_record_search_collapse(self):
+        acts = [{'day': '2019-05-01', 'startt': '%02d:00' % _h, 'endt': '%02d:30' % _h, 'a_done': 'hatha yoga' if _h % 2 else 'yoga'}
+                for _h in range(8, 12)]
+        status, body = self.call('POST', '/acts', acts[:3])
+        self.assertEqual((status, len(body['a_ids'])), (201, 3))
+        status, body = self.call('POST', '/acts', dict(acts[3], comments='sun salutes'))
+        self.assertEqual((status, len(body['a_ids'])), (201, 1))
+        self.assertEqual(self.call('GET', '/names?q=yoga'), (200, {'names': [['hatha yoga', 2], ['yoga', 2]]}))
+        self.assertEqual(self.call('GET', '/names?q=sp&column=a_cat'), (200, {'names': [['sport', 3]]}))
+        self.assertEqual(self.call('POST', '/collapse', {'act_list': ['hatha yoga'], 'updated_actvty_name': 'yoga'}),
+                         (200, {'num_concated': 1, 'num_replaced': 1}))
+        self.assertEqual(self.call('GET', '/names?q=yoga')[1], {'names': [['yoga', 4]]})
+
+    def test_batched_writes_and_errors(self):
+        results = [None] * 10
+
+        def _post(i):
+            results[i] = self.call('POST', '/acts', {'day': '2019-05-02', 'startt': '%02d:00' % i, 'endt': '%02d:10' % i,
+                                                     'a_done': 'unknown' if i == 3 else 'run'})
+        threads = [threading.Thread(target=_post, args=(_i,)) for _i in range(10)]
+        for _th in threads:
+            _th.start()
+        for _th in threads:
+            _th.join()
+        self.assertEqual([_r[0] for _r in results], [201] * 3 + [409] + [201] * 6)  # the bad request fails alone
+        self.assertEqual(self.call('GET', '/names?q=run')[1], {'names': [['run', 9]]})
+        self.assertEqual(self.call('POST', '/acts', {'day': '2019-05-02', 'startt': 'soon'})[0], 400)
+        self.assertEqual(self.call('POST', '/acts', {'day': 'someday', 'startt': '10:00', 'endt': '11:00', 'a_done': 'run'})[0], 400)
+        self.assertEqual(self.call('GET', '/names?column=comments')[0], 400)
+        self.assertEqual(self.call('GET', '/acts')[0], 404)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=3)  # run all the tests defined in child of unittest.TestCase